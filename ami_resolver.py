@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+import botocore
+import aws_session
+from json_files import atomic_write_json
+from multiprocessing.pool import ThreadPool
+
+
+# SSM public parameter that always holds the latest Amazon Linux 2023 AMI ID
+#     for a region
+AMI_PARAMETER = '/aws/service/ami-amazon-linux-latest/al2023-ami-kernel-default-x86_64'
+
+# Cloud Formation dynamic reference to the same parameter, which Cloud
+#     Formation resolves in the Stack's region when the Stack is built
+AMI_PARAMETER_REFERENCE = '{{resolve:ssm:%s}}' % AMI_PARAMETER
+
+# describe_images filters for the same image, used when SSM cannot be read
+#     (the minimal AMIs are named "al2023-ami-minimal-...")
+AMI_OWNER = 'amazon'
+AMI_NAME_PATTERN = 'al2023-ami-2023.*-kernel-*-x86_64'
+
+# Seconds a resolved AMI ID is reused before it is looked up again
+DEFAULT_TTL = 24 * 60 * 60
+
+# Most regions that are looked up at the same time
+MAX_CONCURRENT_LOOKUPS = 8
+
+
+class AmiResolutionError(Exception):
+    """ Raised when the AMI for a region cannot be looked up """
+
+
+class AmiCache(object):
+    """ On-disk record of resolved AMI IDs per region, each with a TTL
+
+    A missing or unreadable cache file is treated as empty, and failures to
+    write it are ignored.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def get(self, region):
+        """ Return the cached AMI ID for the region, or None if missing or expired """
+
+        with self._lock:
+            entry = self._load().get(region)
+            if entry is None or self.clock() - entry['resolved_at'] > self.ttl:
+                return None
+            return entry['image_id']
+
+    def put(self, region, image_id, source):
+        with self._lock:
+            entries = self._load()
+            entries[region] = {
+                'image_id': image_id,
+                'resolved_at': self.clock(),
+                'source': source
+            }
+            self._save(entries)
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as cache_file:
+                    self._entries = dict(json.load(cache_file).get('regions', {}))
+            except (IOError, OSError, ValueError, AttributeError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self, entries):
+        try:
+            atomic_write_json(self.path, {'regions': entries}, indent=2, sort_keys=True)
+        except (IOError, OSError):
+            # The cache is only an optimization, so never fail the run over it
+            pass
+
+
+class AmiResolver(object):
+    """ Looks up the current Amazon Linux 2023 AMI ID for any AWS Region
+
+    The SSM public parameter is read first; if that fails (e.g., the
+    credentials may not call SSM) the newest matching image is found with
+    EC2 describe_images instead.  Results are kept in an AmiCache, and
+    several regions are looked up concurrently by resolve_all().
+    """
+
+    def __init__(self, cache_path, ttl=DEFAULT_TTL, clock=time.time):
+        self.cache = AmiCache(cache_path, ttl, clock)
+
+    def resolve(self, id, secret, region):
+        """ Return the AMI ID for the region, from the cache when it is fresh """
+
+        image_id = self.cache.get(region)
+        if image_id is None:
+            image_id, source = self._lookup(id, secret, region)
+            self.cache.put(region, image_id, source)
+        return image_id
+
+    def resolve_all(self, id, secret, regions):
+        """ Return a dict of region to AMI ID, looking regions up concurrently
+
+        Raises AmiResolutionError naming every region that failed.
+        """
+
+        regions = sorted(set(regions))
+        missing = [region for region in regions if self.cache.get(region) is None]
+        if missing:
+            pool = ThreadPool(min(len(missing), MAX_CONCURRENT_LOOKUPS))
+            try:
+                results = pool.map(lambda region: self._try_resolve(id, secret, region),
+                                   missing)
+            finally:
+                pool.close()
+                pool.join()
+            errors = [error for error in results if error is not None]
+            if errors:
+                raise AmiResolutionError('; '.join(errors))
+        return dict((region, self.resolve(id, secret, region)) for region in regions)
+
+    def _try_resolve(self, id, secret, region):
+        try:
+            self.resolve(id, secret, region)
+        except AmiResolutionError, err:
+            return str(err)
+        return None
+
+    def _lookup(self, id, secret, region):
+        try:
+            client = aws_session.get_client('ssm', region, id, secret)
+            response = client.get_parameter(Name=AMI_PARAMETER)
+            return response['Parameter']['Value'], 'ssm'
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError), err:
+            ssm_error = err
+
+        try:
+            client = aws_session.get_client('ec2', region, id, secret)
+            # AWS deprecates images after a while, and a region may only
+            #     have deprecated ones left
+            response = client.describe_images(
+                Owners=[AMI_OWNER],
+                IncludeDeprecated=True,
+                Filters=[
+                    {'Name': 'name', 'Values': [AMI_NAME_PATTERN]},
+                    {'Name': 'state', 'Values': ['available']}
+                ])
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError), err:
+            raise AmiResolutionError('Could not look up the AMI for "%s": %s; %s' %
+                                     (region, ssm_error, err))
+        if not response['Images']:
+            raise AmiResolutionError('No "%s" image was found in "%s"' %
+                                     (AMI_NAME_PATTERN, region))
+        newest = max(response['Images'], key=lambda image: image['CreationDate'])
+        return newest['ImageId'], 'describe_images'
@@ -0,0 +1,73 @@
+import argparse
+import json
+import sys
+from provision_awscloud_webserver_env import TIMINGS_FILE
+from template_graph import analyze_template, format_analysis, read_timings, timing_durations
+
+
+def parse_args_and_run(args=None):
+    """ Parse command line arguments and analyze a rendered Template's dependencies """
+
+    parser = argparse.ArgumentParser(
+                          description='Reports how much of a Cloud Formation Template can be '\
+                                      'built in parallel, offline.')
+
+    parser.add_argument(
+        '-t',
+        '--template',
+        required=True,
+        help='Template JSON file to analyze (e.g., written with --render_only), or '\
+             '"-" for stdin'
+    )
+    parser.add_argument(
+        '-w',
+        '--weighted',
+        action='store_true',
+        help='Weight each resource with its median creation time from past runs '\
+             'in --timings_file instead of counting levels'
+    )
+    parser.add_argument(
+        '--timings_file',
+        default=TIMINGS_FILE,
+        help='JSON lines file of past phase and resource timings (default is "%s")' %
+             TIMINGS_FILE
+    )
+    parser.add_argument(
+        '--report',
+        help='File to also write the analysis to as JSON'
+    )
+
+    _args = parser.parse_args(args)
+    try:
+        if _args.template == '-':
+            template = json.load(sys.stdin)
+        else:
+            with open(_args.template) as template_file:
+                template = json.load(template_file)
+    except (IOError, ValueError), err:
+        parser.error('Could not read Template "%s": %s' % (_args.template, err))
+
+    durations = None
+    if _args.weighted:
+        try:
+            records = read_timings(_args.timings_file)
+        except IOError, err:
+            parser.error('Could not read timings "%s": %s' % (_args.timings_file, err))
+        durations, missing = timing_durations(records, template.get('Resources', {}))
+        if missing:
+            print 'No past timings for: %s (the median of all timings is used)\n' % \
+                  ', '.join(missing)
+
+    try:
+        analysis = analyze_template(template, durations)
+    except ValueError, err:
+        print '\n%s\n' % err
+        exit(1)
+    print format_analysis(analysis)
+    if _args.report:
+        with open(_args.report, 'w') as report_file:
+            json.dump(analysis, report_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parse_args_and_run()
@@ -0,0 +1,284 @@
+import collections
+import random
+import threading
+import time
+import uuid
+
+
+# Error codes that only mean "ask again later"
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'TooManyRequestsException',
+    'SlowDown'
+])
+
+# Error codes for failures on the AWS side that usually pass on a retry
+TRANSIENT_ERROR_CODES = frozenset([
+    'InternalError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'RequestTimeout',
+    'RequestTimeoutException',
+    'PriorRequestNotComplete'
+])
+
+# Errors raised before a response arrives that are worth retrying (botocore
+#     exception names, since botocore is only imported once a call is made)
+TRANSIENT_EXCEPTION_NAMES = ['ConnectionError', 'HTTPClientError']
+
+# Operations that change state, with the parameter that makes a repeated
+#     request safe (or None).  A transient error may hide a request that
+#     went through, so these are only retried on throttling (which rejects
+#     the request) unless the call carries such a token.
+MUTATING_OPERATIONS = {
+    'create_stack': 'ClientRequestToken',
+    'update_stack': 'ClientRequestToken',
+    'delete_stack': 'ClientRequestToken',
+    'execute_change_set': 'ClientRequestToken',
+    'create_change_set': 'ClientToken',
+    'create_key_pair': None,
+    'import_key_pair': None,
+    'delete_key_pair': None
+}
+
+# Steady requests per second allowed for each service in each Region; AWS
+#     throttles Cloud Formation well before EC2
+DEFAULT_RATES = {
+    'cloudformation': 4.0,
+    'ec2': 20.0,
+    'ssm': 10.0
+}
+DEFAULT_RATE = 10.0
+
+# The rate never drops below this many requests per second when throttled
+MIN_RATE = 0.5
+
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+
+# Counters kept per (service, region)
+STAT_NAMES = ['attempts', 'retries', 'throttled', 'errors', 'rate_wait_seconds',
+              'backoff_seconds']
+
+
+class TokenBucket(object):
+    """ Client-side rate limiter that adapts to throttling
+
+    Up to burst requests may go out at once, after which they are spaced
+    rate per second.  A throttled request halves the rate (down to
+    MIN_RATE) and each successful one wins a little of it back, up to
+    max_rate.
+    """
+
+    def __init__(self, max_rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.burst = burst if burst is not None else max(max_rate, 1.0)
+        self.tokens = self.burst
+        self.clock = clock
+        self.sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Wait for a token and return how many seconds that took """
+
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now so concurrent callers queue up behind it
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.rate / 2.0, MIN_RATE)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.rate + self.max_rate / 20.0, self.max_rate)
+
+
+class CallPolicy(object):
+    """ Rate limits and retries AWS API calls, and counts what that cost
+
+    Each (service, region) gets its own TokenBucket.  Throttling and
+    transient errors are retried up to max_attempts in total, waiting a
+    random time of up to base_delay * 2 ** retry (capped at max_delay)
+    between attempts; any other error is raised at once.  Transient errors of
+    MUTATING_OPERATIONS are only retried when the call carries its request
+    token.  The clock, sleep and random functions can be replaced for
+    testing.
+    """
+
+    def __init__(self, rates=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 clock=time.time, sleep=time.sleep, random=random.random):
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.random = random
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._stats = collections.defaultdict(lambda: dict.fromkeys(STAT_NAMES, 0))
+
+    def call(self, service, region, function, *args, **kwargs):
+        """ Call an API function of a client for the service and region
+
+        The function's name is the operation name (as for boto3 client
+        methods), which decides whether transient errors are retried.
+        """
+
+        import botocore.exceptions
+
+        bucket = self._bucket(service, region)
+        retry_transient = is_retry_safe(getattr(function, '__name__', None), kwargs)
+        retries = 0
+        while True:
+            waited = bucket.acquire()
+            self._count(service, region, attempts=1, rate_wait_seconds=waited)
+            try:
+                response = function(*args, **kwargs)
+            except (botocore.exceptions.ClientError,) + _transient_exceptions(), err:
+                kind = error_kind(err)
+                if kind == 'transient' and not retry_transient:
+                    kind = None
+                if kind is None or retries + 1 >= self.max_attempts:
+                    self._count(service, region, errors=1)
+                    raise
+                if kind == 'throttled':
+                    bucket.throttled()
+                    self._count(service, region, throttled=1)
+                delay = self.backoff(retries)
+                self._count(service, region, retries=1, backoff_seconds=delay)
+                self.sleep(delay)
+                retries += 1
+                continue
+            bucket.succeeded()
+            return response
+
+    def backoff(self, retries):
+        """ Return the jittered delay before the retry after `retries` retries """
+
+        return self.random() * min(self.max_delay, self.base_delay * 2 ** retries)
+
+    def stats(self):
+        """ Return the counters per "service/region", plus their totals """
+
+        with self._lock:
+            stats = dict(('%s/%s' % key, dict(counters))
+                         for key, counters in self._stats.items())
+        totals = dict.fromkeys(STAT_NAMES, 0)
+        for counters in stats.values():
+            for name in STAT_NAMES:
+                totals[name] += counters[name]
+        stats['total'] = totals
+        return stats
+
+    def _bucket(self, service, region):
+        with self._lock:
+            bucket = self._buckets.get((service, region))
+            if bucket is None:
+                bucket = TokenBucket(self.rates.get(service, DEFAULT_RATE),
+                                     clock=self.clock, sleep=self.sleep)
+                self._buckets[(service, region)] = bucket
+            return bucket
+
+    def _count(self, service, region, **counts):
+        with self._lock:
+            counters = self._stats[(service, region)]
+            for name, value in counts.items():
+                counters[name] += value
+
+
+class RateLimitedClient(object):
+    """ Wraps a boto3 client so every API operation goes through a CallPolicy
+
+    Anything other than an API operation (e.g., "meta" or "exceptions") is
+    the wrapped client's own, so Stubbers and event handlers still work.
+    """
+
+    def __init__(self, client, service, region, policy):
+        self._client = client
+        self._service = service
+        self._region = region
+        self._policy = policy
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in self._client.meta.method_to_api_mapping:
+            return attribute
+
+        def call(*args, **kwargs):
+            return self._policy.call(self._service, self._region, attribute, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+
+def is_retry_safe(operation, kwargs):
+    """ Return whether a call may be repeated after a transient error """
+
+    if operation not in MUTATING_OPERATIONS:
+        return True
+    token = MUTATING_OPERATIONS[operation]
+    return token is not None and bool(kwargs.get(token))
+
+
+def client_request_token(action):
+    """ Return a new token that makes a retried mutating request safe
+
+    Cloud Formation ignores a request whose token it has already seen.
+    """
+
+    return '%s-%s' % (action, uuid.uuid4().hex)
+
+
+def error_kind(err):
+    """ Return "throttled" or "transient" for errors worth retrying, otherwise None """
+
+    import botocore.exceptions
+
+    if isinstance(err, _transient_exceptions()):
+        return 'transient'
+    if isinstance(err, botocore.exceptions.ClientError):
+        code = err.response.get('Error', {}).get('Code')
+        if code in THROTTLING_ERROR_CODES:
+            return 'throttled'
+        status = err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        if code in TRANSIENT_ERROR_CODES or status >= 500:
+            return 'transient'
+    return None
+
+
+def _transient_exceptions():
+    import botocore.exceptions
+
+    return tuple(getattr(botocore.exceptions, name) for name in TRANSIENT_EXCEPTION_NAMES)
+
+
+def stats_since(stats, earlier):
+    """ Return the total counters accumulated between two stats() results """
+
+    return dict((name, stats['total'][name] - earlier['total'][name]) for name in STAT_NAMES)
+
+
+def format_call_stats(totals):
+    """ Return a one line summary of total API call counters """
+
+    return 'AWS API calls: %d (%d retried, %d throttled, %d failed); waited %.1f seconds ' \
+           'for the rate limit and %.1f seconds backing off' % (
+               totals['attempts'] - totals['retries'], totals['retries'], totals['throttled'],
+               totals['errors'], totals['rate_wait_seconds'], totals['backoff_seconds'])
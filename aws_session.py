@@ -0,0 +1,109 @@
+import threading
+from aws_calls import CallPolicy, RateLimitedClient
+
+
+# Default botocore configuration shared by every pooled client; retries are
+#     left to the CallPolicy, since botocore's own would multiply them
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_RETRIES = {'max_attempts': 0}
+
+# boto3 and botocore.config take a few hundred milliseconds to import, so they
+#     are only imported once the first session or client is needed
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+_client_settings = {
+    'max_pool_connections': DEFAULT_MAX_POOL_CONNECTIONS,
+    'retries': DEFAULT_RETRIES
+}
+_client_config = None
+_call_policy = CallPolicy()
+
+
+def configure_clients(max_pool_connections=None, retries=None):
+    """ Set the connection pool size and retry config for new clients
+
+    Clients that were already handed out keep their configuration, so the
+    pool is cleared and later get_client calls build fresh clients.
+    """
+
+    global _client_config
+
+    with _lock:
+        if max_pool_connections is not None:
+            _client_settings['max_pool_connections'] = max_pool_connections
+        if retries is not None:
+            _client_settings['retries'] = retries
+        _client_config = None
+        _clients.clear()
+
+
+def set_call_policy(policy):
+    """ Rate limit and retry the API calls of new clients with a CallPolicy
+
+    The pool is cleared so later get_client calls build clients that use it.
+    """
+
+    global _call_policy
+
+    with _lock:
+        _call_policy = policy
+        _clients.clear()
+
+
+def get_call_policy():
+    return _call_policy
+
+
+def get_session(id, secret):
+    """ Return the shared boto3 session for a set of credentials """
+
+    with _lock:
+        return _get_session(id, secret)
+
+
+def get_client(service, region, id, secret):
+    """ Return the shared boto3 client for a service, region and credentials
+
+    boto3 clients are thread-safe, so one client (and its HTTPS connection
+    pool and parsed service model) is reused by every caller in the process.
+    Its API calls are rate limited and retried by the current CallPolicy.
+    """
+
+    key = (service, region, id, secret)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _get_session(id, secret).client(service,
+                                                     region_name=region,
+                                                     config=_get_client_config())
+            client = RateLimitedClient(client, service, region, _call_policy)
+            _clients[key] = client
+        return client
+
+
+def clear_clients():
+    """ Drop every pooled session and client """
+
+    with _lock:
+        _clients.clear()
+        _sessions.clear()
+
+
+def _get_client_config():
+    global _client_config
+
+    if _client_config is None:
+        import botocore.config
+        _client_config = botocore.config.Config(**_client_settings)
+    return _client_config
+
+
+def _get_session(id, secret):
+    session = _sessions.get((id, secret))
+    if session is None:
+        import boto3
+        session = boto3.session.Session(aws_access_key_id=id,
+                                        aws_secret_access_key=secret)
+        _sessions[(id, secret)] = session
+    return session
@@ -0,0 +1,91 @@
+import argparse
+import json
+import sys
+from batch_provisioner import DEFAULT_LOG_DIR, DEFAULT_MAX_CONCURRENCY, \
+    DEFAULT_MAX_PER_REGION, ManifestError, format_report, load_manifest, provision_batch
+from provision_awscloud_webserver_env import TIMINGS_FILE
+
+
+def parse_args_and_run(args=None):
+    """ Parse command line arguments and provision every environment in the manifest """
+
+    parser = argparse.ArgumentParser(
+                          description='Provisions many AWS cloud web server environments '\
+                                      'from a manifest, several at a time.')
+
+    parser.add_argument(
+        '-i',
+        '--id',
+        required=True,
+        help='AWS Access Key ID'
+    )
+    parser.add_argument(
+        '-s',
+        '--secret',
+        required=True,
+        help='AWS Secret Access Key'
+    )
+    parser.add_argument(
+        '-m',
+        '--manifest',
+        required=True,
+        help='JSON (or YAML) file listing the environments to provision'
+    )
+    parser.add_argument(
+        '--max_concurrency',
+        type=int,
+        help='Most environments provisioned at the same time (default is the '\
+             'manifest\'s "max_concurrency", or %d)' % DEFAULT_MAX_CONCURRENCY
+    )
+    parser.add_argument(
+        '--max_per_region',
+        type=int,
+        help='Most environments provisioned at the same time in one AWS Region '\
+             '(default is the manifest\'s "max_per_region", or %d)' % DEFAULT_MAX_PER_REGION
+    )
+    parser.add_argument(
+        '--log_dir',
+        default=DEFAULT_LOG_DIR,
+        help='Directory that each environment\'s output is written to as '\
+             '"<stack_name>.log" (default is "%s")' % DEFAULT_LOG_DIR
+    )
+    parser.add_argument(
+        '--timings_file',
+        default=TIMINGS_FILE,
+        help='JSON lines file that phase and resource timings are appended to '\
+             '(default is "%s")' % TIMINGS_FILE
+    )
+    parser.add_argument(
+        '--report',
+        help='File to write the batch report to as JSON'
+    )
+
+    _args = parser.parse_args(args)
+    try:
+        specs, settings = load_manifest(_args.manifest)
+    except ManifestError, err:
+        parser.error(str(err))
+    max_concurrency = _args.max_concurrency or settings.get('max_concurrency',
+                                                            DEFAULT_MAX_CONCURRENCY)
+    max_per_region = _args.max_per_region or settings.get('max_per_region',
+                                                          DEFAULT_MAX_PER_REGION)
+    if max_concurrency < 1 or max_per_region < 1:
+        parser.error('--max_concurrency and --max_per_region must be at least 1')
+
+    report = provision_batch(_args.id,
+                             _args.secret,
+                             specs,
+                             max_concurrency,
+                             max_per_region,
+                             _args.log_dir,
+                             _args.timings_file)
+    print '\n%s\n' % format_report(report)
+    if _args.report:
+        with open(_args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+    if report['summary']['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parse_args_and_run()
@@ -0,0 +1,544 @@
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import aws_session
+import provision_awscloud_webserver_env as provision
+from ami_resolver import AmiResolutionError
+from aws_calls import format_call_stats, stats_since
+from webserver_profiles import PROFILES
+
+
+# Default limits on how many environments are provisioned at the same time,
+#     in total and within one AWS Region
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_PER_REGION = 3
+
+# Directory that each environment's provisioning output is written to
+DEFAULT_LOG_DIR = os.path.join(provision.CACHE_DIR, 'logs')
+
+# Seconds the scheduler waits between checks, so Ctrl-C is not held up
+WAIT_SECONDS = 1.0
+
+# One environment to provision, as read from the manifest
+EnvironmentSpec = collections.namedtuple('EnvironmentSpec', [
+    'stack_name',
+    'region',
+    'key_pair',
+    'type_instance',
+    'fleet',
+    'web_profile',
+    'defer_update',
+    'ready_timeout',
+    'image_id',
+    'network_stack',
+    'cdn',
+    'instance'
+])
+
+# Manifest keys of an environment (or the defaults), with their default values
+ENVIRONMENT_DEFAULTS = collections.OrderedDict([
+    ('region', 'us-east-1'),
+    ('key_pair', None),
+    ('type_instance', 't2.micro'),
+    ('fleet', None),
+    ('web_profile', 'default'),
+    ('defer_update', False),
+    ('ready_timeout', provision.DEFAULT_READY_TIMEOUT),
+    ('readiness_gate', True),
+    ('image_id', None),
+    ('network_stack', None),
+    ('cdn', None),
+    ('instance', None)
+])
+
+# A shared network Stack that environments of the batch import from
+NetworkTarget = collections.namedtuple('NetworkTarget', [
+    'stack_name',
+    'region',
+    'zone_count'
+])
+
+# A scheduled run: what run() returned (or the exception it raised) and when
+#     it started and finished
+BatchOutcome = collections.namedtuple('BatchOutcome', [
+    'spec',
+    'result',
+    'error',
+    'started',
+    'finished'
+])
+
+
+class ManifestError(ValueError):
+    """ Raised when a batch manifest cannot be read or is invalid """
+
+
+def load_manifest(path):
+    """ Read a batch manifest and return (specs, settings)
+
+    The manifest is a JSON (or, with PyYAML installed, YAML) object with an
+    "environments" list, optional "defaults" shared by every environment,
+    and optional "max_concurrency" and "max_per_region" settings.
+    """
+
+    try:
+        with open(path) as manifest_file:
+            text = manifest_file.read()
+    except (IOError, OSError), err:
+        raise ManifestError('Could not read manifest "%s": %s' % (path, err))
+
+    if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ManifestError('PyYAML must be installed to read YAML manifest "%s"' % path)
+        try:
+            manifest = yaml.safe_load(text)
+        except yaml.YAMLError, err:
+            raise ManifestError('Manifest "%s" is not valid YAML: %s' % (path, err))
+    else:
+        try:
+            manifest = json.loads(text)
+        except ValueError, err:
+            raise ManifestError('Manifest "%s" is not valid JSON: %s' % (path, err))
+
+    return parse_manifest(manifest)
+
+
+def parse_manifest(manifest):
+    """ Validate a manifest object and return (specs, settings) """
+
+    if not isinstance(manifest, dict):
+        raise ManifestError('The manifest must be an object with an "environments" list')
+    unknown = set(manifest) - set(['defaults', 'environments', 'max_concurrency',
+                                   'max_per_region'])
+    if unknown:
+        raise ManifestError('Unknown manifest keys: %s' % ', '.join(sorted(unknown)))
+
+    defaults = manifest.get('defaults') or {}
+    environments = manifest.get('environments')
+    if not isinstance(defaults, dict):
+        raise ManifestError('"defaults" must be an object')
+    if not isinstance(environments, list) or not environments:
+        raise ManifestError('"environments" must be a non-empty list')
+
+    settings = {}
+    for name in ['max_concurrency', 'max_per_region']:
+        if name in manifest:
+            value = manifest[name]
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ManifestError('"%s" must be a positive integer' % name)
+            settings[name] = value
+
+    specs = []
+    stack_names = set()
+    for index, environment in enumerate(environments):
+        if not isinstance(environment, dict):
+            raise ManifestError('Environment %d must be an object' % (index + 1))
+        spec = environment_spec(dict(defaults, **environment), index)
+        if spec.stack_name in stack_names:
+            raise ManifestError('Stack name "%s" is used by more than one environment' %
+                                spec.stack_name)
+        stack_names.add(spec.stack_name)
+        specs.append(spec)
+    for spec in specs:
+        if spec.network_stack in stack_names:
+            raise ManifestError('%s: "network_stack" "%s" is also an environment\'s '
+                                'stack_name' % (spec.stack_name, spec.network_stack))
+    return specs, settings
+
+
+def environment_spec(values, index=0):
+    """ Return the EnvironmentSpec for one manifest environment (merged with defaults) """
+
+    label = values.get('stack_name') or 'Environment %d' % (index + 1)
+    unknown = set(values) - set(ENVIRONMENT_DEFAULTS) - set(['stack_name'])
+    if unknown:
+        raise ManifestError('%s: unknown keys: %s' % (label, ', '.join(sorted(unknown))))
+
+    settings = dict(ENVIRONMENT_DEFAULTS)
+    settings.update(values)
+
+    stack_name = values.get('stack_name')
+    if not isinstance(stack_name, basestring) or \
+            not provision.STACK_NAME_PATTERN.match(stack_name):
+        raise ManifestError('%s: "stack_name" must start with a letter and hold at most '
+                            '128 letters, digits and dashes' % label)
+    if not isinstance(settings['region'], basestring) or \
+            not provision.REGION_PATTERN.match(settings['region']):
+        raise ManifestError('%s: "%s" is not a valid AWS Region ID' %
+                            (label, settings['region']))
+    if not settings['key_pair']:
+        raise ManifestError('%s: a "key_pair" is required' % label)
+    if settings['web_profile'] not in PROFILES:
+        raise ManifestError('%s: "web_profile" must be one of: %s' %
+                            (label, ', '.join(sorted(PROFILES))))
+
+    fleet = settings['fleet']
+    if fleet is True:
+        fleet = {}
+    if fleet in (None, False):
+        fleet = None
+    elif isinstance(fleet, dict):
+        try:
+            fleet = provision.fleet_config(**fleet)
+        except (TypeError, ValueError), err:
+            raise ManifestError('%s: invalid "fleet": %s' % (label, err))
+    else:
+        raise ManifestError('%s: "fleet" must be true, false or an object' % label)
+
+    cdn = settings['cdn']
+    if cdn is True:
+        cdn = {}
+    if cdn in (None, False):
+        cdn = None
+    elif isinstance(cdn, dict):
+        try:
+            cdn = provision.cdn_config(**cdn)
+        except (TypeError, ValueError), err:
+            raise ManifestError('%s: invalid "cdn": %s' % (label, err))
+    else:
+        raise ManifestError('%s: "cdn" must be true, false or an object' % label)
+
+    instance = settings['instance']
+    if instance is None:
+        instance = {}
+    if not isinstance(instance, dict):
+        raise ManifestError('%s: "instance" must be an object' % label)
+    try:
+        instance = provision.instance_options(settings['type_instance'], fleet=fleet,
+                                              **instance)
+    except (TypeError, ValueError), err:
+        raise ManifestError('%s: invalid "type_instance" or "instance": %s' % (label, err))
+
+    network_stack = settings['network_stack']
+    if network_stack is not None and (not isinstance(network_stack, basestring) or
+                                      not provision.STACK_NAME_PATTERN.match(network_stack)):
+        raise ManifestError('%s: "network_stack" must start with a letter and hold at most '
+                            '128 letters, digits and dashes' % label)
+
+    ready_timeout = settings['ready_timeout'] if settings['readiness_gate'] else None
+    return EnvironmentSpec(stack_name=stack_name,
+                           region=settings['region'],
+                           key_pair=settings['key_pair'],
+                           type_instance=settings['type_instance'],
+                           fleet=fleet,
+                           web_profile=settings['web_profile'],
+                           defer_update=bool(settings['defer_update']),
+                           ready_timeout=ready_timeout,
+                           image_id=settings['image_id'],
+                           network_stack=network_stack,
+                           cdn=cdn,
+                           instance=instance)
+
+
+class BatchScheduler(object):
+    """ Runs a function for each EnvironmentSpec on its own thread, within limits
+
+    At most max_concurrency runs are in progress at once, and at most
+    max_per_region of them in the same AWS Region.  Whenever a run finishes
+    the first waiting spec whose Region has room is started, so a busy
+    Region never holds up specs for other Regions.
+    """
+
+    def __init__(self, run, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 max_per_region=DEFAULT_MAX_PER_REGION, clock=time.time,
+                 on_start=None, on_finish=None):
+        if max_concurrency < 1 or max_per_region < 1:
+            raise ValueError('Concurrency limits must be at least 1')
+        self.run = run
+        self.max_concurrency = max_concurrency
+        self.max_per_region = max_per_region
+        self.clock = clock
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self.peak_concurrency = 0
+        self.peak_per_region = {}
+        self._condition = threading.Condition()
+        self._running = 0
+        self._region_running = collections.Counter()
+
+    def run_all(self, specs):
+        """ Run every spec and return their BatchOutcomes in spec order """
+
+        outcomes = [None] * len(specs)
+        pending = list(enumerate(specs))
+        with self._condition:
+            while pending or self._running:
+                ready = [position for position, (index, spec) in enumerate(pending)
+                         if self._has_room(spec.region)]
+                if not ready:
+                    self._condition.wait(WAIT_SECONDS)
+                    continue
+                index, spec = pending.pop(ready[0])
+                self._running += 1
+                self._region_running[spec.region] += 1
+                self.peak_concurrency = max(self.peak_concurrency, self._running)
+                self.peak_per_region[spec.region] = max(
+                    self.peak_per_region.get(spec.region, 0),
+                    self._region_running[spec.region])
+                if self.on_start is not None:
+                    self.on_start(spec)
+                worker = threading.Thread(target=self._run_one,
+                                          args=(index, spec, outcomes),
+                                          name='provision-%s' % spec.stack_name)
+                worker.daemon = True
+                worker.start()
+        return outcomes
+
+    def _has_room(self, region):
+        return self._running < self.max_concurrency and \
+            self._region_running[region] < self.max_per_region
+
+    def _run_one(self, index, spec, outcomes):
+        started = self.clock()
+        result = error = None
+        try:
+            result = self.run(spec)
+        except Exception, err:
+            error = err
+        outcome = BatchOutcome(spec, result, error, started, self.clock())
+        with self._condition:
+            outcomes[index] = outcome
+            self._running -= 1
+            self._region_running[spec.region] -= 1
+            if self.on_finish is not None:
+                self.on_finish(outcome)
+            self._condition.notify()
+
+
+class ThreadOutput(object):
+    """ Stand-in for sys.stdout that sends each thread's output to its own stream
+
+    Threads without a stream of their own write to the default stream.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    def redirect(self, stream):
+        self._local.stream = stream
+
+    def release(self):
+        self._local.stream = None
+
+    def write(self, text):
+        self._stream().write(text)
+
+    def flush(self):
+        self._stream().flush()
+
+    # The print statement keeps its state in the file's softspace attribute
+    @property
+    def softspace(self):
+        return getattr(self._stream(), 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self._stream().softspace = value
+
+    def _stream(self):
+        return getattr(self._local, 'stream', None) or self.default
+
+
+def provision_batch(id, secret, specs, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                    max_per_region=DEFAULT_MAX_PER_REGION, log_dir=DEFAULT_LOG_DIR,
+                    timings_file=provision.TIMINGS_FILE,
+                    provision_environment=None):
+    """ Provision every environment in specs and return the batch report
+
+    The AMIs of all Regions are looked up concurrently first, and then the
+    shared network Stacks are created (or found), so that environments
+    sharing one do not race to create it.  Each environment's (and network
+    Stack's) output goes to "<stack_name>.log" in log_dir (or nowhere when
+    log_dir is None) and a line is displayed as each one starts and
+    finishes.  provision_environment defaults to the provisioning script's.
+    """
+
+    if provision_environment is None:
+        provision_environment = provision.provision_environment
+    if log_dir and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    started = time.time()
+    call_stats = aws_session.get_call_policy().stats()
+    regions = [spec.region for spec in specs if spec.image_id is None]
+    if regions:
+        try:
+            provision.ami_resolver.resolve_all(id, secret, regions)
+        except AmiResolutionError, err:
+            # Each environment falls back (or fails) on its own when provisioned
+            print 'WARNING: %s' % err
+
+    output = ThreadOutput(sys.stdout)
+
+    def logged(function):
+        def run(spec):
+            log_file = open(log_path(log_dir, spec), 'w') if log_dir else open(os.devnull, 'w')
+            output.redirect(log_file)
+            try:
+                return function(spec)
+            except provision.ProvisioningError, err:
+                print '\n%s\n' % err
+                raise
+            finally:
+                output.release()
+                log_file.close()
+        return run
+
+    def ensure_network(target):
+        return provision.ensure_network_stack(id, secret, target.region, target.stack_name,
+                                              target.zone_count, target.zone_count)
+
+    def provision_one(spec):
+        return provision_environment(id, secret, spec.key_pair, spec.region,
+                                     spec.type_instance, spec.fleet,
+                                     spec.web_profile, spec.defer_update,
+                                     spec.ready_timeout, timings_file,
+                                     spec.image_id, spec.stack_name, spec.network_stack,
+                                     cdn=spec.cdn, instance=spec.instance)
+
+    def on_start(spec):
+        output.default.write('Started  %s (%s, %s)\n' % (
+            spec.stack_name, spec.region, getattr(spec, 'type_instance', 'network')))
+
+    def on_finish(outcome):
+        status, succeeded, outputs, error = outcome_result(outcome)
+        output.default.write('Finished %s: %s in %.1f seconds\n' % (
+            outcome.spec.stack_name, status, outcome.finished - outcome.started))
+
+    network_scheduler = BatchScheduler(logged(ensure_network), max_concurrency, max_per_region,
+                                       on_start=on_start, on_finish=on_finish)
+    scheduler = BatchScheduler(logged(provision_one), max_concurrency, max_per_region,
+                               on_start=on_start, on_finish=on_finish)
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        network_outcomes = network_scheduler.run_all(shared_networks(specs))
+        outcomes = scheduler.run_all(specs)
+    finally:
+        sys.stdout = stdout
+
+    entries = [report_entry(outcome, log_dir) for outcome in outcomes]
+    succeeded = len([entry for entry in entries if entry['succeeded']])
+    return {
+        'networks': [network_entry(outcome, log_dir) for outcome in network_outcomes],
+        'environments': entries,
+        'summary': {
+            'environments': len(entries),
+            'succeeded': succeeded,
+            'failed': len(entries) - succeeded,
+            'wall_seconds': time.time() - started,
+            'max_concurrency': max_concurrency,
+            'max_per_region': max_per_region,
+            'peak_concurrency': scheduler.peak_concurrency,
+            'peak_per_region': scheduler.peak_per_region,
+            'api_calls': stats_since(aws_session.get_call_policy().stats(), call_stats)
+        }
+    }
+
+
+def shared_networks(specs):
+    """ Return a NetworkTarget for each network Stack that specs import from
+
+    Each one gets enough Subnets for the widest fleet importing it (and at
+    least the default number).
+    """
+
+    zone_counts = collections.OrderedDict()
+    for spec in specs:
+        if spec.network_stack is not None:
+            key = (spec.network_stack, spec.region)
+            zone_count = spec.fleet.zone_count if spec.fleet is not None else 1
+            zone_counts[key] = max(zone_counts.get(key, provision.DEFAULT_NETWORK_ZONES),
+                                   zone_count)
+    return [NetworkTarget(stack_name, region, zone_count)
+            for (stack_name, region), zone_count in zone_counts.items()]
+
+
+def log_path(log_dir, spec):
+    return os.path.join(log_dir, '%s.log' % spec.stack_name)
+
+
+def report_entry(outcome, log_dir=None):
+    """ Return the report dict for one environment's BatchOutcome """
+
+    spec = outcome.spec
+    status, succeeded, outputs, error = outcome_result(outcome)
+    return {
+        'stack_name': spec.stack_name,
+        'region': spec.region,
+        'type_instance': spec.type_instance,
+        'fleet': spec.fleet is not None,
+        'cdn': spec.cdn is not None,
+        'status': status,
+        'succeeded': succeeded,
+        'url': outputs.get('URL'),
+        'outputs': outputs,
+        'error': error,
+        'seconds': outcome.finished - outcome.started,
+        'log_file': log_path(log_dir, spec) if log_dir else None
+    }
+
+
+def network_entry(outcome, log_dir=None):
+    """ Return the report dict for one network Stack's BatchOutcome """
+
+    target = outcome.spec
+    status, succeeded, outputs, error = outcome_result(outcome)
+    return {
+        'stack_name': target.stack_name,
+        'region': target.region,
+        'status': status,
+        'succeeded': succeeded,
+        'outputs': outputs,
+        'error': error,
+        'seconds': outcome.finished - outcome.started,
+        'log_file': log_path(log_dir, target) if log_dir else None
+    }
+
+
+def outcome_result(outcome):
+    """ Return the (status, succeeded, outputs, error) of a BatchOutcome """
+
+    if outcome.error is not None:
+        return 'ERROR', False, {}, str(outcome.error) or outcome.error.__class__.__name__
+    return tuple(outcome.result)
+
+
+def format_report(report):
+    """ Return the batch report as a table followed by a summary line """
+
+    header = ('Stack', 'Region', 'Type', 'Status', 'Seconds', 'URL / Error')
+    rows = []
+    for entry in report['environments']:
+        detail = entry['url'] or ''
+        if not entry['succeeded']:
+            detail = entry['error'] or ''
+        rows.append((entry['stack_name'], entry['region'], entry['type_instance'],
+                     entry['status'], '%.1f' % entry['seconds'], detail))
+    widths = [max(len(row[column]) for row in [header] + rows)
+              for column in range(len(header) - 1)]
+
+    lines = []
+    for entry in report.get('networks', []):
+        lines.append('Network Stack %s (%s): %s' % (
+            entry['stack_name'], entry['region'],
+            entry['status'] if entry['succeeded'] else entry['error'] or entry['status']))
+    if lines:
+        lines.append('')
+    for row in [header] + rows:
+        lines.append('  '.join(value.ljust(width) for value, width in zip(row, widths)) +
+                     '  ' + row[-1])
+    summary = report['summary']
+    lines.append('')
+    lines.append('%d of %d environments succeeded (%d failed) in %.1f seconds, '
+                 'at most %d at once' % (summary['succeeded'], summary['environments'],
+                                         summary['failed'], summary['wall_seconds'],
+                                         summary['peak_concurrency']))
+    lines.append(format_call_stats(summary['api_calls']))
+    return '\n'.join(lines)
@@ -0,0 +1,356 @@
+import argparse
+import collections
+import json
+import sys
+import threading
+import time
+import botocore
+import aws_session
+import provision_awscloud_webserver_env as provision
+from aws_calls import client_request_token, format_call_stats, stats_since
+from batch_provisioner import BatchScheduler, DEFAULT_MAX_CONCURRENCY, \
+    DEFAULT_MAX_PER_REGION, ManifestError, load_manifest, shared_networks
+from provision_awscloud_webserver_env import REGION_PATTERN, STACK_NAME, \
+    STACK_NAME_PATTERN, TIMINGS_FILE
+from provisioning_timer import ProvisioningTimer
+from stack_poller import StackPoller, StackPollTimeout
+
+
+# Seconds to wait for a Stack to be deleted before giving up on it
+DEFAULT_DELETE_TIMEOUT = 60 * 60
+
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+
+# A Stack to delete
+StackTarget = collections.namedtuple('StackTarget', [
+    'stack_name',
+    'region'
+])
+
+# Outcome of deleting a Stack: its final status, whether it is gone, the
+#     resources that failed to delete (with reasons), those that were
+#     retained on the retry, and any error
+DeleteResult = collections.namedtuple('DeleteResult', [
+    'status',
+    'succeeded',
+    'failed_resources',
+    'retained',
+    'error'
+])
+
+FailedResource = collections.namedtuple('FailedResource', [
+    'logical_id',
+    'resource_type',
+    'reason'
+])
+
+# Keeps event lines from Stacks deleted at the same time from interleaving
+_output_lock = threading.Lock()
+
+
+def destroy_stack(id, secret, target, retain_failed=False, timeout=DEFAULT_DELETE_TIMEOUT,
+                  timings_file=TIMINGS_FILE):
+    """ Delete a Cloud Formation Stack, follow its events and return a DeleteResult
+
+    If deletion fails and retain_failed is set, the deletion is retried once,
+    keeping the resources that failed.  A Stack that does not exist counts as
+    deleted.  Per-resource deletion times are appended to timings_file, and
+    a deleted Stack is dropped from the provisioning script's stack_state.
+    """
+
+    client = aws_session.get_client('cloudformation', target.region, id, secret)
+    try:
+        stack = client.describe_stacks(StackName=target.stack_name)['Stacks'][0]
+    except botocore.exceptions.ClientError, err:
+        if 'does not exist' in err.response['Error']['Message']:
+            display(target, 'Cloud Formation Stack does not exist')
+            provision.stack_state.remove(target.region, target.stack_name)
+            return DeleteResult('NOT_FOUND', True, [], [], None)
+        return DeleteResult('DESCRIBE_FAILED', False, [], [], err.response['Error']['Message'])
+
+    timer = ProvisioningTimer()
+    failed = collections.OrderedDict()
+
+    def handle_event(event):
+        display_stack_event(target, event)
+        timer.add_event(event)
+        if event['ResourceStatus'] == 'DELETE_FAILED' and \
+                event['ResourceType'] != STACK_RESOURCE_TYPE:
+            failed[event['LogicalResourceId']] = FailedResource(
+                event['LogicalResourceId'], event['ResourceType'],
+                event.get('ResourceStatusReason', ''))
+
+    # Deleted Stacks can only be looked up by ID, so poll by ID
+    retained = []
+    try:
+        status = delete_and_wait(client, stack['StackId'], handle_event, timeout, timer)
+        if status == 'DELETE_FAILED' and retain_failed and failed:
+            retained = list(failed)
+            display(target, 'Retrying the deletion, retaining: %s' % ', '.join(retained))
+            status = delete_and_wait(client, stack['StackId'], handle_event, timeout, timer,
+                                     retained)
+    except botocore.exceptions.ClientError, err:
+        return DeleteResult('DELETE_FAILED', False, failed.values(), retained,
+                            err.response['Error']['Message'])
+    except StackPollTimeout, err:
+        return DeleteResult('TIMED_OUT', False, failed.values(), retained, str(err))
+    finally:
+        if timings_file:
+            try:
+                timer.write_jsonl(timings_file, {'stack_name': target.stack_name,
+                                                 'region': target.region})
+            except (IOError, OSError), err:
+                display(target, 'Could not write timings to "%s": %s' % (timings_file, err))
+
+    error = None
+    if status == 'DELETE_COMPLETE':
+        provision.stack_state.remove(target.region, target.stack_name)
+    else:
+        error = 'Stack deletion ended in %s' % status
+    return DeleteResult(status, status == 'DELETE_COMPLETE', failed.values(), retained, error)
+
+
+def delete_and_wait(client, stack_id, on_event, timeout, timer, retain_resources=None):
+    """ Delete the Stack and poll its events until the deletion settles """
+
+    poller = StackPoller(client, stack_id, on_event=on_event, timeout=timeout)
+    poller.mark()
+    with timer.phase('delete_stack' if not retain_resources else 'retry_delete_stack'):
+        token = client_request_token('delete')
+        if retain_resources:
+            client.delete_stack(StackName=stack_id, RetainResources=retain_resources,
+                                ClientRequestToken=token)
+        else:
+            client.delete_stack(StackName=stack_id, ClientRequestToken=token)
+        return poller.wait()
+
+
+def destroy_stacks(id, secret, targets, retain_failed=False, timeout=DEFAULT_DELETE_TIMEOUT,
+                   max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                   max_per_region=DEFAULT_MAX_PER_REGION, timings_file=TIMINGS_FILE,
+                   network_targets=()):
+    """ Delete every StackTarget concurrently and return the deletion report
+
+    The network_targets (shared network Stacks) are only deleted once the
+    other targets are, since Cloud Formation refuses to delete exports that
+    a Stack still imports.
+    """
+
+    started = time.time()
+    call_stats = aws_session.get_call_policy().stats()
+
+    def run(target):
+        return destroy_stack(id, secret, target, retain_failed, timeout, timings_file)
+
+    scheduler = BatchScheduler(run, max_concurrency, max_per_region)
+    entries = [report_entry(outcome) for outcome in scheduler.run_all(targets)]
+    network_scheduler = BatchScheduler(run, max_concurrency, max_per_region)
+    entries.extend(report_entry(outcome)
+                   for outcome in network_scheduler.run_all(list(network_targets)))
+    succeeded = len([entry for entry in entries if entry['succeeded']])
+    return {
+        'stacks': entries,
+        'summary': {
+            'stacks': len(entries),
+            'succeeded': succeeded,
+            'failed': len(entries) - succeeded,
+            'wall_seconds': time.time() - started,
+            'peak_concurrency': max(scheduler.peak_concurrency,
+                                    network_scheduler.peak_concurrency),
+            'api_calls': stats_since(aws_session.get_call_policy().stats(), call_stats)
+        }
+    }
+
+
+def report_entry(outcome):
+    """ Return the report dict for one Stack's BatchOutcome """
+
+    target = outcome.spec
+    if outcome.error is not None:
+        result = DeleteResult('ERROR', False, [], [],
+                              str(outcome.error) or outcome.error.__class__.__name__)
+    else:
+        result = outcome.result
+    return {
+        'stack_name': target.stack_name,
+        'region': target.region,
+        'status': result.status,
+        'succeeded': result.succeeded,
+        'failed_resources': [resource._asdict() for resource in result.failed_resources],
+        'retained': result.retained,
+        'error': result.error,
+        'seconds': outcome.finished - outcome.started
+    }
+
+
+def format_report(report):
+    """ Return the deletion report as a table, the failure reasons and a summary """
+
+    header = ('Stack', 'Region', 'Status', 'Seconds', 'Retained')
+    rows = [(entry['stack_name'], entry['region'], entry['status'], '%.1f' % entry['seconds'],
+             ', '.join(entry['retained'])) for entry in report['stacks']]
+    widths = [max(len(row[column]) for row in [header] + rows)
+              for column in range(len(header) - 1)]
+
+    lines = []
+    for row in [header] + rows:
+        lines.append('  '.join(value.ljust(width) for value, width in zip(row, widths)) +
+                     '  ' + row[-1])
+    for entry in report['stacks']:
+        if entry['failed_resources'] or not entry['succeeded']:
+            if entry['succeeded']:
+                heading = 'deleted, keeping the resources that failed to delete'
+            else:
+                heading = entry['error'] or entry['status']
+            lines.append('')
+            lines.append('%s (%s): %s' % (entry['stack_name'], entry['region'], heading))
+            for resource in entry['failed_resources']:
+                lines.append('    %s (%s): %s' % (resource['logical_id'],
+                                                  resource['resource_type'],
+                                                  resource['reason']))
+    summary = report['summary']
+    lines.append('')
+    lines.append('%d of %d Stacks deleted (%d failed) in %.1f seconds, at most %d at once' % (
+        summary['succeeded'], summary['stacks'], summary['failed'], summary['wall_seconds'],
+        summary['peak_concurrency']))
+    lines.append(format_call_stats(summary['api_calls']))
+    return '\n'.join(lines)
+
+
+def display(target, message):
+    with _output_lock:
+        sys.stdout.write('[%s %s] %s\n' % (target.region, target.stack_name, message))
+
+
+def display_stack_event(target, event):
+    """ Display the progress of a single Stack event, prefixed by its Stack """
+
+    with _output_lock:
+        provision.print_stack_event(event, '[%s %s] ' % (target.region, target.stack_name))
+
+
+def parse_args_and_run(args=None):
+    """ Parse command line arguments and delete the Stacks """
+
+    parser = argparse.ArgumentParser(
+                          description='Deletes AWS cloud web server environments, '\
+                                      'several at a time.')
+
+    parser.add_argument(
+        '-i',
+        '--id',
+        required=True,
+        help='AWS Access Key ID'
+    )
+    parser.add_argument(
+        '-s',
+        '--secret',
+        required=True,
+        help='AWS Secret Access Key'
+    )
+    parser.add_argument(
+        '-r',
+        '--regions',
+        nargs='+',
+        default=['us-east-1'],
+        help='AWS Region IDs to delete the Stacks in (default is "us-east-1")'
+    )
+    parser.add_argument(
+        '-n',
+        '--stack_names',
+        nargs='+',
+        default=[STACK_NAME],
+        help='Names of the Stacks to delete in each Region (default is "%s")' % STACK_NAME
+    )
+    parser.add_argument(
+        '--network_stacks',
+        nargs='+',
+        default=[],
+        help='Names of shared network Stacks to delete in each Region once the '\
+             'other Stacks are deleted'
+    )
+    parser.add_argument(
+        '-m',
+        '--manifest',
+        help='Delete every environment (and then every network Stack) in this batch '\
+             'provisioning manifest instead'
+    )
+    parser.add_argument(
+        '--retain_failed',
+        action='store_true',
+        help='If a deletion fails, retry it once keeping the resources that failed'
+    )
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        default=DEFAULT_DELETE_TIMEOUT,
+        help='Seconds to wait for each Stack to be deleted (default value is %d)' %
+             DEFAULT_DELETE_TIMEOUT
+    )
+    parser.add_argument(
+        '--max_concurrency',
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help='Most Stacks deleted at the same time (default value is %d)' %
+             DEFAULT_MAX_CONCURRENCY
+    )
+    parser.add_argument(
+        '--max_per_region',
+        type=int,
+        default=DEFAULT_MAX_PER_REGION,
+        help='Most Stacks deleted at the same time in one AWS Region '\
+             '(default value is %d)' % DEFAULT_MAX_PER_REGION
+    )
+    parser.add_argument(
+        '--timings_file',
+        default=TIMINGS_FILE,
+        help='JSON lines file that deletion timings are appended to '\
+             '(default is "%s")' % TIMINGS_FILE
+    )
+    parser.add_argument(
+        '--report',
+        help='File to write the deletion report to as JSON'
+    )
+
+    _args = parser.parse_args(args)
+    if _args.manifest:
+        try:
+            specs, settings = load_manifest(_args.manifest)
+        except ManifestError, err:
+            parser.error(str(err))
+        targets = [StackTarget(spec.stack_name, spec.region) for spec in specs]
+        network_targets = [StackTarget(target.stack_name, target.region)
+                           for target in shared_networks(specs)]
+    else:
+        for region in _args.regions:
+            if not REGION_PATTERN.match(region):
+                parser.error('"%s" is not a valid AWS Region ID' % region)
+        for stack_name in _args.stack_names + _args.network_stacks:
+            if not STACK_NAME_PATTERN.match(stack_name):
+                parser.error('"%s" is not a valid Stack name' % stack_name)
+        targets = [StackTarget(stack_name, region)
+                   for region in _args.regions for stack_name in _args.stack_names]
+        network_targets = [StackTarget(stack_name, region)
+                           for region in _args.regions for stack_name in _args.network_stacks]
+    if _args.max_concurrency < 1 or _args.max_per_region < 1:
+        parser.error('--max_concurrency and --max_per_region must be at least 1')
+
+    report = destroy_stacks(_args.id,
+                            _args.secret,
+                            targets,
+                            _args.retain_failed,
+                            _args.timeout,
+                            _args.max_concurrency,
+                            _args.max_per_region,
+                            _args.timings_file,
+                            network_targets)
+    print '\n%s\n' % format_report(report)
+    if _args.report:
+        with open(_args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+    if report['summary']['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parse_args_and_run()
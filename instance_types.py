@@ -0,0 +1,129 @@
+import collections
+
+
+# What an instance family supports: its sizes (with the vCPUs of each),
+#     whether it runs on CPU credits (T-series), whether it can be
+#     EBS-optimized, and its enhanced networking driver ("ena", "vf" for the
+#     Intel 82599 VF, or None)
+InstanceFamily = collections.namedtuple('InstanceFamily', [
+    'sizes',
+    'burstable',
+    'ebs_optimized',
+    'enhanced_networking'
+])
+
+# The capabilities of one instance type
+InstanceCapabilities = collections.namedtuple('InstanceCapabilities', [
+    'type_instance',
+    'vcpus',
+    'burstable',
+    'ebs_optimized',
+    'enhanced_networking'
+])
+
+# vCPUs of each size of the instance families
+T2_SIZES = {'nano': 1, 'micro': 1, 'small': 1, 'medium': 2, 'large': 2, 'xlarge': 4,
+            '2xlarge': 8}
+T3_SIZES = dict(T2_SIZES, nano=2, micro=2, small=2)
+M4_SIZES = {'large': 2, 'xlarge': 4, '2xlarge': 8, '4xlarge': 16, '10xlarge': 40,
+            '16xlarge': 64}
+M5_SIZES = {'large': 2, 'xlarge': 4, '2xlarge': 8, '4xlarge': 16, '8xlarge': 32,
+            '12xlarge': 48, '16xlarge': 64, '24xlarge': 96}
+M6I_SIZES = dict(M5_SIZES, **{'32xlarge': 128})
+C4_SIZES = {'large': 2, 'xlarge': 4, '2xlarge': 8, '4xlarge': 16, '8xlarge': 36}
+C5_SIZES = {'large': 2, 'xlarge': 4, '2xlarge': 8, '4xlarge': 16, '9xlarge': 36,
+            '12xlarge': 48, '18xlarge': 72, '24xlarge': 96}
+
+# x86_64 instance families the web server can run on (the AMI is x86_64)
+INSTANCE_FAMILIES = {
+    't2': InstanceFamily(T2_SIZES, True, False, None),
+    't3': InstanceFamily(T3_SIZES, True, True, 'ena'),
+    't3a': InstanceFamily(T3_SIZES, True, True, 'ena'),
+    'm4': InstanceFamily(M4_SIZES, False, True, 'vf'),
+    'm5': InstanceFamily(M5_SIZES, False, True, 'ena'),
+    'm5a': InstanceFamily(M5_SIZES, False, True, 'ena'),
+    'm6i': InstanceFamily(M6I_SIZES, False, True, 'ena'),
+    'c4': InstanceFamily(C4_SIZES, False, True, 'vf'),
+    'c5': InstanceFamily(C5_SIZES, False, True, 'ena'),
+    'c6i': InstanceFamily(M6I_SIZES, False, True, 'ena'),
+    'r5': InstanceFamily(M5_SIZES, False, True, 'ena'),
+    'r6i': InstanceFamily(M6I_SIZES, False, True, 'ena')
+}
+
+# gp3 volume limits: size in GiB, IOPS (at most IOPS_PER_GIB per GiB above
+#     the baseline), and throughput in MiB/s (at most a quarter of the IOPS)
+GP3_MIN_SIZE = 1
+GP3_MAX_SIZE = 16384
+GP3_BASELINE_IOPS = 3000
+GP3_MAX_IOPS = 16000
+GP3_IOPS_PER_GIB = 500
+GP3_BASELINE_THROUGHPUT = 125
+GP3_MAX_THROUGHPUT = 1000
+GP3_THROUGHPUT_PER_IOPS = 0.25
+
+# Instances per Availability Zone allowed in a spread placement group
+SPREAD_INSTANCES_PER_ZONE = 7
+
+PLACEMENT_STRATEGIES = ['cluster', 'partition', 'spread']
+
+
+class UnsupportedInstanceType(ValueError):
+    """ Raised for an instance type that is not in the capability table """
+
+
+def instance_capabilities(type_instance):
+    """ Return the InstanceCapabilities of an instance type
+
+    Raises UnsupportedInstanceType for a type that is not in INSTANCE_FAMILIES.
+    """
+
+    family, _, size = type_instance.partition('.')
+    if family not in INSTANCE_FAMILIES or size not in INSTANCE_FAMILIES[family].sizes:
+        raise UnsupportedInstanceType(
+            '"%s" is not a supported instance type; supported families are: %s' %
+            (type_instance, ', '.join(sorted(INSTANCE_FAMILIES))))
+    capabilities = INSTANCE_FAMILIES[family]
+    return InstanceCapabilities(type_instance=type_instance,
+                                vcpus=capabilities.sizes[size],
+                                burstable=capabilities.burstable,
+                                ebs_optimized=capabilities.ebs_optimized,
+                                enhanced_networking=capabilities.enhanced_networking)
+
+
+def validate_gp3_volume(size, iops, throughput):
+    """ Raise ValueError unless the gp3 volume settings are within the EBS limits """
+
+    if not GP3_MIN_SIZE <= size <= GP3_MAX_SIZE:
+        raise ValueError('gp3 volume size must be between %d and %d GiB' %
+                         (GP3_MIN_SIZE, GP3_MAX_SIZE))
+    max_iops = min(GP3_MAX_IOPS, max(GP3_BASELINE_IOPS, GP3_IOPS_PER_GIB * size))
+    if not GP3_BASELINE_IOPS <= iops <= max_iops:
+        raise ValueError('gp3 IOPS must be between %d and %d for a %d GiB volume' %
+                         (GP3_BASELINE_IOPS, max_iops, size))
+    max_throughput = min(GP3_MAX_THROUGHPUT, int(iops * GP3_THROUGHPUT_PER_IOPS))
+    if not GP3_BASELINE_THROUGHPUT <= throughput <= max_throughput:
+        raise ValueError('gp3 throughput must be between %d and %d MiB/s at %d IOPS' %
+                         (GP3_BASELINE_THROUGHPUT, max_throughput, iops))
+
+
+def validate_placement(capabilities, strategy, zone_count=1, max_instances=1):
+    """ Raise ValueError unless instances of the type can use the placement strategy
+
+    A cluster placement group keeps its instances in one Availability Zone
+    and needs enhanced networking, and a spread placement group holds at
+    most SPREAD_INSTANCES_PER_ZONE instances per Availability Zone.
+    """
+
+    if strategy not in PLACEMENT_STRATEGIES:
+        raise ValueError('placement strategy must be one of: %s' %
+                         ', '.join(PLACEMENT_STRATEGIES))
+    if strategy == 'cluster':
+        if capabilities.burstable or capabilities.enhanced_networking is None:
+            raise ValueError('a cluster placement group needs a non-burstable instance '
+                             'type with enhanced networking, which "%s" is not' %
+                             capabilities.type_instance)
+        if zone_count > 1:
+            raise ValueError('a cluster placement group cannot span Availability Zones')
+    if strategy == 'spread' and max_instances > SPREAD_INSTANCES_PER_ZONE * zone_count:
+        raise ValueError('a spread placement group holds at most %d instances per '
+                         'Availability Zone' % SPREAD_INSTANCES_PER_ZONE)
@@ -0,0 +1,28 @@
+import json
+import os
+import tempfile
+
+
+def atomic_write_json(path, data, **dump_options):
+    """ Write data to the JSON file at path so that readers never see it half written
+
+    The JSON is written to a temporary file in the same directory, flushed
+    to disk and renamed over path, creating the directory first if needed.
+    dump_options (e.g., indent) are passed on to json.dump.  Raises IOError
+    or OSError when the file cannot be written; the temporary file is then
+    removed.
+    """
+
+    directory = os.path.dirname(path) or '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as json_file:
+            json.dump(data, json_file, **dump_options)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,302 @@
+import httplib
+import math
+import socket
+import threading
+import time
+import urlparse
+
+
+class LatencyHistogram(object):
+    """ Log-bucketed latency histogram with about 1% relative precision
+
+    Recording is O(1) and memory only grows with the spread of latencies,
+    not the number of samples, so long runs can record every request.
+    """
+
+    PRECISION = 1.01
+    MIN_SECONDS = 1e-6
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._log_precision = math.log(self.PRECISION)
+
+    def record(self, seconds):
+        seconds = max(seconds, self.MIN_SECONDS)
+        bucket = int(math.log(seconds / self.MIN_SECONDS) / self._log_precision)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """ Return the latency (in seconds) at the given percentile """
+
+        if not self.count:
+            return 0.0
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= threshold:
+                # Report the upper edge of the bucket, capped at the real max
+                return min(self.MIN_SECONDS * self.PRECISION ** (bucket + 1), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class LoadTestWorker(threading.Thread):
+    """ Sends requests over one keep-alive connection until the test ends """
+
+    def __init__(self, test):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.test = test
+        self.histogram = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.statuses = {}
+        self.connection = None
+
+    def run(self):
+        test = self.test
+        while True:
+            scheduled = test.next_send_time()
+            if scheduled is None:
+                break
+            delay = scheduled - test.clock()
+            if delay > 0:
+                test.sleep(delay)
+
+            ok, status = self._send()
+            # With a target rate, latency is measured from the scheduled send
+            #     time so that a stalled server cannot hide queued requests
+            self.histogram.record(test.clock() - scheduled)
+            self.requests += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if not ok:
+                self.errors += 1
+
+        if self.connection is not None:
+            self.connection.close()
+
+    def _send(self):
+        test = self.test
+        try:
+            if self.connection is None:
+                self.connection = httplib.HTTPConnection(test.host, test.port,
+                                                         timeout=test.timeout)
+                self.connection.connect()
+                # Small requests must not wait on Nagle's algorithm
+                self.connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connection.request('GET', test.path, headers={'Connection': 'keep-alive'})
+            response = self.connection.getresponse()
+            body = response.read()
+            if response.getheader('connection', '').lower() == 'close':
+                self._reset()
+            ok = 200 <= response.status < 300 and \
+                (test.expected_text is None or test.expected_text in body)
+            return ok, str(response.status)
+        except (httplib.HTTPException, socket.error), err:
+            self._reset()
+            return False, err.__class__.__name__
+
+    def _reset(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+
+
+class ConnectionPool(object):
+    """ Keep-alive HTTP connections shared by several threads, per host and port
+
+    A connection is taken from the pool for one request and put back once
+    its response is read, unless the server closed it or the request failed;
+    at most max_idle connections are kept per host.  A request on a reused
+    connection that the server has meanwhile dropped is retried once on a
+    new connection.
+    """
+
+    def __init__(self, timeout=10.0, max_idle=4, clock=time.time):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def get(self, url):
+        """ GET the URL and return (status, body, seconds, reused)
+
+        Raises httplib.HTTPException or socket.error when the request fails.
+        """
+
+        parsed = urlparse.urlparse(url if '://' in url else 'http://' + url)
+        key = (parsed.hostname, parsed.port or 80)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        connection = self._take(key)
+        reused = connection is not None
+        while True:
+            started = self.clock()
+            try:
+                if connection is None:
+                    connection = httplib.HTTPConnection(key[0], key[1], timeout=self.timeout)
+                    connection.connect()
+                    # Small requests must not wait on Nagle's algorithm
+                    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.request('GET', path, headers={'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                if connection is not None:
+                    connection.close()
+                if not reused:
+                    raise
+                connection = None
+                reused = False
+                continue
+            seconds = self.clock() - started
+            # will_close also covers HTTP/1.0 servers that never keep connections
+            if response.will_close:
+                connection.close()
+            else:
+                self._put(key, connection)
+            return response.status, body, seconds, reused
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _take(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            return connections.pop() if connections else None
+
+    def _put(self, key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+
+class LoadTest(object):
+    """ Drives concurrent keep-alive HTTP GETs at a URL for a fixed duration
+
+    Each of the concurrency workers owns one persistent connection.  With a
+    rate (requests per second) the send times follow a fixed schedule shared
+    by all workers; without one every worker sends as fast as it can.
+    """
+
+    def __init__(self, url, concurrency=10, rate=None, duration=30.0, timeout=10.0,
+                 expected_text=None, clock=time.time, sleep=time.sleep):
+        parsed = urlparse.urlparse(url if '://' in url else 'http://' + url)
+        if parsed.scheme != 'http':
+            raise ValueError('Only http:// URLs can be load tested: %s' % url)
+        self.url = parsed.geturl()
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or '/'
+        if parsed.query:
+            self.path += '?' + parsed.query
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.timeout = timeout
+        self.expected_text = expected_text
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._started = None
+        self._sent = 0
+
+    def next_send_time(self):
+        """ Return when the next request should be sent, or None when done """
+
+        with self._lock:
+            now = self.clock()
+            if now - self._started >= self.duration:
+                return None
+            if not self.rate:
+                return now
+            scheduled = self._started + self._sent / float(self.rate)
+            if scheduled - self._started >= self.duration:
+                return None
+            self._sent += 1
+            return scheduled
+
+    def run(self):
+        """ Run the load test and return its results as a dict """
+
+        self._started = self.clock()
+        self._sent = 0
+        workers = [LoadTestWorker(self) for i in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = self.clock() - self._started
+
+        histogram = LatencyHistogram()
+        statuses = {}
+        requests = errors = 0
+        for worker in workers:
+            histogram.merge(worker.histogram)
+            requests += worker.requests
+            errors += worker.errors
+            for status, count in worker.statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+        return {
+            'url': self.url,
+            'concurrency': self.concurrency,
+            'target_rate': self.rate,
+            'duration_seconds': elapsed,
+            'requests': requests,
+            'errors': errors,
+            'error_rate': float(errors) / requests if requests else 0.0,
+            'throughput_rps': requests / elapsed if elapsed else 0.0,
+            'statuses': statuses,
+            'latency_ms': {
+                'mean': histogram.mean() * 1000.0,
+                'p50': histogram.percentile(50) * 1000.0,
+                'p90': histogram.percentile(90) * 1000.0,
+                'p99': histogram.percentile(99) * 1000.0,
+                'max': histogram.max * 1000.0
+            }
+        }
+
+
+def format_results(results):
+    """ Return a human readable summary of load test results """
+
+    latency = results['latency_ms']
+    return '\n'.join([
+        'Load test of %s' % results['url'],
+        '  Concurrency      : %d' % results['concurrency'],
+        '  Target rate      : %s' % (('%s req/s' % results['target_rate'])
+                                     if results['target_rate'] else 'unlimited'),
+        '  Duration         : %.1f s' % results['duration_seconds'],
+        '  Requests         : %d' % results['requests'],
+        '  Throughput       : %.1f req/s' % results['throughput_rps'],
+        '  Errors           : %d (%.2f%%)' % (results['errors'], results['error_rate'] * 100.0),
+        '  Latency (ms)     : p50 %.1f  p90 %.1f  p99 %.1f  max %.1f  mean %.1f' % (
+            latency['p50'], latency['p90'], latency['p99'], latency['max'], latency['mean'])
+    ])
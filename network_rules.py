@@ -0,0 +1,240 @@
+import collections
+
+
+# A port range to open, in the Network ACL (inbound and outbound) and/or
+#     as an inbound Security Group rule; a Security Group rule may be open to
+#     a managed prefix list instead of a CIDR, and then counts as weight rules
+NetworkRule = collections.namedtuple('NetworkRule', [
+    'name',
+    'from_port',
+    'to_port',
+    'protocol',
+    'cidr',
+    'nacl',
+    'security_group',
+    'prefix_list',
+    'weight'
+])
+
+# A compiled Network ACL entry
+NaclEntry = collections.namedtuple('NaclEntry', [
+    'logical_id',
+    'rule_number',
+    'protocol',
+    'from_port',
+    'to_port',
+    'egress',
+    'cidr'
+])
+
+PROTOCOL_NUMBERS = {
+    'tcp': 6,
+    'udp': 17
+}
+
+# Network ACL rule numbers are assigned in rule table order
+RULE_NUMBER_START = 100
+RULE_NUMBER_STEP = 100
+MAX_RULE_NUMBER = 32766
+
+# Default AWS quotas: entries per Network ACL direction, and inbound rules per
+#     Security Group
+NACL_ENTRY_LIMIT = 20
+SECURITY_GROUP_RULE_LIMIT = 60
+
+# A Security Group rule that refers to a managed prefix list counts against
+#     the limit as the prefix list's maximum number of entries, by name
+PREFIX_LIST_WEIGHTS = {
+    'com.amazonaws.global.cloudfront.origin-facing': 55
+}
+
+# Merged rules with more names than this are named after the first and last
+MAX_MERGED_NAMES = 3
+
+
+class RuleLimitError(ValueError):
+    """ Raised when compiled rules do not fit within an AWS limit """
+
+
+def network_rule(name, from_port, to_port=None, protocol='tcp', cidr='0.0.0.0/0',
+                 nacl=True, security_group=False, prefix_list=None, weight=1):
+    """ Return a NetworkRule; to_port defaults to from_port for a single port """
+
+    if to_port is None:
+        to_port = from_port
+    if protocol not in PROTOCOL_NUMBERS:
+        raise ValueError('Unsupported protocol "%s" for rule "%s"' % (protocol, name))
+    if not 0 <= from_port <= to_port <= 65535:
+        raise ValueError('Invalid port range %s-%s for rule "%s"' % (from_port, to_port, name))
+    if prefix_list is not None:
+        if nacl:
+            raise ValueError('Network ACL entries cannot use prefix list for rule "%s"' % name)
+        cidr = None
+    elif weight != 1:
+        raise ValueError('Only a prefix list rule can count as several rules for rule "%s"' %
+                         name)
+    return NetworkRule(name, from_port, to_port, protocol, cidr, nacl, security_group,
+                       prefix_list, weight)
+
+
+def restrict_to_prefix_list(rules, prefix_list, port, weight=1):
+    """ Return the rules with the Security Group part of each rule that opens
+    port only open to the managed prefix list, which counts as weight rules
+
+    Their Network ACL entries are kept as they are, since Network ACLs cannot
+    refer to prefix lists.
+    """
+
+    restricted = []
+    for rule in rules:
+        if rule.security_group and rule.from_port <= port <= rule.to_port:
+            if rule.nacl:
+                restricted.append(rule._replace(security_group=False))
+            restricted.append(rule._replace(cidr=None, nacl=False, prefix_list=prefix_list,
+                                            weight=weight))
+        else:
+            restricted.append(rule)
+    return restricted
+
+
+def close_security_group_port(rules, port):
+    """ Return the rules without the Security Group part of each rule that
+    opens port, for a port that is opened to another Security Group instead
+
+    Their Network ACL entries are kept as they are.
+    """
+
+    closed = []
+    for rule in rules:
+        if rule.security_group and rule.from_port <= port <= rule.to_port:
+            if rule.nacl:
+                closed.append(rule._replace(security_group=False))
+        else:
+            closed.append(rule)
+    return closed
+
+
+def merge_rules(rules):
+    """ Merge rules whose port ranges overlap or are adjacent
+
+    Only rules with the same protocol and CIDR (or prefix list) are merged.  The merged rules
+    keep the order in which their first member appears in rules, so adding a
+    rule to the end of a table never renumbers the entries before it.
+    """
+
+    groups = collections.OrderedDict()
+    for index, rule in enumerate(rules):
+        groups.setdefault((rule.protocol, rule.cidr, rule.prefix_list), []).append((index, rule))
+
+    merged = []
+    for (protocol, cidr, prefix_list), members in groups.items():
+        members.sort(key=lambda member: (member[1].from_port, member[1].to_port))
+        current = None
+        for index, rule in members:
+            if current is not None and rule.from_port <= current['to_port'] + 1:
+                current['to_port'] = max(current['to_port'], rule.to_port)
+                current['first'] = min(current['first'], index)
+                current['members'].append((index, rule.name))
+                current['nacl'] = current['nacl'] or rule.nacl
+                current['security_group'] = current['security_group'] or rule.security_group
+                current['weight'] = max(current['weight'], rule.weight)
+            else:
+                current = {
+                    'first': index,
+                    'from_port': rule.from_port,
+                    'to_port': rule.to_port,
+                    'protocol': protocol,
+                    'cidr': cidr,
+                    'prefix_list': prefix_list,
+                    'members': [(index, rule.name)],
+                    'nacl': rule.nacl,
+                    'security_group': rule.security_group,
+                    'weight': rule.weight
+                }
+                merged.append(current)
+
+    merged.sort(key=lambda group: group['first'])
+    return [NetworkRule(_merged_name([name for index, name in sorted(group['members'])]),
+                        group['from_port'], group['to_port'], group['protocol'],
+                        group['cidr'], group['nacl'], group['security_group'],
+                        group['prefix_list'], group['weight'])
+            for group in merged]
+
+
+def compile_nacl_entries(rules):
+    """ Return the inbound and outbound NaclEntry list for the NACL rules """
+
+    merged = merge_rules([rule for rule in rules if rule.nacl])
+    if len(merged) > NACL_ENTRY_LIMIT:
+        raise RuleLimitError('%d Network ACL entries per direction exceed the limit of %d' %
+                             (len(merged), NACL_ENTRY_LIMIT))
+    if RULE_NUMBER_START + RULE_NUMBER_STEP * (len(merged) - 1) > MAX_RULE_NUMBER:
+        raise RuleLimitError('Network ACL rule numbers would exceed %d' % MAX_RULE_NUMBER)
+
+    entries = []
+    for direction, egress in [('Inbound', False), ('Outbound', True)]:
+        for index, rule in enumerate(merged):
+            entries.append(NaclEntry('%s%sNetworkAclEntry' % (direction, rule.name),
+                                     RULE_NUMBER_START + RULE_NUMBER_STEP * index,
+                                     rule.protocol, rule.from_port, rule.to_port,
+                                     egress, rule.cidr))
+    return entries
+
+
+def compile_security_group_rules(rules):
+    """ Return the merged inbound Security Group rules
+
+    A prefix list rule counts against SECURITY_GROUP_RULE_LIMIT as its weight.
+    """
+
+    merged = merge_rules([rule for rule in rules if rule.security_group])
+    count = sum(rule.weight for rule in merged)
+    if count > SECURITY_GROUP_RULE_LIMIT:
+        raise RuleLimitError('%d Security Group rules exceed the limit of %d' %
+                             (count, SECURITY_GROUP_RULE_LIMIT))
+    return merged
+
+
+def network_acl_entries(network_acl, rules):
+    """ Return the NetworkAclEntry resources for a Network ACL """
+
+    # troposphere is only imported once a template is actually built
+    from troposphere import Ref
+    from troposphere.ec2 import NetworkAclEntry, PortRange
+
+    return [
+        NetworkAclEntry(
+            entry.logical_id,
+            NetworkAclId=Ref(network_acl),
+            RuleNumber=str(entry.rule_number),
+            Protocol=PROTOCOL_NUMBERS[entry.protocol],
+            PortRange=PortRange(To=str(entry.to_port), From=str(entry.from_port)),
+            Egress='true' if entry.egress else 'false',
+            RuleAction='allow',
+            CidrBlock=entry.cidr)
+        for entry in compile_nacl_entries(rules)
+    ]
+
+
+def security_group_rules(rules):
+    """ Return the SecurityGroupRule list for a Security Group's ingress """
+
+    from troposphere.ec2 import SecurityGroupRule
+
+    sg_rules = []
+    for rule in compile_security_group_rules(rules):
+        if rule.prefix_list is not None:
+            source = {'SourcePrefixListId': rule.prefix_list}
+        else:
+            source = {'CidrIp': rule.cidr}
+        sg_rules.append(SecurityGroupRule(IpProtocol=rule.protocol,
+                                          ToPort=str(rule.to_port),
+                                          FromPort=str(rule.from_port),
+                                          **source))
+    return sg_rules
+
+
+def _merged_name(names):
+    if len(names) <= MAX_MERGED_NAMES:
+        return 'And'.join(names)
+    return '%sThrough%s' % (names[0], names[-1])
@@ -1,72 +1,563 @@
 import argparse
+import collections
+import json
+import os
+import re
+import sys
 import time
-import boto3
 import botocore
-from troposphere import Base64, GetAtt, Join, Output, Ref, Tags, Template
-from troposphere.ec2 import Instance, InternetGateway, NetworkAcl, \
-    NetworkAclEntry, NetworkInterfaceProperty, PortRange, Route, \
-    RouteTable, SecurityGroup, SecurityGroupRule, Subnet, \
-    SubnetNetworkAclAssociation, SubnetRouteTableAssociation, VPC, \
-    VPCGatewayAttachment
+import aws_session
+from ami_resolver import AMI_PARAMETER, AMI_PARAMETER_REFERENCE, AmiResolutionError, \
+    AmiResolver, DEFAULT_TTL as DEFAULT_AMI_TTL
+from aws_calls import client_request_token, format_call_stats, stats_since
+from instance_types import GP3_BASELINE_IOPS, GP3_BASELINE_THROUGHPUT, INSTANCE_FAMILIES, \
+    PLACEMENT_STRATEGIES, instance_capabilities, validate_gp3_volume, validate_placement
+from network_rules import close_security_group_port, network_acl_entries, network_rule, \
+    restrict_to_prefix_list, security_group_rules, PREFIX_LIST_WEIGHTS
+from provisioning_timer import ProvisioningTimer
+from stack_state import StackState, record_stack
+from stack_poller import StackPoller, wait_for_change_set
+from template_cache import TemplateCache, ValidationCache, content_hash
+from url_probe import probe_url
+from webserver_profiles import PROFILES, render_user_data
 
 
 # Define some constants to use
 # TODO: Consider passing the following values in as optional command line args
 VPC_CIDR = '10.0.0.0/16'
 SUBNET_CIDR = '10.0.0.0/24'
+FLEET_SUBNET_CIDRS = [SUBNET_CIDR, '10.0.1.0/24', '10.0.2.0/24', '10.0.3.0/24']
 PROJECT = 'Jonathan Strohl\'s Mini-Project'
 NAME_PREFIX = 'jstrohl-miniproject-'
 STACK_NAME = NAME_PREFIX + 'stack'
+CHANGE_SET_PREFIX = NAME_PREFIX + 'update-'
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.' + NAME_PREFIX + 'cache')
+VALIDATION_CACHE_FILE = os.path.join(CACHE_DIR, 'validated_templates.json')
+TIMINGS_FILE = os.path.join(CACHE_DIR, 'timings.jsonl')
+AMI_CACHE_FILE = os.path.join(CACHE_DIR, 'amis.json')
+STATE_FILE = os.path.join(CACHE_DIR, 'stacks.json')
+EXPECTED_TEXT = 'Automation for the People'
 
-# TODO: Consider adding more supported regions, in addition to US
-supported_regions_ami_map = {
-                             'us-east-1' : 'ami-b73b63a0',
-                             'us-east-2' : 'ami-58277d3d',
-                             'us-west-1' : 'ami-23e8a343',
-                             'us-west-2' : '8mi-5ec1673e'
-                            }
+# Seconds to wait for the Web Server to report that it is serving its page
+DEFAULT_READY_TIMEOUT = 900
 
-def provision_environment(id, secret, key_pair, region, type_instance):
-    """ Provision the web server cloud environment """
-    
-    validate_key_pair(id, secret, key_pair, region)
-    template = create_template(key_pair, region, type_instance)
-    create_stack(id, secret, key_pair, region, template)
+# Ports opened for the Web Server: Network ACL rules apply to both directions
+#     and Security Group rules are inbound (see network_rules.py)
+WEB_SERVER_RULES = [
+    network_rule('HTTP', 80, security_group=True),
+    network_rule('HTTPS', 443),
+    network_rule('SSH', 22, security_group=True),
+    network_rule('ResponsePorts', 1024, 65535)
+]
+LOAD_BALANCER_RULES = [
+    network_rule('HTTP', 80, nacl=False, security_group=True)
+]
+
+# AWS Region IDs look like "us-east-1", "eu-central-1" or "us-gov-west-1"
+REGION_PATTERN = re.compile(r'^[a-z]{2}(-gov|-iso[a-z]*)?-[a-z]+-\d+$')
+
+# Image ID used when the current AMI cannot be looked up (see ami_resolver.py)
+#     or when no AWS calls are made: Cloud Formation then reads the AMI ID
+#     from the SSM public parameter itself, in any region
+fallback_image_id = AMI_PARAMETER_REFERENCE
+
+# Web server fleet settings (an Auto Scaling group behind a load balancer)
+FleetConfig = collections.namedtuple('FleetConfig', [
+    'min_size',
+    'max_size',
+    'desired_capacity',
+    'zone_count',
+    'scaling_metric',
+    'scaling_target'
+])
+SCALING_METRICS = {
+    'cpu' : 'ASGAverageCPUUtilization',
+    'requests' : 'ALBRequestCountPerTarget'
+}
+DEFAULT_SCALING_TARGETS = {
+    'cpu' : 50.0,
+    'requests' : 1000.0
+}
+
+# CloudFront caching tier settings: cache TTLs in seconds, whether responses
+#     are compressed, the edge locations used, and the ID of the managed
+#     prefix list that the origin only accepts HTTP from
+CdnConfig = collections.namedtuple('CdnConfig', [
+    'min_ttl',
+    'default_ttl',
+    'max_ttl',
+    'compress',
+    'price_class',
+    'origin_prefix_list'
+])
+CDN_PRICE_CLASSES = ['PriceClass_100', 'PriceClass_200', 'PriceClass_All']
+DEFAULT_CDN_TTL = 3600
+DEFAULT_CDN_MAX_TTL = 24 * 60 * 60
+CDN_ORIGIN_PORT = 80
+
+# Managed prefix list of the addresses CloudFront reaches origins from, and
+#     its known IDs, used only when it cannot be looked up or when no AWS
+#     calls are made
+CLOUDFRONT_PREFIX_LIST = 'com.amazonaws.global.cloudfront.origin-facing'
+fallback_cloudfront_prefix_lists = {
+                                    'us-east-1' : 'pl-3b927c52',
+                                    'us-east-2' : 'pl-b6a144df',
+                                    'us-west-1' : 'pl-4ea04527',
+                                    'us-west-2' : 'pl-82a045eb'
+                                   }
+
+# Web Server Instance tuning: the gp3 root volume's size (GiB), IOPS and
+#     throughput (MiB/s), the CPU credit option of T-series types (or None
+#     for the type's own default), and the strategy of a placement group for
+#     the Instances (or None)
+InstanceOptions = collections.namedtuple('InstanceOptions', [
+    'root_volume_size',
+    'root_volume_iops',
+    'root_volume_throughput',
+    'cpu_credits',
+    'placement_strategy'
+])
+CPU_CREDIT_OPTIONS = ['standard', 'unlimited']
+
+# Root device of the Amazon Linux 2023 AMI, and the size of its snapshot in GiB
+ROOT_DEVICE_NAME = '/dev/xvda'
+DEFAULT_ROOT_VOLUME_SIZE = 8
+
+# Availability Zones (one public Subnet each) of a new shared network Stack
+DEFAULT_NETWORK_ZONES = 2
+
+# References to the networking a web tier is built on: resources in the same
+#     Template, or values imported from a shared network Stack (which has no
+#     logical IDs for the web tier to depend on)
+Network = collections.namedtuple('Network', [
+    'vpc',
+    'subnets',
+    'security_group',
+    'gateway_attachment',
+    'route'
+])
+
+# Stack names must start with a letter and hold only letters, digits and dashes
+STACK_NAME_PATTERN = re.compile(r'^[A-Za-z][-A-Za-z0-9]{0,127}$')
+
+# Outcome of creating or updating a Stack: the final Stack status (or the
+#     step that failed), whether it succeeded, its Outputs and any error
+StackResult = collections.namedtuple('StackResult', [
+    'status',
+    'succeeded',
+    'outputs',
+    'error'
+])
+
+
+class ProvisioningError(Exception):
+    """ Raised when the environment cannot be provisioned as requested """
+
+# Built templates and the bodies that already passed validate_template
+template_cache = TemplateCache()
+validation_cache = ValidationCache(VALIDATION_CACHE_FILE)
+ami_resolver = AmiResolver(AMI_CACHE_FILE)
+
+# IDs, Outputs and physical resource IDs of the Stacks provisioned from here
+stack_state = StackState(STATE_FILE)
+
+# Stack statuses after which the Stack's resources are in place
+SETTLED_STATUSES = frozenset(['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UP_TO_DATE'])
+
+
+def provision_environment(id, secret, key_pair, region, type_instance, fleet=None,
+                          web_profile='default', defer_update=False,
+                          ready_timeout=DEFAULT_READY_TIMEOUT, timings_file=TIMINGS_FILE,
+                          image_id=None, stack_name=STACK_NAME, network_stack=None,
+                          network_zones=DEFAULT_NETWORK_ZONES, update_network=False,
+                          cdn=None, instance=None):
+    """ Provision the web server cloud environment and return its StackResult
+
+    Displays how long each phase and Stack resource took (and how many AWS
+    API calls were retried) when done, and appends the same timings to
+    timings_file as JSON lines (unless None).  Once built, the Stack's ID,
+    Outputs and physical resource IDs are recorded in stack_state.
+    The current Amazon Linux 2023 AMI is looked up unless an image_id is given.
+    With a network_stack name, the Stack only holds the web tier and the
+    network Stack is created first if it does not exist (see
+    ensure_network_stack); the network Stack is timed separately, so its
+    phases are not counted twice in the total.  With a CdnConfig, the
+    CloudFront origin prefix list is looked up unless the CdnConfig names one.
+    Raises ProvisioningError when the key pair, network Stack or prefix list
+    cannot be used.
+    """
+
+    timer = ProvisioningTimer()
+    network_timer = ProvisioningTimer()
+    call_stats = aws_session.get_call_policy().stats()
+    with timer.phase('validate_key_pair'):
+        validate_key_pair(id, secret, key_pair, region)
+    if image_id is None:
+        with timer.phase('resolve_ami'):
+            image_id = resolve_image_id(id, secret, region)
+    if cdn is not None and cdn.origin_prefix_list is None:
+        with timer.phase('resolve_prefix_list'):
+            cdn = cdn._replace(origin_prefix_list=resolve_origin_prefix_list(id, secret, region))
+    result = None
+    if network_stack is not None:
+        with timer.phase('network_stack'):
+            result = ensure_network_stack(id, secret, region, network_stack,
+                                          max(network_zones, _zone_count(fleet)),
+                                          _zone_count(fleet), update_network, network_timer)
+    if result is None or result.succeeded:
+        template, template_body = render_template(key_pair, region, type_instance, fleet,
+                                                  web_profile, defer_update, ready_timeout,
+                                                  timer, image_id, network_stack, cdn,
+                                                  instance)
+        result = create_stack(id, secret, key_pair, region, template_body, ready_timeout,
+                              timer, stack_name)
+        if result.status in SETTLED_STATUSES:
+            with timer.phase('record_state'):
+                save_stack_state(id, secret, region, stack_name, network_stack)
+
+    # The network Stack's own phases all happened within the network_stack phase
+    if network_timer.phases:
+        print 'Network Stack "%s":\n%s' % (network_stack, network_timer.summary())
+    print timer.summary()
+    print format_call_stats(stats_since(aws_session.get_call_policy().stats(), call_stats))
+    if timings_file:
+        context = {'stack_name': stack_name,
+                   'region': region,
+                   'type_instance': type_instance,
+                   'fleet': fleet is not None,
+                   'web_profile': web_profile,
+                   'network_stack': network_stack,
+                   'cdn': cdn is not None}
+        try:
+            if network_timer.phases:
+                network_timer.write_jsonl(timings_file, dict(context, stack_name=network_stack))
+            timer.write_jsonl(timings_file, context)
+        except (IOError, OSError), err:
+            print 'Could not write timings to "%s": %s' % (timings_file, err)
+    return result
 
 
 def validate_key_pair(id, secret, key_pair, region):
     """ Make sure the specified key pair exists in the specified region """
 
-    # Create boto3 client for AWS EC2
-    client = boto3.client('ec2',
-                          aws_access_key_id=id,
-                          aws_secret_access_key=secret,
-                          region_name=region)
+    # Get the shared boto3 client for AWS EC2
+    client = aws_session.get_client('ec2', region, id, secret)
 
-    # Look for specified AWS key pair in this region
+    # Look for specified AWS key pair in this region; throttling and transient
+    #     errors were already retried, so anything else is a real failure
     try:
         kp = client.describe_key_pairs(KeyNames=[key_pair])
-    except:
-        print '\n"%s" is not an existing key pair in AWS Region "%s".' % (key_pair, region)
-        print 'Select an existing key pair defined in your AWS Account for this region.\n'
-        exit(0)
+    except botocore.exceptions.ClientError, err:
+        if err.response['Error']['Code'] == 'InvalidKeyPair.NotFound':
+            raise ProvisioningError(
+                '"%s" is not an existing key pair in AWS Region "%s".\n'
+                'Select an existing key pair defined in your AWS Account for this region.' %
+                (key_pair, region))
+        raise ProvisioningError('Could not look up key pair "%s" in AWS Region "%s": %s' %
+                                (key_pair, region, err))
+    except botocore.exceptions.BotoCoreError, err:
+        raise ProvisioningError('Could not look up key pair "%s" in AWS Region "%s": %s' %
+                                (key_pair, region, err))
+
+
+def ensure_network_stack(id, secret, region, network_stack, zone_count=DEFAULT_NETWORK_ZONES,
+                         required_zones=1, update=False, timer=None):
+    """ Make sure the shared network Stack exists and return its StackResult
+
+    An existing network Stack is reused as it is (after waiting for any
+    operation in progress to settle) unless update is set; a missing one is
+    created with zone_count Subnets.  Raises ProvisioningError when it exports
+    fewer than required_zones Subnets.
+    """
+
+    timer = timer or ProvisioningTimer()
+    client = aws_session.get_client('cloudformation', region, id, secret)
+    stack = None
+    try:
+        stack = client.describe_stacks(StackName=network_stack)['Stacks'][0]
+    except botocore.exceptions.ClientError, err:
+        if 'does not exist' not in err.response['Error']['Message']:
+            print 'Could not look up network Stack "%s": ' \
+                  '%s' % (network_stack, err.response['Error']['Message'])
+            return StackResult('DESCRIBE_FAILED', False, {}, err.response['Error']['Message'])
+
+    # Another run may be creating the same network Stack, so let it finish
+    if stack is not None and stack['StackStatus'].endswith('_IN_PROGRESS'):
+        print 'Waiting for network Stack "%s" (%s)...' % (network_stack, stack['StackStatus'])
+        StackPoller(client, stack['StackId']).wait()
+        stack = client.describe_stacks(StackName=stack['StackId'])['Stacks'][0]
+
+    if stack is None or update:
+        template, template_body = render_network_template(zone_count, timer)
+        result = create_stack(id, secret, None, region, template_body, None, timer,
+                              network_stack)
+        if not result.succeeded:
+            return result
+        save_stack_state(id, secret, region, network_stack)
+    elif stack['StackStatus'] not in ('CREATE_COMPLETE', 'UPDATE_COMPLETE'):
+        print 'Network Stack "%s" cannot be used: %s' % (network_stack, stack['StackStatus'])
+        return StackResult(stack['StackStatus'], False, {},
+                           'Network Stack is %s' % stack['StackStatus'])
+    else:
+        result = StackResult('REUSED', True, get_stack_outputs(client, stack['StackId']), None)
+        print 'Using network Stack "%s" (VPC %s)' % (network_stack, result.outputs.get('VPC'))
+        recorded = stack_state.get(region, network_stack)
+        if recorded is None or recorded['stack_id'] != stack['StackId']:
+            save_stack_state(id, secret, region, network_stack)
+
+    subnet_count = network_subnet_count(result.outputs)
+    if subnet_count < required_zones:
+        raise ProvisioningError(
+            'Network Stack "%s" exports %d Subnet(s) but the fleet needs %d.\n'
+            'Update it with --update_network --network_zones %d first.' %
+            (network_stack, subnet_count, required_zones, required_zones))
+    return result
+
+
+def save_stack_state(id, secret, region, stack_name, network_stack=None):
+    """ Record the Stack's ID, Outputs and physical resource IDs in stack_state
+
+    The state only saves later lookups, so failing to read it is reported
+    but does not fail the run.
+    """
+
+    try:
+        record_stack(stack_state, id, secret, region, stack_name, network_stack)
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError), err:
+        print 'Could not record the state of Stack "%s": %s' % (stack_name, err)
+
+
+def write_template(key_pair, region, type_instance, fleet=None, web_profile='default',
+                   defer_update=False, ready_timeout=DEFAULT_READY_TIMEOUT, image_id=None,
+                   output=None, network_stack=None, cdn=None, instance=None):
+    """ Write the Template JSON to the output file (or stdout) without calling AWS
+
+    Without an image_id, a still fresh AMI from the lookup cache or else
+    fallback_image_id is used.  Likewise, a CdnConfig without a
+    prefix list uses the last known CloudFront prefix list for the region.
+    """
+
+    if image_id is None:
+        image_id = ami_resolver.cache.get(region) or fallback_image_id
+    if cdn is not None and cdn.origin_prefix_list is None:
+        if region not in fallback_cloudfront_prefix_lists:
+            sys.stderr.write('No CloudFront prefix list is known for "%s" without contacting '
+                             'AWS; pass one with --origin_prefix_list.\n' % region)
+            exit(1)
+        cdn = cdn._replace(origin_prefix_list=fallback_cloudfront_prefix_lists[region])
+
+    template, template_body = render_template(key_pair, region, type_instance, fleet,
+                                              web_profile, defer_update, ready_timeout,
+                                              image_id=image_id, network_stack=network_stack,
+                                              cdn=cdn, instance=instance)
+    write_body(template_body, output)
+
 
+def write_network_template(zone_count=DEFAULT_NETWORK_ZONES, output=None):
+    """ Write the network Stack Template JSON to the output file (or stdout) """
 
-def create_template(key_pair, region, type_instance):
-    """ Create the Cloud Formation Template """
+    template, template_body = render_network_template(zone_count)
+    write_body(template_body, output)
+
+
+def write_body(template_body, output=None):
+    """ Write a Template body to the output file (or stdout) """
+
+    if output:
+        with open(output, 'w') as output_file:
+            output_file.write(template_body)
+    else:
+        print template_body
+
+
+def resolve_image_id(id, secret, region):
+    """ Return the current Amazon Linux 2023 AMI ID for the specified region
+
+    When the AMI cannot be looked up, Cloud Formation is left to resolve it.
+    """
+
+    try:
+        return ami_resolver.resolve(id, secret, region)
+    except AmiResolutionError, err:
+        print 'WARNING: %s\nCloud Formation will read the AMI ID from "%s" instead.' % (
+            err, AMI_PARAMETER)
+        return fallback_image_id
+
+
+def resolve_origin_prefix_list(id, secret, region):
+    """ Return the ID of the CloudFront origin-facing prefix list in the region """
+
+    client = aws_session.get_client('ec2', region, id, secret)
+    error = 'it was not found'
+    try:
+        prefix_lists = client.describe_managed_prefix_lists(Filters=[{
+            'Name': 'prefix-list-name',
+            'Values': [CLOUDFRONT_PREFIX_LIST]
+        }])['PrefixLists']
+        if prefix_lists:
+            return prefix_lists[0]['PrefixListId']
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError), err:
+        error = err
+    if region in fallback_cloudfront_prefix_lists:
+        print 'WARNING: Could not look up prefix list "%s" (%s).\nUsing the last known ' \
+              'ID "%s" instead.' % (CLOUDFRONT_PREFIX_LIST, error,
+                                    fallback_cloudfront_prefix_lists[region])
+        return fallback_cloudfront_prefix_lists[region]
+    raise ProvisioningError('Could not look up prefix list "%s" in AWS Region "%s": %s' %
+                            (CLOUDFRONT_PREFIX_LIST, region, error))
+
+
+def create_template(key_pair, region, type_instance, fleet=None,
+                    web_profile='default', defer_update=False, ready_timeout=None,
+                    image_id=None, network_stack=None, cdn=None, instance=None):
+    """ Create the Cloud Formation Template
+
+    By default the web server is a single EC2 Instance; when a FleetConfig is
+    given it is an Auto Scaling group spread over several Availability Zones
+    behind an Application Load Balancer instead.  The web_profile and
+    defer_update options select the UserData (see webserver_profiles.py).
+
+    With a ready_timeout (in seconds), the web server has a CreationPolicy and
+    only signals Cloud Formation once httpd is serving the page, so the Stack
+    is not complete until the web server is.
+
+    image_id is the AMI to launch; without one fallback_image_id is used.
+
+    With a network_stack name, the Template only holds the web tier and
+    imports the VPC, Subnets and Security Group exported by that Stack (see
+    create_network_template).
+
+    With a CdnConfig, a CloudFront distribution caches the web server (or
+    the fleet's load balancer), the URL Output is the CDN's and OriginURL is
+    the web server's own, and the origin only accepts HTTP from CloudFront.
+
+    The Instances are tuned for their type with the InstanceOptions (see
+    instance_properties), by default a baseline gp3 root volume, with
+    T-series types keeping their own CPU credit option (standard for t2).
+    """
+
+    # troposphere is imported here rather than at module load, so that "--help"
+    #     and argument errors do not pay for importing it
+    from troposphere import GetAtt, Ref, Tags, Template
+    from troposphere.ec2 import Instance, NetworkInterfaceProperty
+    from troposphere.policies import CreationPolicy, ResourceSignal
+
+    if image_id is None:
+        image_id = fallback_image_id
+    if cdn is not None and cdn.origin_prefix_list is None:
+        raise ValueError('No CloudFront origin prefix list was given')
+    if instance is None:
+        instance = instance_options(type_instance, fleet=fleet)
+
+    user_data = render_user_data(web_profile, type_instance, defer_update,
+                                 _signal_resource(fleet, ready_timeout))
 
     # Create references for the CFT
     ref_stack_id = Ref('AWS::StackId')
-    ref_region = Ref('AWS::Region')
-    ref_stack_name = Ref('AWS:StackName')
 
     # Add the template header
     t = Template()
     t.add_version('2010-09-09')
-    t.add_description(PROJECT + ": " +\
-        'AWS Cloud Formation Template for creating a custom VPC with '\
-        'public subnet to host a simple web server on a single EC2 instance '\
-        'with a security group that allows public HTTP and SSH traffic.')
+    if network_stack is not None:
+        t.add_description(PROJECT + ": " +\
+            'AWS Cloud Formation Template for creating the web tier of a simple '\
+            'web server in the VPC exported by the "%s" network Stack.' % network_stack)
+    elif fleet is None:
+        t.add_description(PROJECT + ": " +\
+            'AWS Cloud Formation Template for creating a custom VPC with '\
+            'public subnet to host a simple web server on a single EC2 instance '\
+            'with a security group that allows public HTTP and SSH traffic.')
+    else:
+        t.add_description(PROJECT + ": " +\
+            'AWS Cloud Formation Template for creating a custom VPC with '\
+            'public subnets in several Availability Zones to host a simple web '\
+            'server on an Auto Scaling group of EC2 instances behind an '\
+            'Application Load Balancer.')
+
+    # Behind a CDN, a single Web Server only takes HTTP from CloudFront, and a
+    #     fleet's Instances only from the load balancer (see add_webserver_fleet)
+    web_server_rules = WEB_SERVER_RULES
+    if cdn is not None and fleet is None:
+        web_server_rules = restrict_to_prefix_list(WEB_SERVER_RULES, cdn.origin_prefix_list,
+                                                   CDN_ORIGIN_PORT,
+                                                   PREFIX_LIST_WEIGHTS[CLOUDFRONT_PREFIX_LIST])
+    elif cdn is not None:
+        web_server_rules = close_security_group_port(WEB_SERVER_RULES, CDN_ORIGIN_PORT)
+
+    # Add the VPC and everything around it, or import them from the network Stack
+    if network_stack is None:
+        network = add_network(t, _zone_count(fleet), web_server_rules,
+                              dns_hostnames=cdn is not None)
+    else:
+        network = imported_network(network_stack, _zone_count(fleet))
+        if web_server_rules is not WEB_SERVER_RULES:
+            # The shared Security Group stays open, so the web tier gets its own
+            network = network._replace(security_group=Ref(
+                add_webserver_security_group(t, network.vpc, web_server_rules)))
+
+    # Add the Web Server fleet, or the single Web Server Instance
+    if fleet is not None:
+        add_webserver_fleet(t, fleet, key_pair, image_id, type_instance, user_data,
+                            ready_timeout, network, cdn, instance)
+        return t
+
+    webserver_instance = t.add_resource(
+        Instance(
+            'WebServerInstance',
+            ImageId=image_id,
+            InstanceType=type_instance,
+            KeyName=key_pair,
+            NetworkInterfaces=
+            [
+                NetworkInterfaceProperty(
+                    GroupSet=[network.security_group],
+                    AssociatePublicIpAddress='true',
+                    DeviceIndex='0',
+                    DeleteOnTermination='true',
+                    SubnetId=network.subnets[0])
+            ],
+            UserData=user_data_property(user_data, ready_timeout),
+            Tags=Tags(
+                Application=ref_stack_id,
+                Name=NAME_PREFIX+'webserver',
+                Project=PROJECT),
+            **instance_properties(t, type_instance, instance)))
+    # The Instance installs the web server from the Internet before it signals
+    if network.route:
+        webserver_instance.DependsOn = network.route
+
+    # Wait for the Instance to report that it is serving the page
+    if ready_timeout:
+        webserver_instance.CreationPolicy = CreationPolicy(
+            ResourceSignal=ResourceSignal(
+                Count=1,
+                Timeout='PT%dS' % ready_timeout))
+
+    # Add Outputs to the Template for the VPC ID and URL
+    distribution = None
+    if cdn is not None:
+        distribution = add_cdn(t, cdn, GetAtt(webserver_instance, 'PublicDnsName'))
+    add_outputs(t, network.vpc, GetAtt('WebServerInstance', 'PublicIp'), distribution)
+
+    return t
+
+
+def add_network(t, zone_count, web_server_rules=WEB_SERVER_RULES, dns_hostnames=False):
+    """ Add the VPC, public Subnets, routing, Network ACL and Web Server Security
+    Group to the Template and return the Network that refers to them
+
+    Each of several Subnets is placed in its own Availability Zone.  With
+    dns_hostnames, Instances in the VPC get public DNS names (which a CDN
+    needs to reach them).
+    """
+
+    from troposphere import GetAZs, Ref, Select, Tags
+    from troposphere.ec2 import InternetGateway, NetworkAcl, Route, RouteTable, \
+        Subnet, SubnetNetworkAclAssociation, SubnetRouteTableAssociation, VPC, \
+        VPCGatewayAttachment
+
+    ref_stack_id = Ref('AWS::StackId')
+    ref_region = Ref('AWS::Region')
 
     # Add the VPC
     vpc = t.add_resource(
@@ -77,6 +568,9 @@ def create_template(key_pair, region, type_instance):
                 Application=ref_stack_id,
                 Name=NAME_PREFIX+'vpc',
                 Project=PROJECT)))
+    if dns_hostnames:
+        vpc.EnableDnsSupport = True
+        vpc.EnableDnsHostnames = True
 
     # Add a public Subnet for our web server
     public_subnet = t.add_resource(
@@ -88,6 +582,22 @@ def create_template(key_pair, region, type_instance):
                 Application=ref_stack_id,
                 Name=NAME_PREFIX+'public-subnet',
                 Project=PROJECT)))
+    public_subnets = [public_subnet]
+
+    # A fleet gets one public Subnet per Availability Zone
+    if zone_count > 1:
+        public_subnet.AvailabilityZone = Select(0, GetAZs(ref_region))
+        for index in range(1, zone_count):
+            public_subnets.append(t.add_resource(
+                Subnet(
+                    'Subnet%d' % (index + 1),
+                    CidrBlock=FLEET_SUBNET_CIDRS[index],
+                    AvailabilityZone=Select(index, GetAZs(ref_region)),
+                    VpcId=Ref(vpc),
+                    Tags=Tags(
+                        Application=ref_stack_id,
+                        Name=NAME_PREFIX+'public-subnet-%d' % (index + 1),
+                        Project=PROJECT))))
 
     # Add an IGW for public access
     internet_gateway = t.add_resource(
@@ -124,12 +634,13 @@ def create_template(key_pair, region, type_instance):
             DestinationCidrBlock='0.0.0.0/0',
             RouteTableId=Ref(route_table)))
 
-    # Associate our public Subnet with our public Route Table
-    subnet_route_table_assoc = t.add_resource(
-        SubnetRouteTableAssociation(
-            'SubnetRouteTableAssociation',
-            SubnetId=Ref(public_subnet),
-            RouteTableId=Ref(route_table)))
+    # Associate our public Subnets with our public Route Table
+    for index, subnet in enumerate(public_subnets):
+        t.add_resource(
+            SubnetRouteTableAssociation(
+                'SubnetRouteTableAssociation' + _resource_suffix(index),
+                SubnetId=Ref(subnet),
+                RouteTableId=Ref(route_table)))
 
     # Add a new Network ACL for our public Subnet
     network_acl = t.add_resource(
@@ -141,253 +652,719 @@ def create_template(key_pair, region, type_instance):
                 Name=NAME_PREFIX+'networkacl',
                 Project=PROJECT)))
 
-    # Inbound ACL Rule for HTTP
-    inboundHttpAclEntry = t.add_resource(
-        NetworkAclEntry(
-            'InboundHTTPNetworkAclEntry',
-            NetworkAclId=Ref(network_acl),
-            RuleNumber='100',
-            Protocol=6,
-            PortRange=PortRange(To='80', From='80'),
-            Egress='false',
-            RuleAction='allow',
-            CidrBlock='0.0.0.0/0'))
-
-    # Inbound ACL Rule for HTTPS
-    inboundHttpsAclEntry = t.add_resource(
-        NetworkAclEntry(
-            'InboundHTTPSNetworkAclEntry',
-            NetworkAclId=Ref(network_acl),
-            RuleNumber='200',
-            Protocol=6,
-            PortRange=PortRange(To='443', From='443'),
-            Egress='false',
-            RuleAction='allow',
-            CidrBlock='0.0.0.0/0'))
-
-    # Inbound ACL Rule for SSH
-    inboundSshAclEntry = t.add_resource(
-        NetworkAclEntry(
-            'InboundSSHNetworkAclEntry',
-            NetworkAclId=Ref(network_acl),
-            RuleNumber='300',
-            Protocol=6,
-            PortRange=PortRange(To='22', From='22'),
-            Egress='false',
-            RuleAction='allow',
-            CidrBlock='0.0.0.0/0'))
-
-    # Inbound ACL Rule for Ephemeral Response Ports
-    inboundResponsePortsAclEntry = t.add_resource(
-        NetworkAclEntry(
-            'InboundResponsePortsNetworkAclEntry',
-            NetworkAclId=Ref(network_acl),
-            RuleNumber='400',
-            Protocol=6,
-            PortRange=PortRange(To='65535', From='1024'),
-            Egress='false',
-            RuleAction='allow',
-            CidrBlock='0.0.0.0/0'))
-
-    # Outbound ACL Rule for HTTP
-    outboundHttpAclEntry = t.add_resource(
-        NetworkAclEntry(
-            'OutboundHTTPNetworkAclEntry',
-            NetworkAclId=Ref(network_acl),
-            RuleNumber='100',
-            Protocol=6,
-            PortRange=PortRange(To='80', From='80'),
-            Egress='true',
-            RuleAction='allow',
-            CidrBlock='0.0.0.0/0'))
-
-    # Outbound ACL Rule for HTTPS
-    outboundHttpsAclEntry = t.add_resource(
-        NetworkAclEntry(
-            'OutboundHTTPSNetworkAclEntry',
-            NetworkAclId=Ref(network_acl),
-            RuleNumber='200',
-            Protocol=6,
-            PortRange=PortRange(To='443', From='443'),
-            Egress='true',
-            RuleAction='allow',
-            CidrBlock='0.0.0.0/0'))
-
-    # Outbound ACL Rule for SSH
-    outboundSshAclEntry = t.add_resource(
-        NetworkAclEntry(
-            'OutboundSSHNetworkAclEntry',
-            NetworkAclId=Ref(network_acl),
-            RuleNumber='300',
-            Protocol=6,
-            PortRange=PortRange(To='22', From='22'),
-            Egress='true',
-            RuleAction='allow',
-            CidrBlock='0.0.0.0/0'))
-
-    # Outbound ACL Rule for Ephemeral Response Ports
-    outboundResponsePortsAclEntry = t.add_resource(
-        NetworkAclEntry(
-            'OutboundResponsePortsNetworkAclEntry',
-            NetworkAclId=Ref(network_acl),
-            RuleNumber='400',
-            Protocol=6,
-            PortRange=PortRange(To='65535', From='1024'),
-            Egress='true',
-            RuleAction='allow',
-            CidrBlock='0.0.0.0/0'))
-
-    # Associate our public Subnet with our new Network ACL
-    subnet_network_acl_assoc = t.add_resource(
-        SubnetNetworkAclAssociation(
-            'SubnetNetworkAclAssociation',
-            SubnetId=Ref(public_subnet),
-            NetworkAclId=Ref(network_acl)))
+    # Add the inbound and outbound ACL Rules compiled from the rule table
+    for acl_entry in network_acl_entries(network_acl, web_server_rules):
+        t.add_resource(acl_entry)
+
+    # Associate our public Subnets with our new Network ACL
+    for index, subnet in enumerate(public_subnets):
+        t.add_resource(
+            SubnetNetworkAclAssociation(
+                'SubnetNetworkAclAssociation' + _resource_suffix(index),
+                SubnetId=Ref(subnet),
+                NetworkAclId=Ref(network_acl)))
+
+    webserver_security_group = add_webserver_security_group(t, Ref(vpc), web_server_rules)
+
+    return Network(vpc=Ref(vpc),
+                   subnets=[Ref(subnet) for subnet in public_subnets],
+                   security_group=Ref(webserver_security_group),
+                   gateway_attachment=gateway_attachment.title,
+                   route=public_route.title)
+
+
+def add_webserver_security_group(t, vpc, web_server_rules=WEB_SERVER_RULES):
+    """ Add the Web Server Security Group to the Template """
+
+    from troposphere.ec2 import SecurityGroup
 
     # Add a Security Group for our Web Server
-    webserver_security_group = t.add_resource(
+    return t.add_resource(
         SecurityGroup(
             'SecurityGroup',
             GroupDescription='Web Server SG',
-            SecurityGroupIngress=[
-                SecurityGroupRule(
-                    IpProtocol='tcp',
-                    ToPort='80',
-                    FromPort='80',
-                    CidrIp='0.0.0.0/0'),
-                SecurityGroupRule(
-                    IpProtocol='tcp',
-                    ToPort='22',
-                    FromPort='22',
-                    CidrIp='0.0.0.0/0')],
-            VpcId=Ref(vpc)))
-
-    # Add the Web Server Instance
-    instance = t.add_resource(
-        Instance(
-            'WebServerInstance',
-            ImageId=supported_regions_ami_map[region],
-            InstanceType=type_instance,
-            KeyName=key_pair,
-            NetworkInterfaces=
-            [
-                NetworkInterfaceProperty(
-                    GroupSet=[Ref(webserver_security_group)],
-                    AssociatePublicIpAddress='true',
-                    DeviceIndex='0',
-                    DeleteOnTermination='true',
-                    SubnetId=Ref(public_subnet))
-            ],
-            UserData=Base64(
-                Join(
-                    '\n',
-                    [
-                        '#!/bin/bash -x',
-                        'yum install httpd -y',
-                        'yum update -y',
-                        'echo "<html><h1>Automation for the People</h1></html>" ' \
-                        '> /var/www/html/index.html',
-                        'service httpd start',
-                        'chkconfig httpd on'
-                    ])),
+            SecurityGroupIngress=security_group_rules(web_server_rules),
+            VpcId=vpc))
+
+
+def imported_network(network_stack, zone_count):
+    """ Return the Network that imports the first zone_count Subnets (and the VPC
+    and Security Group) exported by a network Stack
+    """
+
+    from troposphere import ImportValue
+
+    return Network(vpc=ImportValue(network_export(network_stack, 'VPC')),
+                   subnets=[ImportValue(network_export(network_stack, _subnet_output(index)))
+                            for index in range(zone_count)],
+                   security_group=ImportValue(network_export(network_stack, 'SecurityGroup')),
+                   gateway_attachment=None,
+                   route=None)
+
+
+def create_network_template(zone_count=DEFAULT_NETWORK_ZONES):
+    """ Create the Cloud Formation Template for a shared network Stack
+
+    It holds the VPC, one public Subnet per Availability Zone, routing, the
+    Network ACL and the Web Server Security Group, and exports their IDs as
+    "<stack name>-VPC", "<stack name>-Subnet1", ... and
+    "<stack name>-SecurityGroup" for web tier Stacks to import.
+    """
+
+    from troposphere import Export, Output, Sub, Template
+
+    t = Template()
+    t.add_version('2010-09-09')
+    t.add_description(PROJECT + ": " +\
+        'AWS Cloud Formation Template for creating a long-lived custom VPC with '\
+        'public subnets in %d Availability Zone(s) and a web server security group, '\
+        'exported for web tier stacks to share.' % zone_count)
+
+    network = add_network(t, zone_count, dns_hostnames=True)
+    outputs = [('VPC', 'VPC ID', network.vpc)]
+    for index, subnet in enumerate(network.subnets):
+        outputs.append((_subnet_output(index), 'Public Subnet ID %d' % (index + 1), subnet))
+    outputs.append(('SecurityGroup', 'Web Server Security Group ID', network.security_group))
+    t.add_output([
+        Output(name,
+               Description=description,
+               Value=value,
+               Export=Export(Sub('${AWS::StackName}-' + name)))
+        for name, description, value in outputs
+    ])
+    return t
+
+
+def network_export(network_stack, output):
+    """ Name of a value exported by a network Stack """
+
+    return '%s-%s' % (network_stack, output)
+
+
+def network_subnet_count(outputs):
+    """ Number of Subnets a network Stack exports, from its Outputs """
+
+    count = 0
+    while _subnet_output(count) in outputs:
+        count += 1
+    return count
+
+
+def add_webserver_fleet(t, fleet, key_pair, image_id, type_instance, user_data,
+                        ready_timeout, network, cdn=None, instance=None):
+    """ Add the load balanced, auto scaled Web Server fleet to the Template
+
+    With a CdnConfig the load balancer is the CDN's origin, and only takes
+    HTTP from CloudFront; the Instances then only take HTTP from the load
+    balancer, so network.security_group must not already open HTTP.
+    """
+
+    from troposphere import GetAtt, Join, Ref, Tags
+    from troposphere import autoscaling, elasticloadbalancingv2 as elb
+    from troposphere.ec2 import LaunchTemplate, LaunchTemplateData, NetworkInterfaces, \
+        SecurityGroup, SecurityGroupIngress
+    from troposphere.policies import CreationPolicy, ResourceSignal
+
+    ref_stack_id = Ref('AWS::StackId')
+
+    load_balancer_rules = LOAD_BALANCER_RULES
+    if cdn is not None:
+        load_balancer_rules = restrict_to_prefix_list(LOAD_BALANCER_RULES,
+                                                      cdn.origin_prefix_list, CDN_ORIGIN_PORT,
+                                                      PREFIX_LIST_WEIGHTS[CLOUDFRONT_PREFIX_LIST])
+
+    # Add a Security Group for the Load Balancer
+    load_balancer_security_group = t.add_resource(
+        SecurityGroup(
+            'LoadBalancerSecurityGroup',
+            GroupDescription='Web Server Load Balancer SG',
+            SecurityGroupIngress=security_group_rules(load_balancer_rules),
+            VpcId=network.vpc))
+
+    # Behind a CDN, the Instances only take HTTP from the Load Balancer, so
+    #     requests cannot bypass CloudFront
+    if cdn is not None:
+        t.add_resource(
+            SecurityGroupIngress(
+                'WebServerLoadBalancerIngress',
+                GroupId=network.security_group,
+                IpProtocol='tcp',
+                FromPort=str(CDN_ORIGIN_PORT),
+                ToPort=str(CDN_ORIGIN_PORT),
+                SourceSecurityGroupId=Ref(load_balancer_security_group)))
+
+    # Add the internet-facing Application Load Balancer
+    load_balancer = t.add_resource(
+        elb.LoadBalancer(
+            'LoadBalancer',
+            Scheme='internet-facing',
+            Type='application',
+            Subnets=network.subnets,
+            SecurityGroups=[Ref(load_balancer_security_group)],
             Tags=Tags(
+                Application=ref_stack_id,
+                Name=NAME_PREFIX+'alb',
+                Project=PROJECT)))
+    if network.gateway_attachment:
+        load_balancer.DependsOn = network.gateway_attachment
+
+    # Add a Target Group that health checks the Web Server page
+    target_group = t.add_resource(
+        elb.TargetGroup(
+            'TargetGroup',
+            Port='80',
+            Protocol='HTTP',
+            VpcId=network.vpc,
+            HealthCheckPath='/',
+            HealthCheckIntervalSeconds='10',
+            HealthCheckTimeoutSeconds='5',
+            HealthyThresholdCount='2',
+            UnhealthyThresholdCount='3',
+            Matcher=elb.Matcher(HttpCode='200'),
+            Tags=Tags(
+                Application=ref_stack_id,
+                Name=NAME_PREFIX+'targetgroup',
+                Project=PROJECT)))
+
+    # Forward HTTP traffic from the Load Balancer to the Target Group
+    listener = t.add_resource(
+        elb.Listener(
+            'Listener',
+            LoadBalancerArn=Ref(load_balancer),
+            Port='80',
+            Protocol='HTTP',
+            DefaultActions=[
+                elb.Action(
+                    Type='forward',
+                    TargetGroupArn=Ref(target_group))
+            ]))
+
+    # Add a Launch Template with the same Web Server setup as the single Instance
+    launch_template = t.add_resource(
+        LaunchTemplate(
+            'WebServerLaunchTemplate',
+            LaunchTemplateData=LaunchTemplateData(
+                ImageId=image_id,
+                InstanceType=type_instance,
+                KeyName=key_pair,
+                NetworkInterfaces=
+                [
+                    NetworkInterfaces(
+                        Groups=[network.security_group],
+                        AssociatePublicIpAddress='true',
+                        DeviceIndex='0',
+                        DeleteOnTermination='true')
+                ],
+                UserData=user_data_property(user_data, ready_timeout),
+                **instance_properties(t, type_instance, instance, launch_template=True))))
+
+    # Add the Auto Scaling group, registered with the Target Group
+    auto_scaling_group = t.add_resource(
+        autoscaling.AutoScalingGroup(
+            'WebServerGroup',
+            LaunchTemplate=autoscaling.LaunchTemplateSpecification(
+                LaunchTemplateId=Ref(launch_template),
+                Version=GetAtt(launch_template, 'LatestVersionNumber')),
+            MinSize=str(fleet.min_size),
+            MaxSize=str(fleet.max_size),
+            DesiredCapacity=str(fleet.desired_capacity),
+            VPCZoneIdentifier=network.subnets,
+            TargetGroupARNs=[Ref(target_group)],
+            HealthCheckType='ELB',
+            HealthCheckGracePeriod='300',
+            Tags=autoscaling.Tags(
                 Application=ref_stack_id,
                 Name=NAME_PREFIX+'webserver',
                 Project=PROJECT)))
+    if network.route:
+        auto_scaling_group.DependsOn = network.route
 
-    # Add Outputs to the Template for the VPC ID and URL
-    t.add_output(
-        [
-            Output('VPC',
-                   Description='VPC ID',
-                   Value=Ref(vpc)
-                  ),
-            Output('URL',
-                   Description='Web Server URL',
-                   Value=Join('',
-                       [
-                           'http://',
-                            GetAtt('WebServerInstance',
-                                   'PublicIp')
-                       ])
-                  )
-        ])
+    # Wait for every initial Instance to report that it is serving the page
+    if ready_timeout:
+        auto_scaling_group.CreationPolicy = CreationPolicy(
+            ResourceSignal=ResourceSignal(
+                Count=fleet.desired_capacity,
+                Timeout='PT%dS' % ready_timeout))
 
-    return t
+    # Track the chosen metric, adding or removing Instances to hold its target
+    metric_specification = autoscaling.PredefinedMetricSpecification(
+        PredefinedMetricType=SCALING_METRICS[fleet.scaling_metric])
+    if fleet.scaling_metric == 'requests':
+        metric_specification.ResourceLabel = Join('/', [
+            GetAtt(load_balancer, 'LoadBalancerFullName'),
+            GetAtt(target_group, 'TargetGroupFullName')])
+    t.add_resource(
+        autoscaling.ScalingPolicy(
+            'WebServerScalingPolicy',
+            DependsOn=listener.title,
+            AutoScalingGroupName=Ref(auto_scaling_group),
+            PolicyType='TargetTrackingScaling',
+            TargetTrackingConfiguration=autoscaling.TargetTrackingConfiguration(
+                PredefinedMetricSpecification=metric_specification,
+                TargetValue=fleet.scaling_target)))
+
+    # Add Outputs to the Template for the VPC ID and Load Balancer URL
+    distribution = None
+    if cdn is not None:
+        distribution = add_cdn(t, cdn, GetAtt(load_balancer, 'DNSName'))
+    add_outputs(t, network.vpc, GetAtt(load_balancer, 'DNSName'), distribution)
+
+
+def instance_properties(t, type_instance, instance, launch_template=False):
+    """ Return the Instance (or Launch Template data) properties that tune the
+    Web Server for its instance type, adding a placement group to the
+    Template when the InstanceOptions ask for one
+
+    The root volume is gp3 with the given IOPS and throughput, types that
+    can be EBS-optimized are, and T-series types get the CPU credit option
+    when one was chosen.
+    Enhanced networking needs no property: every supported type that has it
+    gets it from the Amazon Linux 2023 AMI.
+    """
+
+    from troposphere import Ref
+    from troposphere.ec2 import BlockDeviceMapping, CreditSpecification, EBSBlockDevice, \
+        LaunchTemplateBlockDeviceMapping, LaunchTemplateCreditSpecification, Placement, \
+        PlacementGroup
+
+    if instance is None:
+        instance = instance_options(type_instance)
+    capabilities = instance_capabilities(type_instance)
+    mapping = LaunchTemplateBlockDeviceMapping if launch_template else BlockDeviceMapping
+    properties = {
+        'BlockDeviceMappings': [
+            mapping(
+                DeviceName=ROOT_DEVICE_NAME,
+                Ebs=EBSBlockDevice(
+                    VolumeType='gp3',
+                    VolumeSize=instance.root_volume_size,
+                    Iops=instance.root_volume_iops,
+                    Throughput=instance.root_volume_throughput,
+                    DeleteOnTermination=True))
+        ]
+    }
+    if capabilities.ebs_optimized:
+        properties['EbsOptimized'] = True
+    if instance.cpu_credits is not None:
+        if launch_template:
+            properties['CreditSpecification'] = LaunchTemplateCreditSpecification(
+                CpuCredits=instance.cpu_credits)
+        else:
+            properties['CreditSpecification'] = CreditSpecification(
+                CPUCredits=instance.cpu_credits)
+    if instance.placement_strategy is not None:
+        placement_group = 'WebServerPlacementGroup'
+        if placement_group not in t.resources:
+            t.add_resource(PlacementGroup(placement_group,
+                                          Strategy=instance.placement_strategy))
+        if launch_template:
+            properties['Placement'] = Placement(GroupName=Ref(placement_group))
+        else:
+            properties['PlacementGroupName'] = Ref(placement_group)
+    return properties
+
+
+def add_cdn(t, cdn, origin_domain):
+    """ Add a CloudFront distribution that caches the origin to the Template
+
+    The cache key leaves out cookies, headers and query strings, since the
+    page is the same for everyone.
+    """
+
+    from troposphere import Join, Ref, Tags
+    from troposphere import cloudfront
+
+    cache_policy = t.add_resource(
+        cloudfront.CachePolicy(
+            'CdnCachePolicy',
+            CachePolicyConfig=cloudfront.CachePolicyConfig(
+                Name=Join('-', [Ref('AWS::StackName'), 'cache']),
+                Comment='Web Server page caching',
+                MinTTL=cdn.min_ttl,
+                DefaultTTL=cdn.default_ttl,
+                MaxTTL=cdn.max_ttl,
+                ParametersInCacheKeyAndForwardedToOrigin=
+                cloudfront.ParametersInCacheKeyAndForwardedToOrigin(
+                    EnableAcceptEncodingGzip=cdn.compress,
+                    EnableAcceptEncodingBrotli=cdn.compress,
+                    CookiesConfig=cloudfront.CacheCookiesConfig(CookieBehavior='none'),
+                    HeadersConfig=cloudfront.CacheHeadersConfig(HeaderBehavior='none'),
+                    QueryStringsConfig=cloudfront.CacheQueryStringsConfig(
+                        QueryStringBehavior='none')))))
+
+    return t.add_resource(
+        cloudfront.Distribution(
+            'CdnDistribution',
+            DistributionConfig=cloudfront.DistributionConfig(
+                Comment=NAME_PREFIX+'cdn',
+                Enabled=True,
+                HttpVersion='http2',
+                IPV6Enabled=True,
+                PriceClass=cdn.price_class,
+                Origins=[
+                    cloudfront.Origin(
+                        Id='WebServerOrigin',
+                        DomainName=origin_domain,
+                        CustomOriginConfig=cloudfront.CustomOriginConfig(
+                            OriginProtocolPolicy='http-only',
+                            HTTPPort=CDN_ORIGIN_PORT,
+                            OriginKeepaliveTimeout=60,
+                            OriginReadTimeout=30))
+                ],
+                DefaultCacheBehavior=cloudfront.DefaultCacheBehavior(
+                    TargetOriginId='WebServerOrigin',
+                    ViewerProtocolPolicy='allow-all',
+                    AllowedMethods=['GET', 'HEAD'],
+                    CachedMethods=['GET', 'HEAD'],
+                    CachePolicyId=Ref(cache_policy),
+                    Compress=cdn.compress)),
+            Tags=Tags(
+                Application=Ref('AWS::StackId'),
+                Name=NAME_PREFIX+'cdn',
+                Project=PROJECT)))
+
+
+def add_outputs(t, vpc, origin_address, distribution=None):
+    """ Add the VPC ID and Web Server URL Outputs to the Template
+
+    Behind a CloudFront distribution, the URL is the CDN's and OriginURL is
+    the Web Server's own.
+    """
+
+    from troposphere import GetAtt, Join, Output
+
+    origin_url = Join('', ['http://', origin_address])
+    outputs = [Output('VPC',
+                      Description='VPC ID',
+                      Value=vpc)]
+    if distribution is None:
+        outputs.append(Output('URL',
+                              Description='Web Server URL',
+                              Value=origin_url))
+    else:
+        outputs.append(Output('URL',
+                              Description='Web Server URL (through the CDN)',
+                              Value=Join('', ['http://', GetAtt(distribution, 'DomainName')])))
+        outputs.append(Output('OriginURL',
+                              Description='Web Server origin URL',
+                              Value=origin_url))
+    t.add_output(outputs)
+
+
+def user_data_property(user_data, ready_timeout):
+    """ Return the Base64 UserData for a list of script lines
+
+    The cfn-signal line refers to the Stack name and Region, so a script that
+    signals readiness is wrapped in Fn::Sub rather than joined as-is.
+    """
+
+    from troposphere import Base64, Join, Sub
+
+    if ready_timeout:
+        return Base64(Sub('\n'.join(user_data)))
+    return Base64(Join('\n', user_data))
+
+
+def _signal_resource(fleet, ready_timeout):
+    """ Logical ID of the resource whose CreationPolicy the UserData signals """
+
+    if not ready_timeout:
+        return None
+    return 'WebServerInstance' if fleet is None else 'WebServerGroup'
+
+
+def _zone_count(fleet):
+    """ Number of Subnets the web tier is spread over """
+
+    return fleet.zone_count if fleet is not None else 1
+
+
+def _subnet_output(index):
+    """ Output (and export suffix) of a network Stack for its Nth Subnet """
+
+    return 'Subnet%d' % (index + 1)
+
+
+def _resource_suffix(index):
+    """ Logical ID suffix for the Nth copy of a per-Subnet resource """
 
+    return '' if index == 0 else str(index + 1)
 
-def create_stack(id, secret, key_pair, region, template):
-    ''' Create the Cloud Formation Stack from the specified Template'''
 
-    # Create boto3 client for AWS Cloud Formation
-    client = boto3.client('cloudformation',
-                          aws_access_key_id=id,
-                          aws_secret_access_key=secret,
-                          region_name=region)
+def render_template(key_pair, region, type_instance, fleet=None,
+                    web_profile='default', defer_update=False, ready_timeout=None,
+                    timer=None, image_id=None, network_stack=None, cdn=None, instance=None):
+    """ Return the Cloud Formation Template and its JSON body, built only once
 
-    # Validate the CFT Syntax
+    The cache key covers the arguments and every constant the template is
+    built from, so a change to any of them produces a new template.
+    """
+
+    key = content_hash(key_pair, region, type_instance, fleet, ready_timeout, image_id,
+                       network_stack, cdn, instance,
+                       VPC_CIDR, SUBNET_CIDR, FLEET_SUBNET_CIDRS, fallback_image_id,
+                       INSTANCE_FAMILIES, ROOT_DEVICE_NAME,
+                       WEB_SERVER_RULES, LOAD_BALANCER_RULES,
+                       render_user_data(web_profile, type_instance, defer_update,
+                                        _signal_resource(fleet, ready_timeout)),
+                       PROJECT, NAME_PREFIX)
+    return template_cache.get_or_build(
+        key, lambda: create_template(key_pair, region, type_instance, fleet,
+                                     web_profile, defer_update, ready_timeout, image_id,
+                                     network_stack, cdn, instance),
+        timer)
+
+
+def render_network_template(zone_count=DEFAULT_NETWORK_ZONES, timer=None):
+    """ Return the network Stack Template and its JSON body, built only once """
+
+    key = content_hash('network', zone_count, VPC_CIDR, SUBNET_CIDR, FLEET_SUBNET_CIDRS,
+                       WEB_SERVER_RULES, PROJECT, NAME_PREFIX)
+    return template_cache.get_or_build(key, lambda: create_network_template(zone_count), timer)
+
+
+def create_stack(id, secret, key_pair, region, template_body, ready_timeout=None,
+                 timer=None, stack_name=STACK_NAME):
+    ''' Create the Cloud Formation Stack from the specified Template body
+
+    With a ready_timeout, the Web Server URL is probed once the Stack is
+    complete until the page is served (or the timeout passes).  Returns a
+    StackResult; a Web Server that never became ready counts as a failure.
+    '''
+
+    timer = timer or ProvisioningTimer()
+
+    # Get the shared boto3 client for AWS Cloud Formation
+    client = aws_session.get_client('cloudformation', region, id, secret)
+
+    # Validate the CFT Syntax, unless this exact body has passed before
     try:
-        client.validate_template(TemplateBody=template.to_json())
-        print 'Cloud Formation Template PASSED syntax validation'
+        if validation_cache.is_validated(template_body):
+            print 'Cloud Formation Template PASSED syntax validation (cached)'
+        else:
+            with timer.phase('validate_template'):
+                client.validate_template(TemplateBody=template_body)
+            validation_cache.add(template_body)
+            print 'Cloud Formation Template PASSED syntax validation'
 
         # Submit the Template for CF Stack creation
         try:
-            client.create_stack(StackName=STACK_NAME,
-                                TemplateBody=template.to_json())
-
-            # Poll for CF Stack submission updates until a terminal state
-            continue_polling = True
-            while continue_polling:
-                stack_events = client.describe_stack_events(StackName=STACK_NAME)
-                stack_status = stack_events['StackEvents'][0]['ResourceStatus']
-                if stack_status == 'ROLLBACK_COMPLETE':
-                    print 'Cloud Formation Stack Submission Status : FAILED'
-                    print 'Check the AWS Console for Stack "%s" for more details.' % STACK_NAME
-                    continue_polling = False
-                elif stack_status == 'CREATE_COMPLETE':
-                    print 'Cloud Formation Stack Submission Status : COMPLETED'
-
-                    # Poll for CF Stack build updates until a terminal state
-                    while continue_polling:
-                        stack_details = client.describe_stacks(StackName=STACK_NAME)
-                        stack_build_status = stack_details['Stacks'][0]['StackStatus']
-                        if stack_build_status == 'ROLLBACK_COMPLETE':
-                            print 'Cloud Formation Stack Build Status : FAILED'
-                            print 'Check the AWS Console for Stack "%s" for more details.' % STACK_NAME
-                            continue_polling = False
-                        elif stack_build_status == 'CREATE_COMPLETE':
-                            print 'Cloud Formation Stack Build Status : COMPLETE'
-                            
-                            # Display useful information about the provisioned environment, including
-                            #     the VPC ID and Web Server URL obtained from the Outputs of the CF Stack
-                            stack_outputs = stack_details['Stacks'][0]['Outputs']
-                            for stack_output in stack_outputs:
-                                if stack_output['OutputKey'] == 'VPC':
-                                    stack_vpc = stack_output['OutputValue']
-                                else:
-                                    stack_url = stack_output['OutputValue']
-                            print '\nCloud Formation Stack Name: %s' % STACK_NAME
-                            print 'AWS Region: %s' % region
-                            print 'Key Pair: %s' % key_pair
-                            print 'VPC ID: %s' % stack_vpc
-                            print 'Web Server URL: %s\n' % stack_url
-                            print '\nNOTE: It may take a few minutes for the Web Server to start, so' \
-                                  '\n      periodically hit refresh in your browser until the page is displayed.\n'
-                            continue_polling = False
-                        else:
-                            print 'Cloud Formation Stack Build Status : Building...'
-                            time.sleep(10)
-                else:
-                    print 'Cloud Formation Stack Submission Status : Creating...'
-                    time.sleep(10)
+            submitted = time.time()
+            with timer.phase('stack_submission'):
+                response = client.create_stack(StackName=stack_name,
+                                               TemplateBody=template_body,
+                                               ClientRequestToken=client_request_token('create'))
+            print 'Cloud Formation Stack Submission Status : SUBMITTED'
+
+            # Follow the CF Stack events until the Stack reaches a terminal state
+            poller = StackPoller(client, response['StackId'],
+                                 on_event=stack_event_handler(timer))
+            with timer.phase('stack_build'):
+                stack_status = poller.wait()
+            if stack_status != 'CREATE_COMPLETE':
+                print 'Cloud Formation Stack Build Status : FAILED (%s)' % stack_status
+                print 'Check the AWS Console for Stack "%s" for more details.' % stack_name
+                return StackResult(stack_status, False, {}, 'Stack build failed')
+            print 'Cloud Formation Stack Build Status : COMPLETE'
+            stack_outputs = display_stack_outputs(client, response['StackId'], key_pair,
+                                                  region, ready_timeout, stack_name)
+            return ready_result(stack_status, stack_outputs, ready_timeout, submitted, timer)
 
         except botocore.exceptions.ClientError, err:
+            if err.response['Error']['Code'] == 'AlreadyExistsException':
+                # The Stack is already deployed, so only apply what changed
+                return update_stack(client, key_pair, region, template_body, ready_timeout,
+                                    timer, stack_name)
             print 'Cloud Formation Stack creation FAILED: ' \
                   '%s' % err.response['Error']['Message']
+            return StackResult('CREATE_FAILED', False, {}, err.response['Error']['Message'])
 
     except botocore.exceptions.ClientError, err:
         print 'Cloud Formation Template FAILED syntax validation: ' \
               '%s' % err.response['Error']['Message']
+        return StackResult('VALIDATION_FAILED', False, {}, err.response['Error']['Message'])
+
+
+def update_stack(client, key_pair, region, template_body, ready_timeout=None,
+                 timer=None, stack_name=STACK_NAME):
+    ''' Update the existing Cloud Formation Stack through a Change Set
+
+    Returns a StackResult like create_stack.
+    '''
+
+    timer = timer or ProvisioningTimer()
+
+    try:
+        # Compare the new Template with the deployed one before asking
+        #     Cloud Formation to compute a Change Set
+        deployed = client.get_template(StackName=stack_name,
+                                       TemplateStage='Original')['TemplateBody']
+        if templates_match(deployed, template_body):
+            print 'Cloud Formation Stack "%s" is already up to date' % stack_name
+            return StackResult('UP_TO_DATE', True, get_stack_outputs(client, stack_name), None)
+
+        # Create the Change Set and wait for Cloud Formation to compute it
+        with timer.phase('change_set'):
+            change_set = client.create_change_set(StackName=stack_name,
+                                                  TemplateBody=template_body,
+                                                  ChangeSetName=CHANGE_SET_PREFIX + str(int(time.time())),
+                                                  ChangeSetType='UPDATE',
+                                                  ClientToken=client_request_token('change-set'))
+            details = wait_for_change_set(client, change_set['Id'])
+        if details['Status'] == 'FAILED':
+            client.delete_change_set(ChangeSetName=change_set['Id'])
+            if is_empty_change_set(details):
+                print 'Cloud Formation Stack "%s" is already up to date' % stack_name
+                return StackResult('UP_TO_DATE', True, get_stack_outputs(client, stack_name),
+                                   None)
+            print 'Cloud Formation Change Set FAILED: %s' % details.get('StatusReason')
+            return StackResult('CHANGE_SET_FAILED', False, {}, details.get('StatusReason'))
+
+        for change in details['Changes']:
+            resource_change = change['ResourceChange']
+            print 'Cloud Formation Change Set : %-10s %-40s %s (replacement: %s)' % (
+                resource_change['Action'],
+                resource_change['ResourceType'],
+                resource_change['LogicalResourceId'],
+                resource_change.get('Replacement', 'N/A'))
+
+        # Apply the Change Set, following only the events it produces
+        poller = StackPoller(client, details['StackId'],
+                             on_event=stack_event_handler(timer))
+        poller.mark()
+        submitted = time.time()
+        with timer.phase('stack_submission'):
+            client.execute_change_set(ChangeSetName=change_set['Id'],
+                                      ClientRequestToken=client_request_token('update'))
+        print 'Cloud Formation Stack Update Status : SUBMITTED'
+        with timer.phase('stack_build'):
+            stack_status = poller.wait()
+        if stack_status != 'UPDATE_COMPLETE':
+            print 'Cloud Formation Stack Update Status : FAILED (%s)' % stack_status
+            print 'Check the AWS Console for Stack "%s" for more details.' % stack_name
+            return StackResult(stack_status, False, {}, 'Stack update failed')
+        print 'Cloud Formation Stack Update Status : COMPLETE'
+        stack_outputs = display_stack_outputs(client, details['StackId'], key_pair,
+                                              region, ready_timeout, stack_name)
+        return ready_result(stack_status, stack_outputs, ready_timeout, submitted, timer)
+
+    except botocore.exceptions.ClientError, err:
+        print 'Cloud Formation Stack update FAILED: ' \
+              '%s' % err.response['Error']['Message']
+        return StackResult('UPDATE_FAILED', False, {}, err.response['Error']['Message'])
+
+
+def ready_result(stack_status, stack_outputs, ready_timeout, submitted, timer):
+    """ Return the StackResult of a complete Stack, after waiting for the Web Server """
+
+    if ready_timeout:
+        with timer.phase('web_server_ready'):
+            probe = wait_for_webserver(stack_outputs['URL'], ready_timeout, submitted)
+        if not probe.ready:
+            return StackResult(stack_status, False, stack_outputs,
+                               'Web Server was not ready: %s' % probe.error)
+    return StackResult(stack_status, True, stack_outputs, None)
+
+
+def templates_match(deployed, template_body):
+    """ Whether the deployed Template is identical to the new Template body
+
+    get_template returns JSON Templates already parsed; anything that does not
+    parse as JSON (e.g., a YAML Template applied by hand) never matches.
+    """
+
+    if not isinstance(deployed, dict):
+        try:
+            deployed = json.loads(deployed)
+        except ValueError:
+            return False
+    return deployed == json.loads(template_body)
+
+
+def is_empty_change_set(details):
+    """ Whether a FAILED Change Set only failed because nothing changed """
+
+    reason = details.get('StatusReason') or ''
+    return "didn't contain changes" in reason or 'No updates are to be performed' in reason
+
+
+def display_stack_outputs(client, stack_id, key_pair, region, ready_timeout=None,
+                          stack_name=STACK_NAME):
+    """ Display useful information about the provisioned environment
+
+    This includes the VPC ID and Web Server URL obtained from the Outputs of
+    the CF Stack, which are also returned as a dict.  A network Stack has no
+    key pair or Web Server URL.
+    """
+
+    stack_outputs = get_stack_outputs(client, stack_id)
+    print '\nCloud Formation Stack Name: %s' % stack_name
+    print 'AWS Region: %s' % region
+    if key_pair is not None:
+        print 'Key Pair: %s' % key_pair
+    print 'VPC ID: %s' % stack_outputs['VPC']
+    if 'URL' not in stack_outputs:
+        print
+        return stack_outputs
+    print 'Web Server URL: %s\n' % stack_outputs['URL']
+    if not ready_timeout:
+        print '\nNOTE: It may take a few minutes for the Web Server to start, so' \
+              '\n      periodically hit refresh in your browser until the page is displayed.\n'
+    return stack_outputs
+
+
+def get_stack_outputs(client, stack_id):
+    """ Return the Outputs of a Stack as a dict """
+
+    stack_details = client.describe_stacks(StackName=stack_id)
+    return dict((stack_output['OutputKey'], stack_output['OutputValue'])
+                for stack_output in stack_details['Stacks'][0].get('Outputs', []))
+
+
+def wait_for_webserver(url, ready_timeout, submitted):
+    """ Probe the Web Server URL until it serves the expected page
+
+    submitted is when the Stack operation was submitted, so the reported
+    time to first successful byte covers the whole deployment.
+    """
+
+    print 'Waiting for the Web Server at %s to serve its page...' % url
+    result = probe_url(url, EXPECTED_TEXT, timeout=ready_timeout)
+    if result.ready:
+        print 'Web Server is READY: first successful byte %.1f seconds after the Stack ' \
+              'was submitted\n      (%.1f seconds of probing, %d attempts, %.0f ms to ' \
+              'first byte)\n' % (time.time() - submitted,
+                                  result.elapsed,
+                                  result.attempts,
+                                  result.first_byte * 1000.0)
+    else:
+        print 'Web Server was NOT READY after %.1f seconds (%d attempts): %s\n' % (
+            result.elapsed, result.attempts, result.error)
+    return result
+
+
+def stack_event_handler(timer):
+    """ Return a Stack event callback that displays and times each event """
+
+    def handle_event(event):
+        print_stack_event(event)
+        timer.add_event(event)
+    return handle_event
+
+
+def print_stack_event(event, prefix=''):
+    """ Display the progress of a single Cloud Formation Stack event
+
+    Failed events include their reason; prefix starts the line, e.g. to tell
+    apart Stacks that are followed at the same time.
+    """
+
+    message = 'Cloud Formation Stack Event : %-20s %-40s %s' % (event['ResourceStatus'],
+                                                              event['ResourceType'],
+                                                              event['LogicalResourceId'])
+    if event['ResourceStatus'].endswith('_FAILED') and event.get('ResourceStatusReason'):
+        message += ' (%s)' % event['ResourceStatusReason']
+    print prefix + message
 
 
 def parse_args_and_run(args=None):
@@ -399,14 +1376,12 @@ def parse_args_and_run(args=None):
     parser.add_argument(
         '-i',
         '--id',
-        required=True,
-        help='AWS Access Key ID'
+        help='AWS Access Key ID (required unless --render_only is given)'
     )
     parser.add_argument(
         '-s',
         '--secret',
-        required=True,
-        help='AWS Secret Access Key'
+        help='AWS Secret Access Key (required unless --render_only is given)'
     )
     parser.add_argument(
         '-k',
@@ -425,30 +1400,421 @@ def parse_args_and_run(args=None):
         '-t',
         '--type_instance',
         default='t2.micro',
-        help='AWS Instance Type/Size (e.g., "t2.micro")'
+        action=ValidateInstanceType,
+        help='AWS Instance Type/Size (e.g., "t2.micro"), from the families in '\
+             'instance_types.INSTANCE_FAMILIES'
+    )
+    parser.add_argument(
+        '--root_volume_size',
+        type=int,
+        default=DEFAULT_ROOT_VOLUME_SIZE,
+        help='Size of the gp3 root volume in GiB (default value is %d)' %
+             DEFAULT_ROOT_VOLUME_SIZE
+    )
+    parser.add_argument(
+        '--root_volume_iops',
+        type=int,
+        default=GP3_BASELINE_IOPS,
+        help='Provisioned IOPS of the root volume, up to 500 per GiB (default value '\
+             'is the gp3 baseline of %d)' % GP3_BASELINE_IOPS
+    )
+    parser.add_argument(
+        '--root_volume_throughput',
+        type=int,
+        default=GP3_BASELINE_THROUGHPUT,
+        help='Provisioned throughput of the root volume in MiB/s, up to a quarter '\
+             'of the IOPS (default value is the gp3 baseline of %d)' %
+             GP3_BASELINE_THROUGHPUT
+    )
+    parser.add_argument(
+        '--cpu_credits',
+        choices=CPU_CREDIT_OPTIONS,
+        help='CPU credit option of T-series instance types: "unlimited" bursts past '\
+             'the earned credits at extra cost instead of being throttled (default is '\
+             'the type\'s own option, "standard" for t2)'
+    )
+    parser.add_argument(
+        '--placement_strategy',
+        choices=PLACEMENT_STRATEGIES,
+        help='Launch the web server instances into a placement group with this '\
+             'strategy ("cluster" needs a single instance of a type with enhanced '\
+             'networking)'
+    )
+    parser.add_argument(
+        '--fleet',
+        action='store_true',
+        help='Run the web server on an Auto Scaling group behind a load balancer '\
+             'instead of a single EC2 instance'
+    )
+    parser.add_argument(
+        '--min_size',
+        type=int,
+        default=2,
+        help='Minimum number of web server instances in the fleet'
+    )
+    parser.add_argument(
+        '--max_size',
+        type=int,
+        default=4,
+        help='Maximum number of web server instances in the fleet'
+    )
+    parser.add_argument(
+        '--desired_capacity',
+        type=int,
+        help='Initial number of web server instances in the fleet (default is --min_size)'
+    )
+    parser.add_argument(
+        '--zones',
+        type=int,
+        default=2,
+        choices=range(2, len(FLEET_SUBNET_CIDRS) + 1),
+        help='Number of Availability Zones to spread the fleet across'
+    )
+    parser.add_argument(
+        '--scaling_metric',
+        default='cpu',
+        choices=sorted(SCALING_METRICS.keys()),
+        help='Metric the fleet scales on: average CPU utilization or requests per instance'
+    )
+    parser.add_argument(
+        '--scaling_target',
+        type=float,
+        help='Target value for the scaling metric (default is 50 percent CPU '\
+             'or 1000 requests per instance)'
+    )
+    parser.add_argument(
+        '--web_profile',
+        default='default',
+        choices=PROFILES,
+        help='Web server configuration: stock httpd, or a "performance" profile '\
+             'with the event MPM and kernel limits sized to the instance type'
+    )
+    parser.add_argument(
+        '--ready_timeout',
+        type=int,
+        default=DEFAULT_READY_TIMEOUT,
+        help='Seconds to wait for the web server to serve its page before the '\
+             'Stack (and this script) report failure'
+    )
+    parser.add_argument(
+        '--no_readiness_gate',
+        action='store_true',
+        help='Do not wait for the web server: the Stack completes once its '\
+             'resources are created and the URL is not probed'
+    )
+    parser.add_argument(
+        '--ami_cache_ttl',
+        type=int,
+        default=DEFAULT_AMI_TTL,
+        help='Seconds a looked up AMI ID is reused before it is looked up again; '\
+             '0 always looks it up (default value is %d)' % DEFAULT_AMI_TTL
+    )
+    parser.add_argument(
+        '--timings_file',
+        default=TIMINGS_FILE,
+        help='JSON lines file that phase and resource timings are appended to '\
+             '(default is "%s")' % TIMINGS_FILE
+    )
+    parser.add_argument(
+        '--defer_update',
+        action='store_true',
+        help='Run the full "yum update" in the background after the web server '\
+             'has started instead of before it'
+    )
+    parser.add_argument(
+        '--image_id',
+        help='AMI ID to launch instead of looking up the current Amazon Linux 2023 AMI'
+    )
+    parser.add_argument(
+        '--stack_name',
+        default=STACK_NAME,
+        action=ValidateStackName,
+        help='Name of the Cloud Formation Stack to create or update '\
+             '(default is "%s")' % STACK_NAME
+    )
+    parser.add_argument(
+        '--network_stack',
+        action=ValidateStackName,
+        help='Import the VPC, Subnets and Security Group from this shared network '\
+             'Stack (created first if it does not exist), so the Stack only holds '\
+             'the web tier'
+    )
+    parser.add_argument(
+        '--network_zones',
+        type=int,
+        default=DEFAULT_NETWORK_ZONES,
+        choices=range(1, len(FLEET_SUBNET_CIDRS) + 1),
+        help='Number of Availability Zones (public Subnets) of a new network Stack; '\
+             'at least --zones for a fleet (default value is %d)' % DEFAULT_NETWORK_ZONES
+    )
+    parser.add_argument(
+        '--update_network',
+        action='store_true',
+        help='Update an existing network Stack to the current Template instead of '\
+             'reusing it as it is'
+    )
+    parser.add_argument(
+        '--network_output',
+        help='File to also write the network Stack Template to with --render_only'
+    )
+    parser.add_argument(
+        '--cdn',
+        action='store_true',
+        help='Put a CloudFront distribution in front of the web server (or the '\
+             'fleet\'s load balancer), which then only accepts HTTP from CloudFront'
+    )
+    parser.add_argument(
+        '--cdn_min_ttl',
+        type=int,
+        default=0,
+        help='Minimum seconds CloudFront caches a page for (default value is 0)'
+    )
+    parser.add_argument(
+        '--cdn_default_ttl',
+        type=int,
+        default=DEFAULT_CDN_TTL,
+        help='Seconds CloudFront caches a page for when the web server does not '\
+             'say (default value is %d)' % DEFAULT_CDN_TTL
+    )
+    parser.add_argument(
+        '--cdn_max_ttl',
+        type=int,
+        default=DEFAULT_CDN_MAX_TTL,
+        help='Maximum seconds CloudFront caches a page for (default value is %d)' %
+             DEFAULT_CDN_MAX_TTL
+    )
+    parser.add_argument(
+        '--no_cdn_compression',
+        action='store_true',
+        help='Do not have CloudFront compress the pages it serves'
+    )
+    parser.add_argument(
+        '--cdn_price_class',
+        default=CDN_PRICE_CLASSES[0],
+        choices=CDN_PRICE_CLASSES,
+        help='CloudFront edge locations to serve from (default is "%s", the '\
+             'cheapest)' % CDN_PRICE_CLASSES[0]
+    )
+    parser.add_argument(
+        '--origin_prefix_list',
+        help='ID of the CloudFront origin-facing managed prefix list, instead of '\
+             'looking it up'
+    )
+    parser.add_argument(
+        '--render_only',
+        action='store_true',
+        help='Only write the Cloud Formation Template JSON, without importing '\
+             'boto3 or contacting AWS'
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='File to write the Template to with --render_only (default is stdout)'
     )
 
     _args = parser.parse_args(args)
-    provision_environment(_args.id,
-                          _args.secret,
-                          _args.key_pair,
-                          _args.region,
-                          _args.type_instance)
+    if not _args.render_only and (_args.id is None or _args.secret is None):
+        parser.error('-i/--id and -s/--secret are required unless --render_only is given')
+    if _args.network_stack is not None and _args.network_stack == _args.stack_name:
+        parser.error('--network_stack must differ from --stack_name')
+    fleet = None
+    if _args.fleet:
+        try:
+            fleet = fleet_config(_args.min_size,
+                                 _args.max_size,
+                                 _args.desired_capacity,
+                                 _args.zones,
+                                 _args.scaling_metric,
+                                 _args.scaling_target)
+        except ValueError:
+            parser.error('fleet sizes must satisfy 1 <= --min_size <= '\
+                         '--desired_capacity <= --max_size')
+    cdn = None
+    if _args.cdn:
+        try:
+            cdn = cdn_config(_args.cdn_min_ttl,
+                             _args.cdn_default_ttl,
+                             _args.cdn_max_ttl,
+                             not _args.no_cdn_compression,
+                             _args.cdn_price_class,
+                             _args.origin_prefix_list)
+        except ValueError:
+            parser.error('CDN TTLs must satisfy 0 <= --cdn_min_ttl <= '\
+                         '--cdn_default_ttl <= --cdn_max_ttl')
+    try:
+        instance = instance_options(_args.type_instance,
+                                    _args.root_volume_size,
+                                    _args.root_volume_iops,
+                                    _args.root_volume_throughput,
+                                    _args.cpu_credits,
+                                    _args.placement_strategy,
+                                    fleet)
+    except ValueError, err:
+        parser.error(str(err))
+
+    ami_resolver.cache.ttl = _args.ami_cache_ttl
+    ready_timeout = None if _args.no_readiness_gate else _args.ready_timeout
+    if _args.render_only:
+        write_template(_args.key_pair,
+                       _args.region,
+                       _args.type_instance,
+                       fleet,
+                       _args.web_profile,
+                       _args.defer_update,
+                       ready_timeout,
+                       _args.image_id,
+                       _args.output,
+                       _args.network_stack,
+                       cdn,
+                       instance)
+        if _args.network_output:
+            write_network_template(max(_args.network_zones, _zone_count(fleet)),
+                                   _args.network_output)
+        return
+
+    try:
+        provision_environment(_args.id,
+                              _args.secret,
+                              _args.key_pair,
+                              _args.region,
+                              _args.type_instance,
+                              fleet,
+                              _args.web_profile,
+                              _args.defer_update,
+                              ready_timeout,
+                              _args.timings_file,
+                              _args.image_id,
+                              _args.stack_name,
+                              _args.network_stack,
+                              _args.network_zones,
+                              _args.update_network,
+                              cdn,
+                              instance)
+    except ProvisioningError, err:
+        print '\n%s\n' % err
+        exit(0)
+
+
+def fleet_config(min_size=2, max_size=4, desired_capacity=None, zone_count=2,
+                 scaling_metric='cpu', scaling_target=None):
+    """ Return a validated FleetConfig, filling in the default capacity and target
+
+    Raises ValueError when the sizes, zone count or scaling metric are invalid.
+    """
+
+    if desired_capacity is None:
+        desired_capacity = min_size
+    if not 1 <= min_size <= desired_capacity <= max_size:
+        raise ValueError('fleet sizes must satisfy 1 <= min_size <= '
+                         'desired_capacity <= max_size')
+    if not 2 <= zone_count <= len(FLEET_SUBNET_CIDRS):
+        raise ValueError('fleet zone count must be between 2 and %d' %
+                         len(FLEET_SUBNET_CIDRS))
+    if scaling_metric not in SCALING_METRICS:
+        raise ValueError('fleet scaling metric must be one of: %s' %
+                         ', '.join(sorted(SCALING_METRICS)))
+    if scaling_target is None:
+        scaling_target = DEFAULT_SCALING_TARGETS[scaling_metric]
+    return FleetConfig(min_size=min_size,
+                       max_size=max_size,
+                       desired_capacity=desired_capacity,
+                       zone_count=zone_count,
+                       scaling_metric=scaling_metric,
+                       scaling_target=scaling_target)
+
+
+def cdn_config(min_ttl=0, default_ttl=DEFAULT_CDN_TTL, max_ttl=DEFAULT_CDN_MAX_TTL,
+               compress=True, price_class=CDN_PRICE_CLASSES[0], origin_prefix_list=None):
+    """ Return a validated CdnConfig
+
+    Without an origin_prefix_list, it is looked up when the environment is
+    provisioned.  Raises ValueError when the TTLs or price class are invalid.
+    """
+
+    if not 0 <= min_ttl <= default_ttl <= max_ttl:
+        raise ValueError('CDN TTLs must satisfy 0 <= min_ttl <= default_ttl <= max_ttl')
+    if price_class not in CDN_PRICE_CLASSES:
+        raise ValueError('CDN price class must be one of: %s' % ', '.join(CDN_PRICE_CLASSES))
+    return CdnConfig(min_ttl=min_ttl,
+                     default_ttl=default_ttl,
+                     max_ttl=max_ttl,
+                     compress=compress,
+                     price_class=price_class,
+                     origin_prefix_list=origin_prefix_list)
+
+
+def instance_options(type_instance, root_volume_size=DEFAULT_ROOT_VOLUME_SIZE,
+                     root_volume_iops=GP3_BASELINE_IOPS,
+                     root_volume_throughput=GP3_BASELINE_THROUGHPUT,
+                     cpu_credits=None, placement_strategy=None, fleet=None):
+    """ Return validated InstanceOptions for the instance type (and fleet)
+
+    Raises ValueError when the type is not supported, the root volume is
+    outside the gp3 limits (or smaller than the AMI), CPU credits are given
+    for a type that does not use them, or the type or fleet cannot use the
+    placement strategy.
+    """
+
+    capabilities = instance_capabilities(type_instance)
+    if root_volume_size < DEFAULT_ROOT_VOLUME_SIZE:
+        raise ValueError('the root volume must be at least %d GiB, the size of the AMI' %
+                         DEFAULT_ROOT_VOLUME_SIZE)
+    validate_gp3_volume(root_volume_size, root_volume_iops, root_volume_throughput)
+    if cpu_credits is not None:
+        if cpu_credits not in CPU_CREDIT_OPTIONS:
+            raise ValueError('CPU credits must be one of: %s' % ', '.join(CPU_CREDIT_OPTIONS))
+        if not capabilities.burstable:
+            raise ValueError('CPU credits only apply to T-series instance types, not "%s"' %
+                             type_instance)
+    if placement_strategy is not None:
+        if fleet is None:
+            validate_placement(capabilities, placement_strategy)
+        else:
+            validate_placement(capabilities, placement_strategy, fleet.zone_count,
+                               fleet.max_size)
+    return InstanceOptions(root_volume_size=root_volume_size,
+                           root_volume_iops=root_volume_iops,
+                           root_volume_throughput=root_volume_throughput,
+                           cpu_credits=cpu_credits,
+                           placement_strategy=placement_strategy)
+
+
+class ValidateInstanceType(argparse.Action):
+    """ Class to validate AWS Instance Type argument against the capability table """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            instance_capabilities(values)
+        except ValueError, err:
+            parser.error(str(err))
+        setattr(namespace, self.dest, values)
 
 
 class ValidateRegion(argparse.Action):
-    """ Class to validate AWS Region argument """
+    """ Class to validate AWS Region argument
+
+    Any well-formed Region ID is accepted, since the AMI for it is looked up
+    when the environment is provisioned.
+    """
 
     def __call__(self, parser, namespace, values, option_string=None):
-        if values not in supported_regions_ami_map:
-            print '\n"%s" is not a supported AWS Region. Select from the following:' % values
-            for key in sorted(supported_regions_ami_map.keys()):
-                print '  %s' % key
-            print ''
+        if not REGION_PATTERN.match(values):
+            print '\n"%s" is not a valid AWS Region ID (e.g., "us-east-1" or ' \
+                  '"eu-west-2").\n' % values
             exit(0)
         setattr(namespace, self.dest, values)
 
 
+class ValidateStackName(argparse.Action):
+    """ Class to validate Cloud Formation Stack name argument """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if not STACK_NAME_PATTERN.match(values):
+            parser.error('"%s" is not a valid Stack name: it must start with a letter '\
+                         'and hold at most 128 letters, digits and dashes' % values)
+        setattr(namespace, self.dest, values)
+
+
 if __name__ == '__main__':
     parse_args_and_run()
 
@@ -0,0 +1,159 @@
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+
+# Serializes appends from environments provisioned concurrently in one process
+_write_lock = threading.Lock()
+_run_numbers = itertools.count(1)
+
+
+class ProvisioningTimer(object):
+    """ Records how long each provisioning phase and Stack resource took
+
+    Phases are timed on the local wall clock with phase(); Stack events
+    passed to add_event() are paired up into per-resource durations.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.phases = []
+        self.timeline = ResourceTimeline()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, self.clock() - started)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases.append((name, seconds))
+
+    def add_event(self, event):
+        with self._lock:
+            self.timeline.add_event(event)
+
+    def summary(self):
+        return format_summary(self.phases, self.timeline.durations())
+
+    def write_jsonl(self, path, context):
+        write_jsonl(path, self.phases, self.timeline.durations(), context)
+
+
+class ResourceTimeline(object):
+    """ Pairs up Stack events into per-resource provisioning durations
+
+    A resource starts at its first *_IN_PROGRESS event and finishes at the
+    first *_COMPLETE or *_FAILED event after that.  Durations use the event
+    timestamps from Cloud Formation, so they do not depend on how often the
+    Stack was polled.
+    """
+
+    def __init__(self):
+        self.resources = {}
+        self.order = []
+
+    def add_event(self, event):
+        name = event['LogicalResourceId']
+        status = event['ResourceStatus']
+        resource = self.resources.get(name)
+        if status.endswith('_IN_PROGRESS'):
+            if resource is None or resource['finished'] is not None:
+                # A new operation on the resource (e.g., an update) starts over
+                if resource is None:
+                    self.order.append(name)
+                self.resources[name] = {
+                    'type': event['ResourceType'],
+                    'operation': status[:-len('_IN_PROGRESS')],
+                    'started': event['Timestamp'],
+                    'finished': None,
+                    'status': status
+                }
+        elif resource is not None and resource['finished'] is None and \
+                (status.endswith('_COMPLETE') or status.endswith('_FAILED')):
+            resource['finished'] = event['Timestamp']
+            resource['status'] = status
+
+    def durations(self):
+        """ Return finished resources as dicts, slowest first """
+
+        results = []
+        for name in self.order:
+            resource = self.resources[name]
+            if resource['finished'] is None:
+                continue
+            results.append({
+                'resource': name,
+                'type': resource['type'],
+                'operation': resource['operation'],
+                'status': resource['status'],
+                'seconds': (resource['finished'] - resource['started']).total_seconds()
+            })
+        results.sort(key=lambda result: -result['seconds'])
+        return results
+
+
+def resource_durations(events):
+    """ Return per-resource durations for a list of Stack events (any order) """
+
+    timeline = ResourceTimeline()
+    for event in sorted(events, key=lambda event: event['Timestamp']):
+        timeline.add_event(event)
+    return timeline.durations()
+
+
+def format_summary(phases, resources):
+    """ Return a human readable summary of phase and resource durations """
+
+    lines = ['Provisioning phase timings:']
+    for name, seconds in phases:
+        lines.append('  %-25s %8.2f s' % (name, seconds))
+    lines.append('  %-25s %8.2f s' % ('total', sum(seconds for name, seconds in phases)))
+    if resources:
+        lines.append('Resource provisioning durations (slowest first):')
+        for resource in resources:
+            if resource['type'] == STACK_RESOURCE_TYPE:
+                continue
+            lines.append('  %-40s %-40s %8.1f s' % (resource['resource'],
+                                                   resource['type'],
+                                                   resource['seconds']))
+    return '\n'.join(lines)
+
+
+def write_jsonl(path, phases, resources, context):
+    """ Append one JSON line per phase and per resource to the timings file
+
+    context (e.g., the Stack name, Region and instance type) is copied into
+    every line, together with a run ID shared by all lines of this run.
+    """
+
+    run_id = '%d-%d-%d' % (int(time.time() * 1000), os.getpid(), next(_run_numbers))
+    recorded_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    records = []
+    for name, seconds in phases:
+        records.append(dict(context, run_id=run_id, recorded_at=recorded_at,
+                            kind='phase', name=name, seconds=seconds))
+    for resource in resources:
+        records.append(dict(context, run_id=run_id, recorded_at=recorded_at,
+                            kind='resource', name=resource['resource'],
+                            resource_type=resource['type'],
+                            operation=resource['operation'],
+                            status=resource['status'],
+                            seconds=resource['seconds']))
+
+    lines = ''.join(json.dumps(record, sort_keys=True) + '\n' for record in records)
+    with _write_lock:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'a') as timings_file:
+            timings_file.write(lines)
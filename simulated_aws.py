@@ -0,0 +1,706 @@
+# Offline stand-in for the AWS APIs used by the provisioning script, for benchmarks
+
+import collections
+import datetime
+import json
+import random
+import threading
+import urllib2
+from StringIO import StringIO
+from botocore.awsrequest import AWSResponse
+from webserver_profiles import INDEX_HTML
+
+
+# Simulated seconds Cloud Formation takes to create each resource type
+RESOURCE_BUILD_SECONDS = {
+    'AWS::EC2::VPC': 15,
+    'AWS::EC2::Subnet': 5,
+    'AWS::EC2::InternetGateway': 15,
+    'AWS::EC2::VPCGatewayAttachment': 15,
+    'AWS::EC2::RouteTable': 2,
+    'AWS::EC2::Route': 15,
+    'AWS::EC2::SubnetRouteTableAssociation': 2,
+    'AWS::EC2::NetworkAcl': 2,
+    'AWS::EC2::NetworkAclEntry': 2,
+    'AWS::EC2::SubnetNetworkAclAssociation': 2,
+    'AWS::EC2::SecurityGroup': 5,
+    'AWS::EC2::SecurityGroupIngress': 2,
+    'AWS::EC2::Instance': 60,
+    'AWS::EC2::LaunchTemplate': 2,
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': 180,
+    'AWS::ElasticLoadBalancingV2::TargetGroup': 5,
+    'AWS::ElasticLoadBalancingV2::Listener': 2,
+    'AWS::AutoScaling::AutoScalingGroup': 120,
+    'AWS::AutoScaling::ScalingPolicy': 2,
+    'AWS::CloudFront::CachePolicy': 2,
+    'AWS::CloudFront::Distribution': 240
+}
+DEFAULT_BUILD_SECONDS = 5
+
+# Simulated seconds Cloud Formation takes to delete each resource
+DELETE_SECONDS_FACTOR = 0.5
+
+# Simulated seconds Cloud Formation takes to compute a Change Set
+CHANGE_SET_SECONDS = 5.0
+
+# Operations that are throttled when a throttle rate is set
+THROTTLED_OPERATIONS = frozenset(['DescribeStackEvents', 'DescribeChangeSet'])
+
+EVENTS_PAGE_SIZE = 100
+EPOCH = datetime.datetime(2020, 1, 1)
+SIMULATED_URL = 'http://203.0.113.10'
+SIMULATED_IMAGE_ID = 'ami-0123456789abcdef0'
+SIMULATED_PREFIX_LIST_ID = 'pl-0123456789abcdef0'
+STACK_TYPE = 'AWS::CloudFormation::Stack'
+
+
+class SimulatedClock(object):
+    """ A clock that only moves when something sleeps or waits on it
+
+    It provides time() and sleep() so it can stand in for the time module.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.0)
+
+    def timestamp(self, seconds):
+        return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class SimulatedCloud(object):
+    """ Answers EC2, SSM and Cloud Formation calls from botocore clients offline
+
+    Attached clients still build and validate every request, but the
+    "before-call" event returns a simulated response instead of sending it.
+    Every call advances the clock by the API latency (with +/-50% jitter),
+    calls to THROTTLED_OPERATIONS fail with a Throttling error at
+    throttle_rate, and a created Stack builds its resources in dependency
+    order over simulated time (RESOURCE_BUILD_SECONDS times build_scale).
+    The web server answers open_url() web_ready_seconds after the Stack
+    completes.  A deleted Stack removes its resources in reverse dependency
+    order; those named in delete_failures fail to delete unless retained.
+    An executed Change Set adds, updates and then removes resources in the
+    same way.  Calls that are not simulated fail with an "InvalidAction"
+    error, as botocore reports any other AWS error.
+    """
+
+    def __init__(self, clock, latency=0.05, throttle_rate=0.0, build_scale=1.0,
+                 web_ready_seconds=20.0, seed=0, delete_failures=()):
+        self.clock = clock
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.build_scale = build_scale
+        self.web_ready_seconds = web_ready_seconds
+        self.delete_failures = frozenset(delete_failures)
+        self.random = random.Random(seed)
+        self.calls = collections.Counter()
+        self.throttled = 0
+        self.stacks = {}
+        self.change_sets = {}
+        self._stack_names = {}
+        self._clients = []
+        self._local = threading.local()
+
+    def attach(self, client):
+        client.meta.events.register('before-parameter-build.*.*', self._capture_params,
+                                    unique_id=self._unique_id('params'))
+        client.meta.events.register('before-call.*.*', self._handle,
+                                    unique_id=self._unique_id('call'))
+        self._clients.append(client)
+
+    def detach(self):
+        for client in self._clients:
+            client.meta.events.unregister('before-parameter-build.*.*',
+                                          unique_id=self._unique_id('params'))
+            client.meta.events.unregister('before-call.*.*',
+                                          unique_id=self._unique_id('call'))
+        self._clients = []
+
+    def open_url(self, url, timeout=None):
+        """ Stand-in for urllib2.urlopen on the web server URL """
+
+        self._wait_latency()
+        for stack in self.stacks.values():
+            if self.clock.now >= stack['completed_at'] + self.web_ready_seconds:
+                return StringIO(INDEX_HTML)
+        raise urllib2.URLError('[Errno 111] Connection refused')
+
+    def completion_lag(self):
+        """ Seconds between each Stack completing and a caller seeing it """
+
+        return [stack['seen_at'] - stack['completed_at']
+                for stack in self.stacks.values() if stack['seen_at'] is not None]
+
+    def _unique_id(self, hook):
+        # Handler IDs are unique per client, not per event
+        return 'simulated-cloud-%s-%d' % (hook, id(self))
+
+    def _wait_latency(self):
+        self.clock.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+    def _capture_params(self, params, **kwargs):
+        # "before-call" only sees the serialized request, so keep the API params
+        #     (per thread, since environments may be provisioned concurrently)
+        self._local.params = dict(params)
+
+    def _handle(self, model, **kwargs):
+        operation = model.name
+        params = self._local.params
+        self.calls[operation] += 1
+        self._wait_latency()
+        if operation in THROTTLED_OPERATIONS and self.random.random() < self.throttle_rate:
+            self.throttled += 1
+            return self._error(400, 'Throttling', 'Rate exceeded')
+        handler = getattr(self, '_' + operation, None)
+        if handler is None:
+            return self._error(400, 'InvalidAction', '%s is not simulated' % operation)
+        return handler(params)
+
+    def _response(self, parsed):
+        parsed.setdefault('ResponseMetadata', {'HTTPStatusCode': 200})
+        return AWSResponse(None, 200, {}, None), parsed
+
+    def _error(self, status, code, message):
+        parsed = {
+            'ResponseMetadata': {'HTTPStatusCode': status},
+            'Error': {'Code': code, 'Message': message}
+        }
+        return AWSResponse(None, status, {}, None), parsed
+
+    def _DescribeKeyPairs(self, params):
+        return self._response({'KeyPairs': [{'KeyName': name, 'KeyFingerprint': '00'}
+                                            for name in params['KeyNames']]})
+
+    def _GetParameter(self, params):
+        return self._response({'Parameter': {'Name': params['Name'], 'Type': 'String',
+                                             'Value': SIMULATED_IMAGE_ID}})
+
+    def _DescribeManagedPrefixLists(self, params):
+        return self._response({'PrefixLists': [{
+            'PrefixListId': SIMULATED_PREFIX_LIST_ID,
+            'PrefixListName': 'com.amazonaws.global.cloudfront.origin-facing',
+            'AddressFamily': 'IPv4',
+            'State': 'create-complete',
+            'MaxEntries': 55
+        }]})
+
+    def _ValidateTemplate(self, params):
+        return self._response({'Parameters': []})
+
+    def _CreateStack(self, params):
+        name = params['StackName']
+        if name in self.stacks and self._status(self.stacks[name]) != 'DELETE_COMPLETE':
+            return self._error(400, 'AlreadyExistsException',
+                               'Stack [%s] already exists' % name)
+        stack_id = 'arn:aws:cloudformation:us-east-1:123456789012:stack/%s/%d' % (
+            name, len(self._stack_names) + 1)
+        template = json.loads(params['TemplateBody'])
+        exports = self._exports()
+        for export in _imports(template):
+            # Values are only exported once the exporting Stack is complete
+            if export not in exports or \
+                    self._status(exports[export]) not in ('CREATE_COMPLETE', 'UPDATE_COMPLETE'):
+                return self._error(400, 'ValidationError', 'No export named %s found' % export)
+        events, completed_at = self._build_events(stack_id, name, template)
+        self._stack_names[stack_id] = name
+        self.stacks[name] = {
+            'StackId': stack_id,
+            'StackName': name,
+            'CreationTime': self.clock.timestamp(self.clock.now),
+            'template': template,
+            'events': events,
+            'completed_at': completed_at,
+            'seen_at': None,
+            'remaining': set(template.get('Resources', {}))
+        }
+        return self._response({'StackId': stack_id})
+
+    def _DeleteStack(self, params):
+        stack = self._stack(params['StackName'])
+        if stack is None:
+            return self._response({})
+        status = self._status(stack)
+        if status in ('DELETE_COMPLETE', 'DELETE_IN_PROGRESS'):
+            return self._response({})
+        for export, importer in self._imported_exports(stack):
+            return self._error(400, 'ValidationError',
+                               'Export %s cannot be deleted as it is in use by %s' %
+                               (export, importer))
+        retain = set(params.get('RetainResources', []))
+        if retain and status != 'DELETE_FAILED':
+            return self._error(400, 'ValidationError',
+                               'Resources can only be retained when deletion failed')
+        stack['events'].extend(self._delete_events(stack, retain))
+        return self._response({})
+
+    def _DescribeStackEvents(self, params):
+        stack = self._stack(params['StackName'])
+        now = self.clock.timestamp(self.clock.now)
+        visible = [event for event in stack['events'] if event['Timestamp'] <= now]
+        visible.reverse()
+        start = int(params.get('NextToken', 0))
+        response = {'StackEvents': visible[start:start + EVENTS_PAGE_SIZE]}
+        if start + EVENTS_PAGE_SIZE < len(visible):
+            response['NextToken'] = str(start + EVENTS_PAGE_SIZE)
+        if stack['seen_at'] is None and start == 0 and \
+                self.clock.now >= stack['completed_at']:
+            stack['seen_at'] = self.clock.now
+        return self._response(response)
+
+    def _DescribeStacks(self, params):
+        stack = self._stack(params['StackName'])
+        status = self._status(stack) if stack is not None else None
+        # Deleted Stacks can only be described by their ID
+        if stack is None or (status == 'DELETE_COMPLETE' and
+                             params['StackName'] == stack['StackName']):
+            return self._error(400, 'ValidationError',
+                               'Stack with id %s does not exist' % params['StackName'])
+        outputs = []
+        for index, key in enumerate(sorted(stack['template'].get('Outputs', {}))):
+            value = SIMULATED_URL if key == 'URL' else '%s-%08x' % (key.lower(), index)
+            outputs.append({'OutputKey': key, 'OutputValue': value})
+        return self._response({'Stacks': [{
+            'StackId': stack['StackId'],
+            'StackName': stack['StackName'],
+            'CreationTime': stack['CreationTime'],
+            'StackStatus': status,
+            'Outputs': outputs if status in ('CREATE_COMPLETE', 'UPDATE_COMPLETE') else []
+        }]})
+
+    def _DescribeStackResources(self, params):
+        stack = self._stack(params['StackName'])
+        if stack is None:
+            return self._error(400, 'ValidationError',
+                               'Stack with id %s does not exist' % params['StackName'])
+        now = self.clock.timestamp(self.clock.now)
+        latest = collections.OrderedDict()
+        for event in stack['events']:
+            if event['Timestamp'] <= now and event['ResourceType'] != STACK_TYPE:
+                latest[event['LogicalResourceId']] = event
+        return self._response({'StackResources': [{
+            'StackName': stack['StackName'],
+            'StackId': stack['StackId'],
+            'LogicalResourceId': name,
+            'PhysicalResourceId': event['PhysicalResourceId'],
+            'ResourceType': event['ResourceType'],
+            'Timestamp': event['Timestamp'],
+            'ResourceStatus': event['ResourceStatus']
+        } for name, event in latest.items()]})
+
+    def _GetTemplate(self, params):
+        stack = self._stack(params['StackName'])
+        if stack is None or self._status(stack) == 'DELETE_COMPLETE':
+            return self._error(400, 'ValidationError',
+                               'Stack with id %s does not exist' % params['StackName'])
+        return self._response({'TemplateBody': json.dumps(stack['template']),
+                               'StagesAvailable': ['Original', 'Processed']})
+
+    def _CreateChangeSet(self, params):
+        stack = self._stack(params['StackName'])
+        if stack is None or self._status(stack) == 'DELETE_COMPLETE':
+            return self._error(400, 'ValidationError',
+                               'Stack [%s] does not exist' % params['StackName'])
+        status = self._status(stack)
+        if status.endswith('_IN_PROGRESS') or status in ('CREATE_FAILED', 'ROLLBACK_COMPLETE'):
+            return self._error(400, 'ValidationError',
+                               'Stack:%s is in %s state and can not be updated.' %
+                               (stack['StackId'], status))
+        change_set_id = 'arn:aws:cloudformation:us-east-1:123456789012:changeSet/%s/%d' % (
+            params['ChangeSetName'], len(self.change_sets) + 1)
+        template = json.loads(params['TemplateBody'])
+        self.change_sets[change_set_id] = {
+            'Id': change_set_id,
+            'ChangeSetName': params['ChangeSetName'],
+            'stack': stack,
+            'template': template,
+            'changes': _template_changes(stack['template'], template),
+            'unchanged': template == stack['template'],
+            'computed_at': self.clock.now + CHANGE_SET_SECONDS * self.build_scale
+        }
+        return self._response({'Id': change_set_id, 'StackId': stack['StackId']})
+
+    def _DescribeChangeSet(self, params):
+        change_set = self.change_sets.get(params['ChangeSetName'])
+        if change_set is None:
+            return self._error(404, 'ChangeSetNotFound',
+                               'ChangeSet [%s] does not exist' % params['ChangeSetName'])
+        response = {
+            'ChangeSetId': change_set['Id'],
+            'ChangeSetName': change_set['ChangeSetName'],
+            'StackId': change_set['stack']['StackId'],
+            'StackName': change_set['stack']['StackName'],
+            'ExecutionStatus': 'UNAVAILABLE',
+            'Status': 'CREATE_IN_PROGRESS',
+            'Changes': []
+        }
+        if self.clock.now < change_set['computed_at']:
+            return self._response(response)
+        if change_set['unchanged']:
+            response.update(Status='FAILED',
+                            StatusReason="The submitted information didn't contain changes. "
+                                         "Submit different information to create a change "
+                                         "set.")
+            return self._response(response)
+        response.update(Status='CREATE_COMPLETE', ExecutionStatus='AVAILABLE', Changes=[{
+            'Type': 'Resource',
+            'ResourceChange': dict(change, Scope=[], Details=[])
+        } for change in change_set['changes']])
+        return self._response(response)
+
+    def _ExecuteChangeSet(self, params):
+        change_set = self.change_sets.get(params['ChangeSetName'])
+        if change_set is None:
+            return self._error(404, 'ChangeSetNotFound',
+                               'ChangeSet [%s] does not exist' % params['ChangeSetName'])
+        if change_set['unchanged'] or self.clock.now < change_set['computed_at']:
+            return self._error(400, 'InvalidChangeSetStatus',
+                               'ChangeSet [%s] cannot be executed in its current status' %
+                               change_set['Id'])
+        stack = change_set['stack']
+        events, completed_at = self._update_events(stack, change_set['template'],
+                                                   change_set['changes'])
+        stack['events'].extend(events)
+        stack['template'] = change_set['template']
+        stack['completed_at'] = completed_at
+        stack['seen_at'] = None
+        for change in change_set['changes']:
+            if change['Action'] == 'Add':
+                stack['remaining'].add(change['LogicalResourceId'])
+            elif change['Action'] == 'Remove':
+                stack['remaining'].discard(change['LogicalResourceId'])
+        # Executing a Change Set removes every Change Set of the Stack
+        for change_set_id, other in self.change_sets.items():
+            if other['stack'] is stack:
+                del self.change_sets[change_set_id]
+        return self._response({})
+
+    def _DeleteChangeSet(self, params):
+        if self.change_sets.pop(params['ChangeSetName'], None) is None:
+            return self._error(404, 'ChangeSetNotFound',
+                               'ChangeSet [%s] does not exist' % params['ChangeSetName'])
+        return self._response({})
+
+    def _exports(self):
+        """ Return the exporting Stack of each value exported by a Stack that is not deleted """
+
+        exports = {}
+        for stack in self.stacks.values():
+            if self._status(stack) != 'DELETE_COMPLETE':
+                for output in stack['template'].get('Outputs', {}).values():
+                    if 'Export' in output:
+                        exports[_export_name(output['Export']['Name'], stack)] = stack
+        return exports
+
+    def _imported_exports(self, stack):
+        """ Yield (export, importing Stack name) for each export of the Stack in use """
+
+        exports = set(name for name, exporter in self._exports().items() if exporter is stack)
+        for other in self.stacks.values():
+            if other is not stack and self._status(other) != 'DELETE_COMPLETE':
+                for export in _imports(other['template']):
+                    if export in exports:
+                        yield export, other['StackName']
+
+    def _stack(self, name_or_id):
+        return self.stacks.get(self._stack_names.get(name_or_id, name_or_id))
+
+    def _status(self, stack):
+        """ Return the Stack status as of the simulated time """
+
+        now = self.clock.timestamp(self.clock.now)
+        status = 'CREATE_IN_PROGRESS'
+        for event in stack['events']:
+            if event['Timestamp'] <= now and event['ResourceType'] == STACK_TYPE:
+                status = event['ResourceStatus']
+        return status
+
+    def _build_events(self, stack_id, stack_name, template):
+        """ Schedule the Stack events for creating every resource in the template
+
+        A resource starts once everything it Refs, GetAtts or DependsOn has
+        been created.  Returns the events (oldest first) and the simulated
+        time at which the Stack completes.
+        """
+
+        resources = template.get('Resources', {})
+        started = self.clock.now
+        finish_times = self._build_times(resources, resources, started)
+        completed_at = max([finish for start, finish in finish_times.values()] or
+                           [started]) + 1.0
+
+        schedule = [(started, stack_name, STACK_TYPE, stack_id, 'CREATE_IN_PROGRESS')]
+        for name, (start, finish) in finish_times.items():
+            schedule.append((start, name, resources[name]['Type'], '', 'CREATE_IN_PROGRESS'))
+            schedule.append((finish, name, resources[name]['Type'],
+                             '%s-simulated' % name.lower(), 'CREATE_COMPLETE'))
+        schedule.append((completed_at, stack_name, STACK_TYPE, stack_id, 'CREATE_COMPLETE'))
+        schedule.sort(key=lambda entry: (entry[0], entry[4] != 'CREATE_IN_PROGRESS'))
+
+        events = []
+        for index, (at, name, resource_type, physical_id, status) in enumerate(schedule):
+            events.append({
+                'StackId': stack_id,
+                'EventId': '%s-%d' % (name, index),
+                'StackName': stack_name,
+                'LogicalResourceId': name,
+                'PhysicalResourceId': physical_id,
+                'ResourceType': resource_type,
+                'Timestamp': self.clock.timestamp(at),
+                'ResourceStatus': status
+            })
+        return events, completed_at
+
+    def _build_times(self, resources, names, started):
+        """ Return the (start, finish) simulated time of building each named resource
+
+        A resource starts once every named resource it Refs, GetAtts or
+        DependsOn has been built; other resources already exist.
+        """
+
+        build_times = {}
+
+        def finish_time(name):
+            if name not in build_times:
+                start = started + 1.0
+                for dependency in _dependencies(resources[name]):
+                    if dependency in names and dependency != name:
+                        start = max(start, finish_time(dependency))
+                build = RESOURCE_BUILD_SECONDS.get(resources[name]['Type'],
+                                                   DEFAULT_BUILD_SECONDS)
+                build_times[name] = (start, start + build * self.build_scale)
+            return build_times[name][1]
+
+        for name in names:
+            finish_time(name)
+        return build_times
+
+    def _update_events(self, stack, template, changes):
+        """ Schedule the Stack events for executing a Change Set
+
+        Added and modified resources are built in dependency order, then the
+        removed ones are deleted during the cleanup.  Returns the events
+        (oldest first) and the simulated time at which the Stack completes.
+        """
+
+        resources = template.get('Resources', {})
+        old_resources = stack['template'].get('Resources', {})
+        actions = dict((change['LogicalResourceId'], change['Action']) for change in changes)
+        started = self.clock.now
+        build_times = self._build_times(
+            resources, set(name for name, action in actions.items() if action != 'Remove'),
+            started)
+        built = max([finish for start, finish in build_times.values()] or [started]) + 1.0
+
+        schedule = [(started, stack['StackName'], STACK_TYPE, stack['StackId'],
+                     'UPDATE_IN_PROGRESS')]
+        for name, (start, finish) in build_times.items():
+            operation = 'CREATE' if actions[name] == 'Add' else 'UPDATE'
+            physical_id = '%s-simulated' % name.lower()
+            schedule.append((start, name, resources[name]['Type'],
+                             physical_id if operation == 'UPDATE' else '',
+                             operation + '_IN_PROGRESS'))
+            schedule.append((finish, name, resources[name]['Type'], physical_id,
+                             operation + '_COMPLETE'))
+        schedule.append((built, stack['StackName'], STACK_TYPE, stack['StackId'],
+                         'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS'))
+        completed_at = built
+        for name in sorted(name for name, action in actions.items() if action == 'Remove'):
+            resource_type = old_resources[name]['Type']
+            seconds = RESOURCE_BUILD_SECONDS.get(resource_type, DEFAULT_BUILD_SECONDS) * \
+                self.build_scale * DELETE_SECONDS_FACTOR
+            physical_id = '%s-simulated' % name.lower()
+            schedule.append((built, name, resource_type, physical_id, 'DELETE_IN_PROGRESS'))
+            schedule.append((built + seconds, name, resource_type, physical_id,
+                             'DELETE_COMPLETE'))
+            completed_at = max(completed_at, built + seconds)
+        completed_at += 1.0
+        schedule.append((completed_at, stack['StackName'], STACK_TYPE, stack['StackId'],
+                         'UPDATE_COMPLETE'))
+        schedule.sort(key=lambda entry: (entry[0], not entry[4].endswith('_IN_PROGRESS')))
+
+        first = len(stack['events'])
+        events = [{
+            'StackId': stack['StackId'],
+            'EventId': '%s-%d' % (name, first + index),
+            'StackName': stack['StackName'],
+            'LogicalResourceId': name,
+            'PhysicalResourceId': physical_id,
+            'ResourceType': resource_type,
+            'Timestamp': self.clock.timestamp(at),
+            'ResourceStatus': status
+        } for index, (at, name, resource_type, physical_id, status) in enumerate(schedule)]
+        return events, completed_at
+
+    def _delete_events(self, stack, retain):
+        """ Schedule the Stack events for deleting every remaining resource
+
+        A resource is deleted once everything that refers to it is gone.
+        Resources in delete_failures fail unless retained, and everything
+        they refer to is left in place.
+        """
+
+        resources = stack['template'].get('Resources', {})
+        remaining = stack['remaining']
+        dependents = dict((name, set()) for name in remaining)
+        for name in remaining:
+            for dependency in _dependencies(resources[name]):
+                if dependency in dependents and dependency != name:
+                    dependents[dependency].add(name)
+
+        started = self.clock.now
+        outcomes = {}
+
+        def outcome(name):
+            # Returns (start, end, status); the status is None if it is left in place
+            if name not in outcomes:
+                start = started + 1.0
+                blocked = False
+                for dependent in dependents[name]:
+                    dependent_end, dependent_status = outcome(dependent)[1:]
+                    if dependent_status in (None, 'DELETE_FAILED'):
+                        blocked = True
+                    else:
+                        start = max(start, dependent_end)
+                build = RESOURCE_BUILD_SECONDS.get(resources[name]['Type'],
+                                                   DEFAULT_BUILD_SECONDS)
+                end = start + build * self.build_scale * DELETE_SECONDS_FACTOR
+                if blocked:
+                    outcomes[name] = (start, start, None)
+                elif name in retain:
+                    outcomes[name] = (start, start, 'DELETE_SKIPPED')
+                elif name in self.delete_failures:
+                    outcomes[name] = (start, end, 'DELETE_FAILED')
+                else:
+                    outcomes[name] = (start, end, 'DELETE_COMPLETE')
+            return outcomes[name]
+
+        schedule = [(started, stack['StackName'], STACK_TYPE, stack['StackId'],
+                     'DELETE_IN_PROGRESS', None)]
+        ended = started
+        failed = []
+        for name in sorted(remaining):
+            start, end, status = outcome(name)
+            physical_id = '%s-simulated' % name.lower()
+            resource_type = resources[name]['Type']
+            if status is None:
+                continue
+            if status != 'DELETE_SKIPPED':
+                schedule.append((start, name, resource_type, physical_id,
+                                 'DELETE_IN_PROGRESS', None))
+            if status == 'DELETE_FAILED':
+                failed.append(name)
+                schedule.append((end, name, resource_type, physical_id, status,
+                                 'resource %s has a dependent object' % physical_id))
+            else:
+                schedule.append((end, name, resource_type, physical_id, status, None))
+                remaining.discard(name)
+            ended = max(ended, end)
+
+        if failed:
+            schedule.append((ended + 1.0, stack['StackName'], STACK_TYPE, stack['StackId'],
+                             'DELETE_FAILED', 'The following resource(s) failed to delete: '
+                             '[%s]. ' % ', '.join(failed)))
+        else:
+            schedule.append((ended + 1.0, stack['StackName'], STACK_TYPE, stack['StackId'],
+                             'DELETE_COMPLETE', None))
+        schedule.sort(key=lambda entry: (entry[0], entry[4] != 'DELETE_IN_PROGRESS'))
+
+        events = []
+        first = len(stack['events'])
+        for index, (at, name, resource_type, physical_id, status, reason) in \
+                enumerate(schedule):
+            event = {
+                'StackId': stack['StackId'],
+                'EventId': '%s-%d' % (name, first + index),
+                'StackName': stack['StackName'],
+                'LogicalResourceId': name,
+                'PhysicalResourceId': physical_id,
+                'ResourceType': resource_type,
+                'Timestamp': self.clock.timestamp(at),
+                'ResourceStatus': status
+            }
+            if reason is not None:
+                event['ResourceStatusReason'] = reason
+            events.append(event)
+        return events
+
+
+def _template_changes(old, new):
+    """ Return the ResourceChange of every resource that a new template adds,
+    modifies or removes, in logical ID order
+    """
+
+    old_resources = old.get('Resources', {})
+    new_resources = new.get('Resources', {})
+    changes = []
+    for name in sorted(set(old_resources) | set(new_resources)):
+        if name not in old_resources:
+            action, replacement = 'Add', None
+        elif name not in new_resources:
+            action, replacement = 'Remove', None
+        elif old_resources[name] != new_resources[name]:
+            action = 'Modify'
+            replacement = 'True' if old_resources[name]['Type'] != \
+                new_resources[name]['Type'] else 'False'
+        else:
+            continue
+        change = {
+            'Action': action,
+            'LogicalResourceId': name,
+            'ResourceType': (new_resources.get(name) or old_resources[name])['Type']
+        }
+        if replacement is not None:
+            change['Replacement'] = replacement
+        changes.append(change)
+    return changes
+
+
+def _imports(value):
+    """ Yield the export names a template (or any part of it) imports """
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == 'Fn::ImportValue' and isinstance(item, basestring):
+                yield item
+            else:
+                for export in _imports(item):
+                    yield export
+    elif isinstance(value, list):
+        for item in value:
+            for export in _imports(item):
+                yield export
+
+
+def _export_name(name, stack):
+    """ Resolve an export name, which may use ${AWS::StackName} in an Fn::Sub """
+
+    if isinstance(name, dict) and 'Fn::Sub' in name:
+        return name['Fn::Sub'].replace('${AWS::StackName}', stack['StackName'])
+    return name
+
+
+def _dependencies(value):
+    """ Yield the logical IDs a template resource (or any part of it) refers to """
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == 'Ref' and isinstance(item, basestring):
+                yield item
+            elif key == 'Fn::GetAtt' and isinstance(item, list):
+                yield item[0]
+            elif key == 'DependsOn':
+                for dependency in ([item] if isinstance(item, basestring) else item):
+                    yield dependency
+            else:
+                for dependency in _dependencies(item):
+                    yield dependency
+    elif isinstance(value, list):
+        for item in value:
+            for dependency in _dependencies(item):
+                yield dependency
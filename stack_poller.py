@@ -0,0 +1,183 @@
+import time
+import botocore
+from aws_calls import THROTTLING_ERROR_CODES
+
+
+# Stack states from which CloudFormation will not move on its own
+TERMINAL_STACK_STATUSES = frozenset([
+    'CREATE_COMPLETE',
+    'CREATE_FAILED',
+    'ROLLBACK_COMPLETE',
+    'ROLLBACK_FAILED',
+    'DELETE_COMPLETE',
+    'DELETE_FAILED',
+    'UPDATE_COMPLETE',
+    'UPDATE_FAILED',
+    'UPDATE_ROLLBACK_COMPLETE',
+    'UPDATE_ROLLBACK_FAILED',
+    'IMPORT_COMPLETE',
+    'IMPORT_ROLLBACK_COMPLETE',
+    'IMPORT_ROLLBACK_FAILED'
+])
+
+# Terminal states that mean the requested operation succeeded
+SUCCESSFUL_STACK_STATUSES = frozenset([
+    'CREATE_COMPLETE',
+    'DELETE_COMPLETE',
+    'UPDATE_COMPLETE',
+    'IMPORT_COMPLETE'
+])
+
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+
+
+class StackPollTimeout(Exception):
+    """ Raised when a stack does not reach a terminal state in time """
+
+
+class StackPoller(object):
+    """ Follows the event stream of a Cloud Formation Stack until it settles
+
+    Each pass pages through describe_stack_events (newest first) only until
+    it reaches an event that has already been seen, so a pass costs a single
+    API call unless more than one page of events arrived since the last one.
+    The stack status is taken from the stack's own events, so no separate
+    describe_stacks call is needed while polling.
+
+    The wait between passes starts at min_interval and grows by
+    backoff_factor (up to max_interval) while nothing new happens; any new
+    event drops it back to min_interval.  The clock and sleep functions can
+    be replaced for testing.
+    """
+
+    def __init__(self, client, stack_name, on_event=None,
+                 min_interval=2.0, max_interval=15.0, backoff_factor=1.5,
+                 timeout=None, clock=time.time, sleep=time.sleep):
+        self.client = client
+        self.stack_name = stack_name
+        self.on_event = on_event
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.seen_event_ids = set()
+        self.stack_status = None
+        self.api_calls = 0
+
+    def mark(self):
+        """ Treat every event already on the stack as seen
+
+        Call this before starting an update or delete on an existing stack
+        so that its historical events (and terminal status) are ignored.
+        """
+
+        response = self._describe_stack_events()
+        events = response['StackEvents']
+        self.seen_event_ids.update(event['EventId'] for event in events)
+
+    def fetch_new_events(self):
+        """ Return the events added since the last pass, oldest first """
+
+        new_events = []
+        next_token = None
+        while True:
+            response = self._describe_stack_events(next_token)
+            reached_seen_event = False
+            for event in response['StackEvents']:
+                if event['EventId'] in self.seen_event_ids:
+                    reached_seen_event = True
+                    break
+                new_events.append(event)
+            next_token = response.get('NextToken')
+            if reached_seen_event or not next_token:
+                break
+
+        new_events.reverse()
+        for event in new_events:
+            self.seen_event_ids.add(event['EventId'])
+            if self._is_stack_event(event):
+                self.stack_status = event['ResourceStatus']
+        return new_events
+
+    def wait(self):
+        """ Poll until the stack reaches a terminal state and return it """
+
+        started = self.clock()
+        interval = self.min_interval
+        while True:
+            try:
+                new_events = self.fetch_new_events()
+            except botocore.exceptions.ClientError, err:
+                if err.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                    raise
+                new_events = []
+                interval = self.max_interval
+
+            for event in new_events:
+                if self.on_event is not None:
+                    self.on_event(event)
+
+            if self.stack_status in TERMINAL_STACK_STATUSES:
+                return self.stack_status
+
+            if new_events:
+                interval = self.min_interval
+            else:
+                interval = min(interval * self.backoff_factor, self.max_interval)
+
+            if self.timeout is not None and \
+                    self.clock() - started + interval > self.timeout:
+                raise StackPollTimeout(
+                    'Stack "%s" did not reach a terminal state within %s seconds '
+                    '(last status: %s)' % (self.stack_name, self.timeout, self.stack_status))
+            self.sleep(interval)
+
+    def _describe_stack_events(self, next_token=None):
+        self.api_calls += 1
+        if next_token:
+            return self.client.describe_stack_events(StackName=self.stack_name,
+                                                     NextToken=next_token)
+        return self.client.describe_stack_events(StackName=self.stack_name)
+
+    def _is_stack_event(self, event):
+        # The stack's own events carry its ARN as the physical resource ID;
+        #     nested stacks share the resource type but not the ARN
+        return event.get('ResourceType') == STACK_RESOURCE_TYPE and \
+            event.get('PhysicalResourceId') == event.get('StackId')
+
+
+def wait_for_change_set(client, change_set_id, min_interval=1.0, max_interval=10.0,
+                        backoff_factor=1.5, timeout=None, clock=time.time, sleep=time.sleep):
+    """ Poll describe_change_set until the Change Set is computed or fails
+
+    Returns the last describe_change_set response, with every page of
+    Changes merged into it.
+    """
+
+    started = clock()
+    interval = min_interval
+    while True:
+        try:
+            details = client.describe_change_set(ChangeSetName=change_set_id)
+        except botocore.exceptions.ClientError, err:
+            if err.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                raise
+            details = {'Status': 'CREATE_PENDING'}
+            interval = max_interval
+
+        if details['Status'] in ('CREATE_COMPLETE', 'FAILED'):
+            next_token = details.get('NextToken')
+            while next_token:
+                page = client.describe_change_set(ChangeSetName=change_set_id,
+                                                  NextToken=next_token)
+                details['Changes'].extend(page['Changes'])
+                next_token = page.get('NextToken')
+            return details
+
+        if timeout is not None and clock() - started + interval > timeout:
+            raise StackPollTimeout(
+                'Change Set "%s" was not computed within %s seconds' % (change_set_id, timeout))
+        sleep(interval)
+        interval = min(interval * backoff_factor, max_interval)
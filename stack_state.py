@@ -0,0 +1,95 @@
+import json
+import threading
+import time
+import aws_session
+from json_files import atomic_write_json
+
+
+class StackState(object):
+    """ On-disk record of provisioned Stacks, keyed by Region and Stack name
+
+    Each entry holds the Stack ID, its Outputs and the physical ID of every
+    resource, so follow-up commands can look resources up by ID instead of
+    scanning the account with filters.  The file is read again for every
+    lookup and update, since several processes may share it.  A missing or
+    unreadable state file is treated as empty, and failures to write it are
+    ignored.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def get(self, region, stack_name):
+        """ Return the recorded entry for the Stack, or None """
+
+        with self._lock:
+            return self._load().get(_key(region, stack_name))
+
+    def put(self, region, stack_name, entry):
+        with self._lock:
+            entries = self._load()
+            entries[_key(region, stack_name)] = dict(entry, recorded_at=self.clock())
+            self._save(entries)
+
+    def remove(self, region, stack_name):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(_key(region, stack_name), None) is not None:
+                self._save(entries)
+
+    def _load(self):
+        try:
+            with open(self.path) as state_file:
+                return dict(json.load(state_file).get('stacks', {}))
+        except (IOError, OSError, ValueError, AttributeError):
+            return {}
+
+    def _save(self, entries):
+        try:
+            atomic_write_json(self.path, {'stacks': entries}, indent=2, sort_keys=True)
+        except (IOError, OSError):
+            # The state is only an optimization, so never fail the run over it
+            pass
+
+
+def describe_stack_state(client, stack_name, network_stack=None):
+    """ Return the state entry of a Stack, read with two Cloud Formation calls """
+
+    stack = client.describe_stacks(StackName=stack_name)['Stacks'][0]
+    resources = client.describe_stack_resources(StackName=stack['StackId'])['StackResources']
+    return {
+        'stack_id': stack['StackId'],
+        'stack_name': stack['StackName'],
+        'status': stack['StackStatus'],
+        'outputs': dict((stack_output['OutputKey'], stack_output['OutputValue'])
+                        for stack_output in stack.get('Outputs', [])),
+        'resources': dict((resource['LogicalResourceId'], {
+                              'type': resource['ResourceType'],
+                              'physical_id': resource.get('PhysicalResourceId')
+                          }) for resource in resources),
+        'network_stack': network_stack
+    }
+
+
+def record_stack(state, id, secret, region, stack_name, network_stack=None):
+    """ Describe the Stack and record it in the StackState; returns the entry """
+
+    client = aws_session.get_client('cloudformation', region, id, secret)
+    entry = describe_stack_state(client, stack_name, network_stack)
+    entry['region'] = region
+    state.put(region, stack_name, entry)
+    return entry
+
+
+def physical_id(entry, logical_id):
+    """ Return the physical ID of a resource in a state entry, or None """
+
+    if entry is None:
+        return None
+    return entry['resources'].get(logical_id, {}).get('physical_id')
+
+
+def _key(region, stack_name):
+    return '%s/%s' % (region, stack_name)
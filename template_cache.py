@@ -0,0 +1,99 @@
+import hashlib
+import json
+import threading
+from json_files import atomic_write_json
+
+
+def content_hash(*parts):
+    """ Return a stable SHA-256 hex digest of JSON-serializable parts """
+
+    serialized = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class TemplateCache(object):
+    """ In-process memo of built templates and their serialized JSON bodies
+
+    Entries are keyed by a content hash of everything the template depends
+    on, so each distinct template is built and serialized exactly once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get_or_build(self, key, build, timer=None):
+        """ Return the cached (template, body) for key, building it if needed
+
+        When a ProvisioningTimer is given, building and serializing are timed
+        as the "create_template" and "to_json" phases.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if timer is None:
+                    template = build()
+                    body = template.to_json()
+                else:
+                    with timer.phase('create_template'):
+                        template = build()
+                    with timer.phase('to_json'):
+                        body = template.to_json()
+                entry = (template, body)
+                self._entries[key] = entry
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ValidationCache(object):
+    """ On-disk record of template bodies that passed validate_template
+
+    Only the SHA-256 digest of each validated body is stored.  A missing or
+    unreadable cache file is treated as empty.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._digests = None
+
+    def is_validated(self, body):
+        with self._lock:
+            return self._body_digest(body) in self._load()
+
+    def add(self, body):
+        """ Record the body as validated and persist the cache file """
+
+        with self._lock:
+            digests = self._load()
+            digest = self._body_digest(body)
+            if digest in digests:
+                return
+            digests.add(digest)
+            self._save(digests)
+
+    def _load(self):
+        if self._digests is None:
+            try:
+                with open(self.path) as cache_file:
+                    self._digests = set(json.load(cache_file).get('validated', []))
+            except (IOError, OSError, ValueError, AttributeError):
+                self._digests = set()
+        return self._digests
+
+    def _save(self, digests):
+        try:
+            atomic_write_json(self.path, {'validated': sorted(digests)})
+        except (IOError, OSError):
+            # The cache is only an optimization, so never fail the run over it
+            pass
+
+    @staticmethod
+    def _body_digest(body):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        return hashlib.sha256(body).hexdigest()
@@ -0,0 +1,353 @@
+import collections
+import json
+import re
+
+
+# A dependency of one resource on another: "reference" for a Ref, Fn::GetAtt
+#     or Fn::Sub variable, "depends_on" for an explicit DependsOn
+Dependency = collections.namedtuple('Dependency', [
+    'resource',
+    'dependency',
+    'kind'
+])
+
+# When a resource starts and finishes building, at the earliest, in seconds
+#     (or in levels for an unweighted graph) from the start of the Stack
+Schedule = collections.namedtuple('Schedule', [
+    'start',
+    'finish'
+])
+
+# An explicit DependsOn and what it costs: whether other dependencies already
+#     imply it, how much shorter the critical path would be without it, and
+#     why the template needs it (None when no known reason applies)
+DependsOnFinding = collections.namedtuple('DependsOnFinding', [
+    'resource',
+    'dependency',
+    'redundant',
+    'savings',
+    'reason'
+])
+
+# Resource types whose DependsOn on another type is known to be needed, with
+#     a predicate on the dependent resource's Properties and the reason
+REQUIRED_DEPENDS_ON = {
+    ('AWS::EC2::Route', 'AWS::EC2::VPCGatewayAttachment'): (
+        lambda properties: 'GatewayId' in properties,
+        'a Route to an Internet Gateway fails until the gateway is attached'),
+    ('AWS::ElasticLoadBalancingV2::LoadBalancer', 'AWS::EC2::VPCGatewayAttachment'): (
+        lambda properties: properties.get('Scheme') == 'internet-facing',
+        'an internet-facing load balancer needs the Internet Gateway attached'),
+    ('AWS::AutoScaling::AutoScalingGroup', 'AWS::EC2::Route'): (
+        lambda properties: True,
+        'Instances need the Internet route to install the web server and signal'),
+    ('AWS::EC2::Instance', 'AWS::EC2::Route'): (
+        lambda properties: True,
+        'the Instance needs the Internet route to install the web server and signal'),
+    ('AWS::AutoScaling::ScalingPolicy', 'AWS::ElasticLoadBalancingV2::Listener'): (
+        lambda properties: 'ResourceLabel' in json.dumps(properties),
+        'a request count metric needs the Target Group attached to the load balancer')
+}
+
+# Variables in an Fn::Sub string: ${Name} or ${Name.Attribute}, but not ${!Literal}
+SUB_VARIABLE_PATTERN = re.compile(r'\$\{([^!}][^}]*)\}')
+
+
+def template_dependencies(template):
+    """ Return every Dependency between the resources of a parsed template
+
+    Refs to parameters and pseudo parameters (e.g., AWS::StackName) are not
+    dependencies, and neither are Fn::ImportValue exports of other Stacks.
+    """
+
+    resources = template.get('Resources', {})
+    dependencies = []
+    for name in sorted(resources):
+        resource = resources[name]
+        depends_on = resource.get('DependsOn', [])
+        if isinstance(depends_on, basestring):
+            depends_on = [depends_on]
+        references = set(_references(dict((key, value) for key, value in resource.items()
+                                          if key != 'DependsOn')))
+        for dependency in sorted(references):
+            if dependency in resources and dependency != name:
+                dependencies.append(Dependency(name, dependency, 'reference'))
+        for dependency in depends_on:
+            dependencies.append(Dependency(name, dependency, 'depends_on'))
+    return dependencies
+
+
+def schedule(resources, dependencies, durations=None):
+    """ Return the earliest Schedule of every resource, by name
+
+    Cloud Formation starts a resource as soon as everything it depends on is
+    built.  Without durations every resource takes one unit, so a resource's
+    start is its level: the longest chain of dependencies below it.
+    Raises ValueError for a dependency cycle or an unknown resource.
+    """
+
+    depends = _dependency_sets(resources, dependencies)
+    schedules = {}
+    visiting = set()
+
+    def visit(name):
+        if name in schedules:
+            return schedules[name].finish
+        if name in visiting:
+            raise ValueError('Resource "%s" is part of a dependency cycle' % name)
+        visiting.add(name)
+        start = max([visit(dependency) for dependency in depends[name]] or [0])
+        visiting.discard(name)
+        seconds = 1 if durations is None else durations[name]
+        schedules[name] = Schedule(start, start + seconds)
+        return schedules[name].finish
+
+    for name in sorted(resources):
+        visit(name)
+    return schedules
+
+
+def critical_path(resources, dependencies, durations=None):
+    """ Return (resource names, length) of the longest chain through the template """
+
+    schedules = schedule(resources, dependencies, durations)
+    if not schedules:
+        return [], 0
+    depends = _dependency_sets(resources, dependencies)
+    name = max(sorted(schedules), key=lambda name: schedules[name].finish)
+    length = schedules[name].finish
+    path = [name]
+    while depends[name]:
+        # Follow whichever dependency finished last, since it held up the start
+        name = max(sorted(depends[name]), key=lambda name: schedules[name].finish)
+        path.append(name)
+    path.reverse()
+    return path, length
+
+
+def level_widths(resources, dependencies):
+    """ Return how many resources can be built at each level, lowest level first """
+
+    schedules = schedule(resources, dependencies)
+    widths = [0] * (max([entry.start for entry in schedules.values()] or [-1]) + 1)
+    for entry in schedules.values():
+        widths[entry.start] += 1
+    return widths
+
+
+def depends_on_findings(resources, dependencies, durations=None):
+    """ Return a DependsOnFinding for every explicit DependsOn in the template
+
+    A DependsOn is redundant when another chain of dependencies already
+    orders the two resources, so it can be dropped without changing the
+    build.  Otherwise its savings are how much shorter the critical path
+    gets without it; a DependsOn with savings and no reason from
+    REQUIRED_DEPENDS_ON serializes the build without a known need.
+    """
+
+    length = critical_path(resources, dependencies, durations)[1]
+    findings = []
+    for edge in dependencies:
+        if edge.kind != 'depends_on':
+            continue
+        others = [other for other in dependencies if other != edge]
+        redundant = _reachable(resources, others, edge.resource, edge.dependency)
+        savings = 0
+        if not redundant:
+            savings = length - critical_path(resources, others, durations)[1]
+        findings.append(DependsOnFinding(resource=edge.resource,
+                                         dependency=edge.dependency,
+                                         redundant=redundant,
+                                         savings=savings,
+                                         reason=_required_reason(resources, edge)))
+    return findings
+
+
+def analyze_template(template, durations=None):
+    """ Return the dependency analysis of a template as a dict
+
+    With durations (seconds by resource name) the critical path is weighted
+    by them; otherwise it is measured in levels.
+    """
+
+    resources = template.get('Resources', {})
+    dependencies = template_dependencies(template)
+    schedules = schedule(resources, dependencies, durations)
+    path, length = critical_path(resources, dependencies, durations)
+    widths = level_widths(resources, dependencies)
+    levels = schedule(resources, dependencies)
+    return {
+        'resources': len(resources),
+        'dependencies': len(set((edge.resource, edge.dependency) for edge in dependencies)),
+        'weighted': durations is not None,
+        'critical_path': [{
+            'resource': name,
+            'type': resources[name]['Type'],
+            'start': schedules[name].start,
+            'finish': schedules[name].finish
+        } for name in path],
+        'length': length,
+        'levels': [{
+            'level': level,
+            'width': width,
+            'resources': sorted(name for name in resources if levels[name].start == level)
+        } for level, width in enumerate(widths)],
+        'depends_on': [finding._asdict() for finding in
+                       depends_on_findings(resources, dependencies, durations)]
+    }
+
+
+def format_analysis(analysis):
+    """ Return a human readable report of a template dependency analysis """
+
+    unit = 's' if analysis['weighted'] else 'levels'
+    lines = ['%d resources, %d dependencies; the critical path takes %s %s:' % (
+        analysis['resources'], analysis['dependencies'],
+        _format_number(analysis['length']), unit)]
+    for step in analysis['critical_path']:
+        lines.append('  %-32s %-42s %8s -> %s' % (step['resource'], step['type'],
+                                                  _format_number(step['start']),
+                                                  _format_number(step['finish'])))
+    widths = [level['width'] for level in analysis['levels']]
+    lines.append('Resources that can be built in parallel at each level (widest %d):' %
+                 max(widths or [0]))
+    for level in analysis['levels']:
+        lines.append('  %3d %3d  %s' % (level['level'], level['width'],
+                                        ', '.join(level['resources'])))
+    if analysis['depends_on']:
+        lines.append('Explicit DependsOn:')
+    for finding in analysis['depends_on']:
+        if finding['redundant']:
+            verdict = 'redundant: other dependencies already order them'
+        elif finding['reason']:
+            verdict = 'needed: %s' % finding['reason']
+        elif finding['savings'] > 0:
+            verdict = 'NOT KNOWN TO BE NEEDED: lengthens the critical path by %s %s' % (
+                _format_number(finding['savings']), unit)
+        else:
+            verdict = 'not known to be needed, but off the critical path'
+        lines.append('  %s -> %s: %s' % (finding['resource'], finding['dependency'], verdict))
+    return '\n'.join(lines)
+
+
+def timing_durations(records, resources, default=None):
+    """ Return (durations by name, names without a timing) for the resources
+
+    records are timings JSON lines (see provisioning_timer.write_jsonl); the
+    median seconds of completed creates of a resource with the same logical
+    ID and type are used, else those of any resource of the same type, else
+    default (or the median of every timing, when default is None).
+    """
+
+    by_name = collections.defaultdict(list)
+    by_type = collections.defaultdict(list)
+    for record in records:
+        if record.get('kind') != 'resource' or record.get('operation') != 'CREATE' or \
+                not str(record.get('status', '')).endswith('_COMPLETE'):
+            continue
+        by_name[(record['name'], record['resource_type'])].append(record['seconds'])
+        by_type[record['resource_type']].append(record['seconds'])
+    if default is None:
+        default = _median([seconds for timings in by_type.values() for seconds in timings])
+
+    durations = {}
+    missing = []
+    for name, resource in resources.items():
+        timings = by_name.get((name, resource['Type'])) or by_type.get(resource['Type'])
+        if timings:
+            durations[name] = _median(timings)
+        else:
+            durations[name] = default or 0
+            missing.append(name)
+    return durations, sorted(missing)
+
+
+def read_timings(path):
+    """ Return the records of a timings JSON lines file, skipping malformed lines """
+
+    records = []
+    with open(path) as timings_file:
+        for line in timings_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                records.append(record)
+    return records
+
+
+def _references(value):
+    """ Yield the names a template value refers to with Ref, Fn::GetAtt or Fn::Sub """
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == 'Ref' and isinstance(item, basestring):
+                yield item
+            elif key == 'Fn::GetAtt' and isinstance(item, list):
+                yield item[0]
+            elif key == 'Fn::GetAtt' and isinstance(item, basestring):
+                yield item.split('.')[0]
+            elif key == 'Fn::Sub':
+                text, variables = (item, {}) if isinstance(item, basestring) else item
+                for variable in SUB_VARIABLE_PATTERN.findall(text):
+                    if variable.split('.')[0] not in variables:
+                        yield variable.split('.')[0]
+                for reference in _references(variables):
+                    yield reference
+            else:
+                for reference in _references(item):
+                    yield reference
+    elif isinstance(value, list):
+        for item in value:
+            for reference in _references(item):
+                yield reference
+
+
+def _dependency_sets(resources, dependencies):
+    depends = dict((name, set()) for name in resources)
+    for edge in dependencies:
+        if edge.dependency not in resources:
+            raise ValueError('Resource "%s" depends on unknown resource "%s"' %
+                             (edge.resource, edge.dependency))
+        depends[edge.resource].add(edge.dependency)
+    return depends
+
+
+def _reachable(resources, dependencies, source, target):
+    """ Return whether target is among the (transitive) dependencies of source """
+
+    depends = _dependency_sets(resources, dependencies)
+    seen = set()
+    pending = [source]
+    while pending:
+        name = pending.pop()
+        for dependency in depends[name] - seen:
+            if dependency == target:
+                return True
+            seen.add(dependency)
+            pending.append(dependency)
+    return False
+
+
+def _required_reason(resources, edge):
+    required = REQUIRED_DEPENDS_ON.get((resources[edge.resource]['Type'],
+                                        resources[edge.dependency]['Type']))
+    if required is None:
+        return None
+    predicate, reason = required
+    return reason if predicate(resources[edge.resource].get('Properties', {})) else None
+
+
+def _format_number(value):
+    return '%d' % value if value == int(value) else '%.1f' % value
+
+
+def _median(values):
+    if not values:
+        return None
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
@@ -2,91 +2,437 @@
 # TODO: With more time, better infrastructure tests could be implemented with serverspec
 
 import argparse
+import collections
+import httplib
+import json
+import multiprocessing
+import socket
+import time
 import urllib2
-import boto3
 import botocore
+import aws_session
+from multiprocessing.pool import ThreadPool
+from load_tester import ConnectionPool, LoadTest, format_results
+from provision_awscloud_webserver_env import STACK_NAME, stack_state
+from stack_state import physical_id
 
+EXPECTED_TEXT = 'Automation for the People'
+WEBSERVER_NAME = 'jstrohl-miniproject-webserver'
+DEFAULT_CHECK_TIMEOUT = 30.0
 
-def test_environment(id, secret, address, region):
-    """ Validates the provisioned web server cloud environment """
-
-    # Validate infrastructure pieces
-    validate_securitygroup(id, secret, region)
-    validate_webserver(address)
-
-    # If we haven't exited yet, we passed all tests
-    print 'SUCCESS: All tests passed'
-
-def validate_securitygroup(id, secret, region):
-    """ Validates the Security Group exists with correct rules """
-
-    # Create boto3 client for AWS EC2
-    client = boto3.client('ec2',
-                          aws_access_key_id=id,
-                          aws_secret_access_key=secret,
-                          region_name=region)
-
-    # Describe the Security Group
-    sgs = client.describe_security_groups(Filters=[{
-                                                    'Name':'description',
-                                                    'Values':['Web Server SG']
-                                                   }])
-
-    # Verify we found the Security Group
-    if len(sgs['SecurityGroups']) == 0:
-        print 'FAILURE: Could not find expected Security Group'
-        exit(0)
-
-    # Verify we had the appropriate Security Group Rules
-    security_group = sgs['SecurityGroups'][0]
-    security_group_id = security_group['GroupId']
-    foundHttpRule = False
-    foundSshRule = False
-    for rule in security_group['IpPermissions']:
-        if rule['FromPort'] == 80 and rule['ToPort'] == 80:
-            foundHttpRule = True 
-        if rule['FromPort'] == 22 and rule['ToPort'] == 22:
-            foundSshRule = True
-    if not (foundHttpRule and foundSshRule):
-        print 'FAILURE: Could not find expected Security Group Rules'
-        exit(0)
-
-    # Describe the Web Server Instance
-    instances = client.describe_instances(Filters=[{
-                                                    'Name':'tag-value',
-                                                    'Values':['jstrohl-miniproject-webserver']
-                                                   },
-                                                   {
-                                                    'Name':'instance-state-name',
-                                                    'Values':['running']
-                                                   }])
+# Pages fetched from each Instance in fleet mode; only the first one has to
+#     open a connection
+DEFAULT_FLEET_SAMPLES = 3
+
+# Most Instances checked at the same time in fleet mode
+MAX_CONCURRENT_INSTANCES = 16
+
+# Instance states that are reported in fleet mode (anything terminating is
+#     on its way out of the Auto Scaling group)
+LIVE_INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+# Outcome of checking one Web Server Instance in fleet mode; response times
+#     are in milliseconds
+InstanceCheck = collections.namedtuple('InstanceCheck', [
+    'instance_id',
+    'zone',
+    'state',
+    'address',
+    'security_group_attached',
+    'first_ms',
+    'keep_alive_ms',
+    'failures'
+])
+
+
+def test_environment(id, secret, address, region, timeout=DEFAULT_CHECK_TIMEOUT, state=None,
+                     fleet=False, stack_name=STACK_NAME, samples=DEFAULT_FLEET_SAMPLES):
+    """ Validates the provisioned web server cloud environment
+
+    The independent checks run concurrently, each with its own timeout, and
+    every failure is collected so that one run reports all of the problems.
+    With the Stack's recorded state (see stack_state.py) its resources are
+    looked up by ID.  In fleet mode every Instance of the Stack is checked
+    (see validate_fleet) instead of only the first.  Returns the list of
+    failure messages.
+    """
+
+    if fleet:
+        checks = [
+            ('Fleet', validate_fleet, (id, secret, region, stack_name, state, samples, timeout)),
+            ('Web Server', validate_webserver, (address, timeout))
+        ]
+    else:
+        checks = [
+            ('Security Group', validate_securitygroup, (id, secret, region, state)),
+            ('Web Server', validate_webserver, (address, timeout))
+        ]
+    failures = run_checks(checks, timeout)
+
+    for failure in failures:
+        print 'FAILURE: %s' % failure
+    if not failures:
+        print 'SUCCESS: All tests passed'
+    return failures
+
+
+def run_checks(checks, timeout):
+    """ Runs (name, function, args) checks in a thread pool
+
+    Each check function returns a list of failure messages.  A check that
+    raises, or that has not finished once the timeout has passed, is reported
+    as a failure too.
+    """
+
+    pool = ThreadPool(len(checks))
+    try:
+        pending = [(name, pool.apply_async(function, args)) for name, function, args in checks]
+        deadline = time.time() + timeout
+        failures = []
+        for name, result in pending:
+            try:
+                failures.extend(result.get(max(deadline - time.time(), 0)))
+            except multiprocessing.TimeoutError:
+                failures.append('%s check did not finish within %s seconds' % (name, timeout))
+            except Exception, err:
+                failures.append('%s check raised %s: %s' % (name, err.__class__.__name__, err))
+        return failures
+    finally:
+        pool.terminate()
+
+
+def validate_securitygroup(id, secret, region, state=None):
+    """ Validates the Security Group exists with correct rules
+
+    The Security Group and Web Server Instance are looked up by the physical
+    IDs in the Stack's recorded state (a fleet's Instances by their Auto
+    Scaling group); without state they are searched for by description and
+    Name tag instead, the Security Group only among those attached to the
+    Instance.
+    """
+
+    # Get the shared boto3 client for AWS EC2
+    client = aws_session.get_client('ec2', region, id, secret)
+
+    # Look up the running Web Server Instance first: without a recorded
+    #     Security Group ID, only the Security Groups attached to it need to be
+    #     described, rather than searching the whole account
+    instances = find_webserver_instances(client, state)
+    attached_group_ids = None
+    if instances:
+        attached_group_ids = [sg['GroupId'] for sg in instances[0].get('SecurityGroups', [])]
+    sgs = find_security_groups(client, recorded_security_group_id(region, state),
+                               attached_group_ids)
+
+    failures = []
+
+    # Verify we found the Security Group with the appropriate Security Group Rules
+    security_group_id = None
+    if len(sgs) == 0:
+        failures.append('Could not find expected Security Group')
+    else:
+        security_group = sgs[0]
+        security_group_id = security_group['GroupId']
+        foundHttpRule = False
+        foundSshRule = False
+        for rule in security_group['IpPermissions']:
+            if rule.get('FromPort') == 80 and rule.get('ToPort') == 80:
+                foundHttpRule = True
+            if rule.get('FromPort') == 22 and rule.get('ToPort') == 22:
+                foundSshRule = True
+        if not (foundHttpRule and foundSshRule):
+            failures.append('Could not find expected Security Group Rules')
 
     # Verify we found the Web Server Instance in "running" state
-    if len(instances['Reservations']) == 0 or len(instances['Reservations'][0]['Instances']) == 0:
-        print 'FAILURE: Could not find expected Web Server EC2 Instance'
-        exit(0)
-
-    # Verify that the Security Group is applied to the Web Server Instance
-    instance = instances['Reservations'][0]['Instances'][0]
-    foundSgId = False
-    for sg in instance['SecurityGroups']:
-        if sg['GroupId'] == security_group_id:
-            foundSgId = True
-    if not foundSgId:
-        print 'FAILURE: Security Group was not associated with Web Server EC2 Instance'
-        exit(0)
-
-
-def validate_webserver(address):
+    if len(instances) == 0:
+        failures.append('Could not find expected Web Server EC2 Instance')
+    elif security_group_id is not None:
+        # Verify that the Security Group is applied to the Web Server Instance
+        instance = instances[0]
+        foundSgId = False
+        for sg in instance['SecurityGroups']:
+            if sg['GroupId'] == security_group_id:
+                foundSgId = True
+        if not foundSgId:
+            failures.append('Security Group was not associated with Web Server EC2 Instance')
+
+    return failures
+
+
+def recorded_security_group_id(region, state):
+    """ Return the recorded ID of the Web Server Security Group, or None
+
+    A Stack behind a CDN has its own Security Group even when it imports the
+    rest of its network; otherwise the Security Group belongs to the network
+    Stack when the Stack imports one.
+    """
+
+    security_group_id = physical_id(state, 'SecurityGroup')
+    if security_group_id is None and state is not None and state.get('network_stack'):
+        security_group_id = physical_id(stack_state.get(region, state['network_stack']),
+                                        'SecurityGroup')
+    return security_group_id
+
+
+def find_security_groups(client, security_group_id=None, group_ids=None):
+    """ Returns the Web Server Security Group(s), by ID when it is known
+
+    Otherwise they are searched for by description, only among group_ids
+    when those are given.
+    """
+
+    if security_group_id is None:
+        if group_ids == []:
+            return []
+        request = {'Filters': [{
+            'Name':'description',
+            'Values':['Web Server SG']
+        }]}
+        if group_ids:
+            request['GroupIds'] = group_ids
+        return client.describe_security_groups(**request)['SecurityGroups']
+    try:
+        return client.describe_security_groups(GroupIds=[security_group_id])['SecurityGroups']
+    except botocore.exceptions.ClientError, err:
+        if err.response['Error']['Code'] == 'InvalidGroup.NotFound':
+            return []
+        raise
+
+
+def find_webserver_instances(client, state=None):
+    """ Returns the running Web Server Instances
+
+    A single Instance is looked up by its ID and a fleet by its Auto Scaling
+    group, when the Stack's state records them.
+    """
+
+    running = {
+        'Name':'instance-state-name',
+        'Values':['running']
+    }
+    instance_id = physical_id(state, 'WebServerInstance')
+    group_name = physical_id(state, 'WebServerGroup')
+    if instance_id is not None:
+        try:
+            reservations = client.describe_instances(InstanceIds=[instance_id],
+                                                     Filters=[running])['Reservations']
+        except botocore.exceptions.ClientError, err:
+            if err.response['Error']['Code'] == 'InvalidInstanceID.NotFound':
+                return []
+            raise
+    elif group_name is not None:
+        reservations = client.describe_instances(Filters=[{
+                                                     'Name':'tag:aws:autoscaling:groupName',
+                                                     'Values':[group_name]
+                                                 }, running])['Reservations']
+    else:
+        reservations = client.describe_instances(Filters=[{
+                                                     'Name':'tag:Name',
+                                                     'Values':[WEBSERVER_NAME]
+                                                 }, running])['Reservations']
+    return [instance for reservation in reservations
+            for instance in reservation['Instances']]
+
+
+def validate_fleet(id, secret, region, stack_name=STACK_NAME, state=None,
+                   samples=DEFAULT_FLEET_SAMPLES, timeout=DEFAULT_CHECK_TIMEOUT):
+    """ Validates every Web Server Instance of the Stack
+
+    Each Instance must be running with the Web Server Security Group attached
+    (without recorded state, the one found among the Instances' own Security
+    Groups) and serve the expected page from its public IP address (unless
+    the Stack is behind a CDN, when only the load balancer can reach it).
+    The Instances are checked concurrently, fetching samples pages from each
+    over a shared pool of keep-alive connections, and a pass/fail table with
+    response times is displayed.
+    """
+
+    client = aws_session.get_client('ec2', region, id, secret)
+
+    instances = describe_stack_instances(client, stack_name, state)
+    if not instances:
+        return ['Could not find any Web Server EC2 Instances for Stack "%s"' % stack_name]
+
+    # Without a recorded ID, only the Security Groups attached to the Stack's
+    #     own Instances are searched, since other environments in the account
+    #     have Web Server Security Groups too
+    security_group_id = recorded_security_group_id(region, state)
+    if security_group_id is None:
+        attached_group_ids = sorted(set(sg['GroupId'] for instance in instances
+                                        for sg in instance.get('SecurityGroups', [])))
+        sgs = find_security_groups(client, None, attached_group_ids)
+        if sgs:
+            security_group_id = sgs[0]['GroupId']
+
+    # Behind a CDN the Instances only take HTTP from the load balancer, so
+    #     their pages cannot be fetched directly
+    if physical_id(state, 'WebServerLoadBalancerIngress') is not None:
+        samples = 0
+
+    pool = ConnectionPool(timeout=timeout)
+    workers = ThreadPool(min(len(instances), MAX_CONCURRENT_INSTANCES))
+    try:
+        checks = workers.map(
+            lambda instance: check_instance(pool, instance, security_group_id, samples),
+            instances)
+    finally:
+        workers.terminate()
+        pool.close()
+
+    print format_instance_checks(checks)
+    failures = []
+    if security_group_id is None:
+        failures.append('Could not find expected Security Group')
+    for check in checks:
+        for failure in check.failures:
+            failures.append('Instance %s %s' % (check.instance_id, failure))
+    return failures
+
+
+def describe_stack_instances(client, stack_name, state=None):
+    """ Returns every live Instance of the Stack, following describe_instances pages
+
+    A fleet's Instances are found by their Auto Scaling group and a single
+    Instance by its ID when the Stack's state records them; otherwise by the
+    Stack name tag that Cloud Formation adds.
+    """
+
+    live = {
+        'Name':'instance-state-name',
+        'Values':LIVE_INSTANCE_STATES
+    }
+    instance_id = physical_id(state, 'WebServerInstance')
+    group_name = physical_id(state, 'WebServerGroup')
+    if group_name is not None:
+        request = {'Filters': [{'Name':'tag:aws:autoscaling:groupName',
+                                'Values':[group_name]}, live],
+                   'MaxResults': 100}
+    elif instance_id is not None:
+        request = {'InstanceIds': [instance_id], 'Filters': [live]}
+    else:
+        request = {'Filters': [{'Name':'tag:aws:cloudformation:stack-name',
+                                'Values':[stack_name]}, live],
+                   'MaxResults': 100}
+
+    instances = []
+    try:
+        while True:
+            page = client.describe_instances(**request)
+            for reservation in page['Reservations']:
+                instances.extend(reservation['Instances'])
+            if not page.get('NextToken'):
+                return instances
+            request['NextToken'] = page['NextToken']
+    except botocore.exceptions.ClientError, err:
+        if err.response['Error']['Code'] == 'InvalidInstanceID.NotFound':
+            return []
+        raise
+
+
+def check_instance(pool, instance, security_group_id, samples=DEFAULT_FLEET_SAMPLES):
+    """ Checks one Web Server Instance and returns its InstanceCheck
+
+    With no samples, the Instance's page is not fetched.
+    """
+
+    failures = []
+    state = instance['State']['Name']
+    if state != 'running':
+        failures.append('is %s' % state)
+
+    attached = None
+    if security_group_id is not None:
+        group_ids = [sg['GroupId'] for sg in instance.get('SecurityGroups', [])]
+        attached = security_group_id in group_ids
+        if not attached:
+            failures.append('does not have Security Group %s attached' % security_group_id)
+
+    address = instance.get('PublicIpAddress')
+    times = []
+    if address is None:
+        failures.append('has no public IP address')
+    elif state == 'running':
+        for sample in range(samples):
+            try:
+                status, body, seconds, reused = pool.get('http://%s/' % address)
+            except (httplib.HTTPException, socket.error), err:
+                failures.append('could not load the Webpage at http://%s: %s' %
+                                (address, err or err.__class__.__name__))
+                break
+            if status != 200 or EXPECTED_TEXT not in body:
+                failures.append('Webpage at http://%s returned HTTP %d without the text '
+                                '"%s"' % (address, status, EXPECTED_TEXT))
+                break
+            times.append(seconds * 1000.0)
+
+    keep_alive = sorted(times[1:])
+    return InstanceCheck(instance_id=instance['InstanceId'],
+                         zone=instance.get('Placement', {}).get('AvailabilityZone'),
+                         state=state,
+                         address=address,
+                         security_group_attached=attached,
+                         first_ms=times[0] if times else None,
+                         keep_alive_ms=keep_alive[len(keep_alive) / 2] if keep_alive else None,
+                         failures=failures)
+
+
+def format_instance_checks(checks):
+    """ Returns the fleet checks as a per-Instance pass/fail table """
+
+    def milliseconds(value):
+        return '%.1f' % value if value is not None else '-'
+
+    header = ('Instance', 'Zone', 'State', 'Address', 'SG', 'First ms', 'Keep-alive ms',
+              'Result')
+    rows = []
+    for check in checks:
+        attached = {True: 'yes', False: 'NO', None: '?'}[check.security_group_attached]
+        rows.append((check.instance_id, check.zone or '-', check.state, check.address or '-',
+                     attached, milliseconds(check.first_ms), milliseconds(check.keep_alive_ms),
+                     'FAIL' if check.failures else 'PASS'))
+    widths = [max(len(row[column]) for row in [header] + rows)
+              for column in range(len(header) - 1)]
+
+    lines = []
+    for row in [header] + rows:
+        lines.append('  '.join(value.ljust(width) for value, width in zip(row, widths)) +
+                     '  ' + row[-1])
+    passed = len([check for check in checks if not check.failures])
+    lines.append('%d of %d Instances passed' % (passed, len(checks)))
+    return '\n'.join(lines)
+
+
+def validate_webserver(address, timeout=DEFAULT_CHECK_TIMEOUT):
     """ Validates the HTML content of the Web Server Page """
 
-    response = urllib2.urlopen('http://' + address)
-    html = response.read()
-    if 'Automation for the People' not in html:
-        print 'FAILURE: Webpage on Web Server Instance at http://%s did not contain '\
-              'the text "Automation for the People"' % address
-        exit(0)
-       
+    try:
+        response = urllib2.urlopen('http://' + address, timeout=timeout)
+        html = response.read()
+    except (urllib2.URLError, socket.error), err:
+        return ['Could not load the Webpage on Web Server Instance at http://%s: %s' % (address, err)]
+    if EXPECTED_TEXT not in html:
+        return ['Webpage on Web Server Instance at http://%s did not contain '\
+                'the text "Automation for the People"' % address]
+    return []
+
+
+def load_test_webserver(address, concurrency, rate, duration, json_output=None):
+    """ Drives concurrent HTTP load at the Web Server and reports the results """
+
+    load_test = LoadTest('http://' + address,
+                         concurrency=concurrency,
+                         rate=rate,
+                         duration=duration,
+                         expected_text=EXPECTED_TEXT)
+    results = load_test.run()
+    print format_results(results)
+
+    # Save the results for tracking trends across runs
+    if json_output:
+        with open(json_output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+    return results
+
 
 def parse_args_and_run(args=None):
     """ Parse command line arguments and provision the environment """
@@ -98,20 +444,25 @@ def parse_args_and_run(args=None):
     parser.add_argument(
         '-i',
         '--id',
-        required=True,
-        help='AWS Access Key ID'
+        help='AWS Access Key ID (not needed with --load_test)'
     )
     parser.add_argument(
         '-s',
         '--secret',
-        required=True,
-        help='AWS Secret Access Key'
+        help='AWS Secret Access Key (not needed with --load_test)'
     )
     parser.add_argument(
         '-a',
         '--address',
-        required=True,
-        help='Public IP address of the Web Server Instance to test'
+        help='Public IP address of the Web Server Instance to test (default is '\
+             'the URL recorded for the Stack when it was provisioned)'
+    )
+    parser.add_argument(
+        '-n',
+        '--stack_name',
+        default=STACK_NAME,
+        help='Name of the Cloud Formation Stack whose recorded state is used '\
+             '(default is "%s")' % STACK_NAME
     )
     parser.add_argument(
         '-r',
@@ -119,12 +470,81 @@ def parse_args_and_run(args=None):
         default='us-east-1',
         help='AWS Region ID'
     )
+    parser.add_argument(
+        '--fleet',
+        action='store_true',
+        help='Check every Instance of the Stack instead of only the first (implied '\
+             'when the recorded Stack is a fleet)'
+    )
+    parser.add_argument(
+        '--samples',
+        type=int,
+        default=DEFAULT_FLEET_SAMPLES,
+        help='Pages fetched from each Instance with --fleet (default value is %d)' %
+             DEFAULT_FLEET_SAMPLES
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=DEFAULT_CHECK_TIMEOUT,
+        help='Seconds to allow the environment checks to finish'
+    )
+    parser.add_argument(
+        '--load_test',
+        action='store_true',
+        help='Load test the Web Server instead of validating the environment'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=10,
+        help='Number of concurrent keep-alive connections for --load_test'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        help='Target requests per second across all connections for --load_test '\
+             '(default is as fast as possible)'
+    )
+    parser.add_argument(
+        '--duration',
+        type=float,
+        default=30.0,
+        help='Length of the --load_test in seconds'
+    )
+    parser.add_argument(
+        '--json_output',
+        help='File to write the --load_test results to as JSON'
+    )
 
     _args = parser.parse_args(args)
-    test_environment(_args.id,
-                     _args.secret,
-                     _args.address,
-                     _args.region)
+    state = stack_state.get(_args.region, _args.stack_name)
+    address = _args.address
+    if address is None and state is not None and state['outputs'].get('URL'):
+        address = state['outputs']['URL'].split('://', 1)[-1]
+    if address is None:
+        parser.error('-a/--address is required: no URL is recorded for Stack "%s" in "%s"' %
+                     (_args.stack_name, _args.region))
+    if _args.load_test:
+        load_test_webserver(address,
+                            _args.concurrency,
+                            _args.rate,
+                            _args.duration,
+                            _args.json_output)
+        return
+    if not (_args.id and _args.secret):
+        parser.error('arguments -i/--id and -s/--secret are required')
+    failures = test_environment(_args.id,
+                                _args.secret,
+                                address,
+                                _args.region,
+                                _args.timeout,
+                                state,
+                                _args.fleet or physical_id(state, 'WebServerGroup') is not None,
+                                _args.stack_name,
+                                _args.samples)
+    if failures:
+        exit(1)
 
 
 if __name__ == '__main__':
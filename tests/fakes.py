@@ -0,0 +1,13 @@
+class FakeClock(object):
+    """ A clock that only moves when sleep is called """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
@@ -0,0 +1,120 @@
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import botocore.session
+from botocore.stub import Stubber
+
+import ami_resolver
+import provision_awscloud_webserver_env as provision
+from ami_resolver import AmiResolver, AmiResolutionError, AMI_PARAMETER, AMI_NAME_PATTERN
+from tests.fakes import FakeClock
+
+IMAGE_FILTERS = {
+    'Owners': ['amazon'],
+    'IncludeDeprecated': True,
+    'Filters': [{'Name': 'name', 'Values': [AMI_NAME_PATTERN]},
+                {'Name': 'state', 'Values': ['available']}]
+}
+
+
+class AmiResolverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Building the EC2 client is slow, so the tests share them
+        session = botocore.session.get_session()
+        cls.clients = dict((service, session.create_client(
+            service, region_name='eu-west-2', aws_access_key_id='id',
+            aws_secret_access_key='secret')) for service in ['ssm', 'ec2'])
+
+    def setUp(self):
+        self.stubbers = {}
+        for service, client in self.clients.items():
+            self.stubbers[service] = Stubber(client)
+            self.stubbers[service].activate()
+        self.saved = ami_resolver.aws_session.get_client
+        ami_resolver.aws_session.get_client = lambda service, region, id, secret: \
+            self.clients[service]
+
+        self.directory = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.resolver = AmiResolver(os.path.join(self.directory, 'amis.json'), ttl=60,
+                                    clock=self.clock)
+
+    def tearDown(self):
+        for stubber in self.stubbers.values():
+            stubber.deactivate()
+        ami_resolver.aws_session.get_client = self.saved
+        shutil.rmtree(self.directory)
+
+    def add_parameter(self, image_id):
+        self.stubbers['ssm'].add_response('get_parameter', {'Parameter': {
+            'Name': AMI_PARAMETER, 'Type': 'String', 'Value': image_id}},
+            {'Name': AMI_PARAMETER})
+
+    def add_ssm_failure(self):
+        self.stubbers['ssm'].add_client_error('get_parameter', 'AccessDeniedException',
+                                              'not authorized to perform ssm:GetParameter')
+
+    def test_reads_the_ssm_parameter(self):
+        self.add_parameter('ami-0123')
+
+        self.assertEqual(self.resolver.resolve('id', 'secret', 'eu-west-2'), 'ami-0123')
+        self.stubbers['ssm'].assert_no_pending_responses()
+
+    def test_falls_back_to_the_newest_image(self):
+        self.add_ssm_failure()
+        self.stubbers['ec2'].add_response('describe_images', {'Images': [
+            {'ImageId': 'ami-old', 'Name': 'al2023-ami-2023.1.20230705.0-kernel-6.1-x86_64',
+             'CreationDate': '2023-07-05T00:00:00.000Z'},
+            {'ImageId': 'ami-new', 'Name': 'al2023-ami-2023.6.20241010.0-kernel-6.1-x86_64',
+             'CreationDate': '2024-10-10T00:00:00.000Z'},
+            {'ImageId': 'ami-mid', 'Name': 'al2023-ami-2023.4.20240401.1-kernel-6.1-x86_64',
+             'CreationDate': '2024-04-01T00:00:00.000Z'}
+        ]}, IMAGE_FILTERS)
+
+        self.assertEqual(self.resolver.resolve('id', 'secret', 'eu-west-2'), 'ami-new')
+        self.stubbers['ec2'].assert_no_pending_responses()
+
+    def test_reuses_the_cached_image_until_it_expires(self):
+        self.add_parameter('ami-0123')
+        self.assertEqual(self.resolver.resolve('id', 'secret', 'eu-west-2'), 'ami-0123')
+
+        # A new resolver reads the same cache file, without calling SSM
+        self.clock.now += 60
+        resolver = AmiResolver(self.resolver.cache.path, ttl=60, clock=self.clock)
+        self.assertEqual(resolver.resolve('id', 'secret', 'eu-west-2'), 'ami-0123')
+
+        self.clock.now += 1
+        self.add_parameter('ami-4567')
+        self.assertEqual(resolver.resolve('id', 'secret', 'eu-west-2'), 'ami-4567')
+        self.stubbers['ssm'].assert_no_pending_responses()
+
+    def test_raises_when_both_lookups_fail(self):
+        self.add_ssm_failure()
+        self.stubbers['ec2'].add_client_error('describe_images', 'UnauthorizedOperation')
+
+        self.assertRaises(AmiResolutionError, self.resolver.resolve, 'id', 'secret',
+                          'eu-west-2')
+        self.assertIsNone(self.resolver.cache.get('eu-west-2'))
+
+    def test_provisioning_leaves_the_ami_to_cloud_formation_when_both_lookups_fail(self):
+        self.add_ssm_failure()
+        self.stubbers['ec2'].add_response('describe_images', {'Images': []}, IMAGE_FILTERS)
+        saved = provision.ami_resolver, sys.stdout
+        provision.ami_resolver = self.resolver
+        sys.stdout = StringIO.StringIO()
+        try:
+            image_id = provision.resolve_image_id('id', 'secret', 'eu-west-2')
+        finally:
+            provision.ami_resolver, sys.stdout = saved
+
+        self.assertEqual(image_id, '{{resolve:ssm:%s}}' % AMI_PARAMETER)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+
+import botocore.exceptions
+
+from aws_calls import CallPolicy, TokenBucket, MIN_RATE, is_retry_safe
+from tests.fakes import FakeClock
+
+
+def client_error(code, status=400):
+    return botocore.exceptions.ClientError(
+        {'Error': {'Code': code, 'Message': code},
+         'ResponseMetadata': {'HTTPStatusCode': status}}, 'Operation')
+
+
+def failing(name, errors, response='done'):
+    """ Return an API function named after an operation that raises errors, then responds """
+
+    errors = list(errors)
+    calls = []
+
+    def function(**kwargs):
+        calls.append(kwargs)
+        if errors:
+            raise errors.pop(0)
+        return response
+    function.__name__ = name
+    function.calls = calls
+    return function
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_allows_a_burst_then_spaces_requests(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2.0, burst=2, clock=clock, sleep=clock.sleep)
+
+        self.assertEqual([bucket.acquire() for _ in range(4)], [0.0, 0.0, 0.5, 0.5])
+        self.assertEqual(clock.sleeps, [0.5, 0.5])
+
+    def test_refills_over_time_up_to_the_burst(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2.0, burst=2, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        bucket.acquire()
+        clock.now += 10
+
+        self.assertEqual([bucket.acquire() for _ in range(3)], [0.0, 0.0, 0.5])
+
+    def test_throttling_halves_the_rate_and_success_wins_it_back(self):
+        bucket = TokenBucket(4.0, clock=FakeClock(), sleep=None)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 2.0)
+        for _ in range(10):
+            bucket.throttled()
+        self.assertEqual(bucket.rate, MIN_RATE)
+
+        bucket.succeeded()
+        self.assertEqual(bucket.rate, MIN_RATE + 0.2)
+        for _ in range(100):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 4.0)
+
+
+class CallPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        # Large rates so only the backoff sleeps
+        self.policy = CallPolicy(rates={'cloudformation': 1000.0}, max_attempts=4,
+                                 base_delay=0.5, max_delay=1.5, clock=self.clock,
+                                 sleep=self.clock.sleep, random=lambda: 1.0)
+
+    def call(self, function, **kwargs):
+        return self.policy.call('cloudformation', 'us-east-1', function, **kwargs)
+
+    def test_backoff_doubles_up_to_the_max_delay(self):
+        self.assertEqual([self.policy.backoff(retries) for retries in range(4)],
+                         [0.5, 1.0, 1.5, 1.5])
+
+    def test_backoff_is_jittered(self):
+        self.policy.random = lambda: 0.25
+        self.assertEqual(self.policy.backoff(1), 0.25)
+
+    def test_retries_throttling_and_counts_it(self):
+        function = failing('describe_stacks', [client_error('Throttling')] * 2)
+
+        self.assertEqual(self.call(function, StackName='webserver'), 'done')
+        self.assertEqual(len(function.calls), 3)
+        self.assertEqual(self.clock.sleeps, [0.5, 1.0])
+        totals = self.policy.stats()['total']
+        self.assertEqual((totals['attempts'], totals['retries'], totals['throttled'],
+                          totals['errors']), (3, 2, 2, 0))
+        self.assertEqual(totals['backoff_seconds'], 1.5)
+
+    def test_gives_up_after_max_attempts(self):
+        function = failing('describe_stacks', [client_error('InternalError', 500)] * 4)
+
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.call(function)
+        self.assertEqual(len(function.calls), 4)
+        self.assertEqual(self.policy.stats()['total']['errors'], 1)
+
+    def test_raises_other_errors_at_once(self):
+        function = failing('describe_stacks', [client_error('ValidationError')])
+
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.call(function)
+        self.assertEqual(len(function.calls), 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_does_not_retry_transient_errors_of_mutating_calls_without_a_token(self):
+        for error in [client_error('ServiceUnavailable', 503),
+                      botocore.exceptions.ConnectionError(error='reset')]:
+            function = failing('create_stack', [error])
+            self.assertRaises(type(error), self.call, function, StackName='webserver')
+            self.assertEqual(len(function.calls), 1)
+
+    def test_retries_transient_errors_of_mutating_calls_with_a_token(self):
+        function = failing('create_stack', [client_error('ServiceUnavailable', 503)])
+
+        self.assertEqual(self.call(function, StackName='webserver',
+                                   ClientRequestToken='create-1'), 'done')
+        self.assertEqual(len(function.calls), 2)
+
+    def test_retries_throttling_of_mutating_calls_without_a_token(self):
+        function = failing('create_key_pair', [client_error('RequestLimitExceeded')])
+
+        self.assertEqual(self.call(function, KeyName='webserver'), 'done')
+        self.assertEqual(len(function.calls), 2)
+
+    def test_is_retry_safe(self):
+        self.assertTrue(is_retry_safe('describe_stacks', {}))
+        self.assertFalse(is_retry_safe('delete_stack', {'StackName': 'webserver'}))
+        self.assertTrue(is_retry_safe('create_change_set', {'ClientToken': 'change-set-1'}))
+        self.assertFalse(is_retry_safe('create_key_pair', {'ClientRequestToken': 'key-1'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from batch_provisioner import parse_manifest, ManifestError
+
+
+def manifest(*environments, **settings):
+    """ Return a manifest whose environments share a key pair """
+
+    return dict({'defaults': {'key_pair': 'webserver'},
+                 'environments': list(environments)}, **settings)
+
+
+class ParseManifestTest(unittest.TestCase):
+
+    def assertManifestError(self, manifest, message):
+        with self.assertRaises(ManifestError) as context:
+            parse_manifest(manifest)
+        self.assertIn(message, str(context.exception))
+
+    def test_returns_specs_and_settings(self):
+        specs, settings = parse_manifest(manifest({'stack_name': 'web1'},
+                                                  {'stack_name': 'web2', 'region': 'eu-west-1',
+                                                   'fleet': {'max_size': 6}},
+                                                  max_concurrency=2))
+
+        self.assertEqual([(spec.stack_name, spec.region) for spec in specs],
+                         [('web1', 'us-east-1'), ('web2', 'eu-west-1')])
+        self.assertIsNone(specs[0].fleet)
+        self.assertEqual(specs[1].fleet.max_size, 6)
+        self.assertEqual(settings, {'max_concurrency': 2})
+
+    def test_rejects_a_malformed_manifest(self):
+        self.assertManifestError([], 'must be an object')
+        self.assertManifestError(manifest({'stack_name': 'web1'}, stacks=[]),
+                                 'Unknown manifest keys: stacks')
+        self.assertManifestError({'defaults': ['webserver'], 'environments': [{'stack_name': 'web1'}]},
+                                 '"defaults" must be an object')
+        self.assertManifestError(manifest(), '"environments" must be a non-empty list')
+        self.assertManifestError(manifest('web1'), 'Environment 1 must be an object')
+
+    def test_rejects_bad_settings(self):
+        for value in [0, -1, True, '2']:
+            self.assertManifestError(manifest({'stack_name': 'web1'}, max_concurrency=value),
+                                     '"max_concurrency" must be a positive integer')
+
+    def test_rejects_invalid_environments(self):
+        self.assertManifestError(manifest({'stack_name': 'web1', 'size': 2}),
+                                 'web1: unknown keys: size')
+        self.assertManifestError(manifest({'stack_name': '1web'}), '"stack_name" must start')
+        self.assertManifestError(manifest({}), 'Environment 1: "stack_name" must start')
+        self.assertManifestError(manifest({'stack_name': 'web1', 'region': 'Ohio'}),
+                                 'web1: "Ohio" is not a valid AWS Region ID')
+        self.assertManifestError({'environments': [{'stack_name': 'web1'}]},
+                                 'web1: a "key_pair" is required')
+        self.assertManifestError(manifest({'stack_name': 'web1', 'web_profile': 'fastest'}),
+                                 '"web_profile" must be one of')
+        self.assertManifestError(manifest({'stack_name': 'web1', 'fleet': {'max_size': 0}}),
+                                 'web1: invalid "fleet"')
+        self.assertManifestError(manifest({'stack_name': 'web1', 'fleet': 'yes'}),
+                                 '"fleet" must be true, false or an object')
+        self.assertManifestError(manifest({'stack_name': 'web1', 'cdn': 'yes'}),
+                                 '"cdn" must be true, false or an object')
+        self.assertManifestError(manifest({'stack_name': 'web1', 'type_instance': 'x9.huge'}),
+                                 'web1: invalid "type_instance" or "instance"')
+
+    def test_rejects_duplicate_stack_names(self):
+        self.assertManifestError(manifest({'stack_name': 'web1'}, {'stack_name': 'web1'}),
+                                 'Stack name "web1" is used by more than one environment')
+
+    def test_rejects_a_network_stack_that_is_an_environment(self):
+        self.assertManifestError(manifest({'stack_name': 'web1', 'network_stack': 'web2'},
+                                          {'stack_name': 'web2'}),
+                                 'web1: "network_stack" "web2" is also an environment\'s')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import datetime
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import botocore.session
+from botocore.stub import ANY, Stubber
+
+import destroy_awscloud_webserver_env as destroy
+from stack_state import StackState
+
+STACK_ID = 'arn:aws:cloudformation:us-east-1:123456789012:stack/webserver/1'
+
+
+def stack_event(event_id, logical_id, status, resource_type='AWS::S3::Bucket', reason=None):
+    """ Return a describe_stack_events event for the test Stack """
+
+    event = {
+        'StackId': STACK_ID,
+        'StackName': 'webserver',
+        'EventId': event_id,
+        'LogicalResourceId': logical_id,
+        'PhysicalResourceId': STACK_ID if logical_id == 'webserver' else logical_id.lower(),
+        'ResourceType': resource_type,
+        'ResourceStatus': status,
+        'Timestamp': datetime.datetime(2020, 1, 1, 0, 0, int(event_id[1:]))
+    }
+    if reason:
+        event['ResourceStatusReason'] = reason
+    return event
+
+
+def stack_status_event(event_id, status):
+    return stack_event(event_id, 'webserver', status, destroy.STACK_RESOURCE_TYPE)
+
+
+class DestroyStackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = botocore.session.get_session().create_client(
+            'cloudformation', region_name='us-east-1', aws_access_key_id='id',
+            aws_secret_access_key='secret')
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+        self.target = destroy.StackTarget('webserver', 'us-east-1')
+
+        self.directory = tempfile.mkdtemp()
+        self.state = StackState(os.path.join(self.directory, 'state.json'))
+        self.state.put('us-east-1', 'webserver', {'stack_id': STACK_ID})
+        self.saved = (destroy.aws_session.get_client, destroy.provision.stack_state, sys.stdout)
+        destroy.aws_session.get_client = lambda service, region, id, secret: self.client
+        destroy.provision.stack_state = self.state
+        sys.stdout = StringIO.StringIO()
+
+        self.stubber.add_response('describe_stacks', {'Stacks': [{
+            'StackId': STACK_ID,
+            'StackName': 'webserver',
+            'CreationTime': datetime.datetime(2020, 1, 1),
+            'StackStatus': 'CREATE_COMPLETE'
+        }]}, {'StackName': 'webserver'})
+        self.history = [stack_status_event('e1', 'CREATE_COMPLETE')]
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        destroy.aws_session.get_client, destroy.provision.stack_state, sys.stdout = self.saved
+        shutil.rmtree(self.directory)
+
+    def add_deletion(self, events, retain_resources=None):
+        """ Stub a delete_stack call and the events that follow it, newest first """
+
+        self.stubber.add_response('describe_stack_events', {'StackEvents': self.history},
+                                  {'StackName': STACK_ID})
+        expected = {'StackName': STACK_ID, 'ClientRequestToken': ANY}
+        if retain_resources:
+            expected['RetainResources'] = retain_resources
+        self.stubber.add_response('delete_stack', {}, expected)
+        self.history = events + self.history
+        self.stubber.add_response('describe_stack_events', {'StackEvents': self.history},
+                                  {'StackName': STACK_ID})
+
+    def failed_deletion(self):
+        return [stack_status_event('e5', 'DELETE_FAILED'),
+                stack_event('e4', 'Bucket', 'DELETE_FAILED', reason='The bucket is not empty'),
+                stack_event('e3', 'Subnet', 'DELETE_COMPLETE', 'AWS::EC2::Subnet'),
+                stack_status_event('e2', 'DELETE_IN_PROGRESS')]
+
+    def test_reports_the_resources_that_failed_to_delete(self):
+        self.add_deletion(self.failed_deletion())
+
+        result = destroy.destroy_stack('id', 'secret', self.target, timings_file=None)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(result.status, 'DELETE_FAILED')
+        self.assertFalse(result.succeeded)
+        self.assertEqual(result.failed_resources, [destroy.FailedResource(
+            'Bucket', 'AWS::S3::Bucket', 'The bucket is not empty')])
+        self.assertEqual(result.retained, [])
+        self.assertEqual(result.error, 'Stack deletion ended in DELETE_FAILED')
+        self.assertIsNotNone(self.state.get('us-east-1', 'webserver'))
+        self.assertIn('[us-east-1 webserver] Cloud Formation Stack Event : DELETE_FAILED',
+                      sys.stdout.getvalue())
+        self.assertIn('Bucket (The bucket is not empty)\n', sys.stdout.getvalue())
+
+    def test_retries_retaining_the_resources_that_failed(self):
+        self.add_deletion(self.failed_deletion())
+        self.add_deletion([stack_status_event('e7', 'DELETE_COMPLETE'),
+                           stack_event('e6', 'Bucket', 'DELETE_SKIPPED')],
+                          retain_resources=['Bucket'])
+
+        result = destroy.destroy_stack('id', 'secret', self.target, retain_failed=True,
+                                       timings_file=None)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(result.status, 'DELETE_COMPLETE')
+        self.assertTrue(result.succeeded)
+        self.assertEqual([resource.logical_id for resource in result.failed_resources],
+                         ['Bucket'])
+        self.assertEqual(result.retained, ['Bucket'])
+        self.assertIsNone(self.state.get('us-east-1', 'webserver'))
+
+    def test_does_not_retry_when_only_the_stack_failed(self):
+        self.add_deletion([stack_status_event('e3', 'DELETE_FAILED'),
+                           stack_status_event('e2', 'DELETE_IN_PROGRESS')])
+
+        result = destroy.destroy_stack('id', 'secret', self.target, retain_failed=True,
+                                       timings_file=None)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual((result.status, result.failed_resources, result.retained),
+                         ('DELETE_FAILED', [], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from instance_types import (instance_capabilities, validate_gp3_volume, validate_placement,
+                            InstanceCapabilities, UnsupportedInstanceType)
+from webserver_profiles import instance_vcpus, mpm_settings
+
+
+class InstanceVcpusTest(unittest.TestCase):
+
+    def test_reads_vcpus_from_the_capability_table(self):
+        self.assertEqual([instance_vcpus(type_instance) for type_instance in
+                          ['t2.micro', 't3.micro', 'm5.large', 'c4.8xlarge', 'm6i.32xlarge']],
+                         [1, 2, 2, 36, 128])
+        self.assertEqual(instance_capabilities('c5.9xlarge').vcpus, 36)
+
+    def test_rejects_unsupported_types(self):
+        self.assertRaises(UnsupportedInstanceType, instance_vcpus, 'm3.large')
+        self.assertRaises(UnsupportedInstanceType, instance_vcpus, 't2.huge')
+
+    def test_sizes_the_event_mpm_to_the_vcpus(self):
+        settings = dict(mpm_settings('t3.micro'))
+        self.assertEqual((settings['StartServers'], settings['ServerLimit'],
+                          settings['MaxRequestWorkers']), (4, 16, 400))
+        self.assertEqual(dict(mpm_settings('m5.24xlarge'))['MaxRequestWorkers'], 4000)
+
+
+class InstanceCapabilitiesTest(unittest.TestCase):
+
+    def test_reads_the_family_capabilities(self):
+        self.assertEqual(instance_capabilities('t2.micro'),
+                         InstanceCapabilities('t2.micro', 1, True, False, None))
+        self.assertEqual(instance_capabilities('m4.large'),
+                         InstanceCapabilities('m4.large', 2, False, True, 'vf'))
+        self.assertEqual(instance_capabilities('r6i.32xlarge'),
+                         InstanceCapabilities('r6i.32xlarge', 128, False, True, 'ena'))
+
+    def test_rejects_unknown_families_and_sizes(self):
+        for type_instance in ['m3.large', 'm5.32xlarge', 'a1.large', 't3']:
+            self.assertRaises(UnsupportedInstanceType, instance_capabilities, type_instance)
+        self.assertTrue(issubclass(UnsupportedInstanceType, ValueError))
+
+
+class Gp3VolumeTest(unittest.TestCase):
+
+    def test_accepts_the_limits(self):
+        validate_gp3_volume(8, 3000, 125)
+        validate_gp3_volume(10, 5000, 1000)
+        validate_gp3_volume(8, 3000, 750)
+        validate_gp3_volume(32, 16000, 1000)
+        validate_gp3_volume(16384, 16000, 1000)
+
+    def test_rejects_sizes_outside_gp3(self):
+        self.assertRaises(ValueError, validate_gp3_volume, 0, 3000, 125)
+        self.assertRaises(ValueError, validate_gp3_volume, 16385, 3000, 125)
+
+    def test_limits_iops_per_gib(self):
+        self.assertRaises(ValueError, validate_gp3_volume, 10, 5001, 125)
+        self.assertRaises(ValueError, validate_gp3_volume, 8, 2999, 125)
+
+    def test_limits_iops_to_the_gp3_maximum(self):
+        self.assertRaises(ValueError, validate_gp3_volume, 100, 16001, 125)
+
+    def test_limits_throughput_per_iops(self):
+        self.assertRaises(ValueError, validate_gp3_volume, 8, 3000, 751)
+        self.assertRaises(ValueError, validate_gp3_volume, 100, 16000, 1001)
+        self.assertRaises(ValueError, validate_gp3_volume, 8, 3000, 124)
+
+
+class PlacementTest(unittest.TestCase):
+
+    def test_cluster_needs_a_non_burstable_type_with_enhanced_networking(self):
+        validate_placement(instance_capabilities('m5.large'), 'cluster')
+        self.assertRaises(ValueError, validate_placement, instance_capabilities('t3.micro'),
+                          'cluster')
+        self.assertRaises(ValueError, validate_placement, instance_capabilities('t2.micro'),
+                          'cluster')
+
+    def test_cluster_stays_in_one_zone(self):
+        self.assertRaises(ValueError, validate_placement, instance_capabilities('m5.large'),
+                          'cluster', zone_count=2)
+
+    def test_spread_holds_seven_instances_per_zone(self):
+        capabilities = instance_capabilities('t3.micro')
+        validate_placement(capabilities, 'spread', zone_count=1, max_instances=7)
+        validate_placement(capabilities, 'spread', zone_count=2, max_instances=14)
+        self.assertRaises(ValueError, validate_placement, capabilities, 'spread',
+                          zone_count=1, max_instances=8)
+        self.assertRaises(ValueError, validate_placement, capabilities, 'spread',
+                          zone_count=2, max_instances=15)
+
+    def test_rejects_unknown_strategies(self):
+        validate_placement(instance_capabilities('t3.micro'), 'partition', 3, 100)
+        self.assertRaises(ValueError, validate_placement, instance_capabilities('m5.large'),
+                          'host')
+
+
+if __name__ == '__main__':
+    unittest.main()
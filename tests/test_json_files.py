@@ -0,0 +1,41 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from json_files import atomic_write_json
+
+
+class AtomicWriteJsonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_creates_the_directory_and_replaces_the_file(self):
+        path = os.path.join(self.directory, 'cache', 'state.json')
+
+        atomic_write_json(path, {'stacks': {'a': 1}})
+        atomic_write_json(path, {'stacks': {'b': 2}}, indent=2, sort_keys=True)
+
+        with open(path) as json_file:
+            self.assertEqual(json.load(json_file), {'stacks': {'b': 2}})
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['state.json'])
+
+    def test_keeps_the_old_file_when_the_data_cannot_be_written(self):
+        path = os.path.join(self.directory, 'state.json')
+        atomic_write_json(path, {'stacks': {}})
+
+        self.assertRaises(TypeError, atomic_write_json, path, {'stacks': object()})
+
+        # No half written file, and no temporary file left behind
+        with open(path) as json_file:
+            self.assertEqual(json.load(json_file), {'stacks': {}})
+        self.assertEqual(os.listdir(self.directory), ['state.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
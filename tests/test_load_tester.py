@@ -0,0 +1,133 @@
+import BaseHTTPServer
+import socket
+import SocketServer
+import threading
+import unittest
+
+from load_tester import ConnectionPool, LoadTest
+
+PAGE = '<html><h1>Automation for the People</h1></html>'
+
+
+class PageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves the page over keep-alive connections, counting the connections """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        status = 404 if self.path == '/missing' else 200
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(PAGE)))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PageServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def unreachable_url():
+    """ Return the URL of a local port that nothing listens on """
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return 'http://127.0.0.1:%d/' % port
+
+
+class LocalServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PageServer(('127.0.0.1', 0), PageHandler)
+        self.server.lock = threading.Lock()
+        self.server.connections = 0
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class LoadTestTest(LocalServerTest):
+
+    def test_unlimited_rate_reuses_one_connection_per_worker(self):
+        results = LoadTest(self.url + '/', concurrency=3, duration=0.3,
+                           expected_text='Automation').run()
+
+        self.assertGreater(results['requests'], 3)
+        self.assertEqual(results['errors'], 0)
+        self.assertEqual(results['statuses'], {'200': results['requests']})
+        self.assertIsNone(results['target_rate'])
+        self.assertEqual(self.server.connections, 3)
+
+    def test_rate_limit_follows_the_send_schedule(self):
+        results = LoadTest(self.url, concurrency=2, rate=20, duration=0.5).run()
+
+        # Send times 0, 0.05, ... 0.45 seconds after the start
+        self.assertEqual(results['requests'], 10)
+        self.assertEqual(results['errors'], 0)
+        self.assertGreaterEqual(results['duration_seconds'], 0.45)
+
+    def test_counts_error_statuses_and_unexpected_pages(self):
+        missing = LoadTest(self.url + '/missing', concurrency=1, rate=20, duration=0.2).run()
+        unexpected = LoadTest(self.url, concurrency=1, rate=20, duration=0.2,
+                              expected_text='Something else').run()
+
+        self.assertEqual((missing['requests'], missing['errors'], missing['statuses']),
+                         (4, 4, {'404': 4}))
+        self.assertEqual((unexpected['errors'], unexpected['error_rate']), (4, 1.0))
+
+    def test_counts_connection_failures(self):
+        results = LoadTest(unreachable_url(), concurrency=1, rate=20, duration=0.1,
+                           timeout=1.0).run()
+
+        self.assertEqual(results['errors'], results['requests'])
+        self.assertNotIn('200', results['statuses'])
+
+    def test_rejects_other_schemes(self):
+        self.assertRaises(ValueError, LoadTest, 'https://example.com/')
+
+
+class ConnectionPoolTest(LocalServerTest):
+
+    def setUp(self):
+        LocalServerTest.setUp(self)
+        self.pool = ConnectionPool(timeout=5.0)
+
+    def tearDown(self):
+        self.pool.close()
+        LocalServerTest.tearDown(self)
+
+    def test_reuses_kept_alive_connections(self):
+        results = [self.pool.get(self.url + '/') for index in range(3)]
+
+        self.assertEqual([(status, body, reused) for status, body, seconds, reused in results],
+                         [(200, PAGE, False), (200, PAGE, True), (200, PAGE, True)])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_does_not_reuse_a_connection_the_server_closed(self):
+        self.assertEqual(self.pool.get(self.url + '/close')[3], False)
+        self.assertEqual(self.pool.get(self.url + '/')[3], False)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_raises_when_the_server_is_unreachable(self):
+        self.assertRaises(socket.error, self.pool.get, unreachable_url())
+
+
+if __name__ == '__main__':
+    unittest.main()
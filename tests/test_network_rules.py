@@ -0,0 +1,133 @@
+import unittest
+
+from network_rules import (network_rule, merge_rules, compile_nacl_entries,
+                           network_acl_entries, close_security_group_port,
+                           restrict_to_prefix_list, compile_security_group_rules,
+                           RuleLimitError, NACL_ENTRY_LIMIT, SECURITY_GROUP_RULE_LIMIT)
+
+
+class MergeRulesTest(unittest.TestCase):
+
+    def test_merges_overlapping_and_adjacent_ranges(self):
+        merged = merge_rules([network_rule('Low', 1000, 2000),
+                              network_rule('Middle', 1500, 3000),
+                              network_rule('High', 3001, 4000),
+                              network_rule('Apart', 5000)])
+
+        self.assertEqual([(rule.name, rule.from_port, rule.to_port) for rule in merged],
+                         [('LowAndMiddleAndHigh', 1000, 4000), ('Apart', 5000, 5000)])
+
+    def test_keeps_protocols_and_sources_apart(self):
+        merged = merge_rules([network_rule('Web', 80),
+                              network_rule('Dns', 80, protocol='udp'),
+                              network_rule('Office', 81, cidr='10.0.0.0/8'),
+                              network_rule('Cdn', 81, nacl=False, prefix_list='pl-1')])
+
+        self.assertEqual([rule.name for rule in merged], ['Web', 'Dns', 'Office', 'Cdn'])
+
+    def test_keeps_the_order_of_the_first_member(self):
+        merged = merge_rules([network_rule('Ssh', 22),
+                              network_rule('Http', 80),
+                              network_rule('SshAlternate', 23, security_group=True)])
+
+        self.assertEqual([rule.name for rule in merged], ['SshAndSshAlternate', 'Http'])
+        self.assertTrue(merged[0].nacl)
+        self.assertTrue(merged[0].security_group)
+
+    def test_names_large_merges_after_the_first_and_last(self):
+        merged = merge_rules([network_rule('Port%d' % port, port) for port in range(1, 6)])
+
+        self.assertEqual([rule.name for rule in merged], ['Port1ThroughPort5'])
+
+
+class NetworkAclEntriesTest(unittest.TestCase):
+
+    def test_numbers_entries_in_rule_order_for_each_direction(self):
+        entries = compile_nacl_entries([network_rule('HTTP', 80),
+                                        network_rule('HTTPS', 443),
+                                        network_rule('Cdn', 80, nacl=False,
+                                                     security_group=True, prefix_list='pl-1'),
+                                        network_rule('SSH', 22)])
+
+        self.assertEqual([(entry.logical_id, entry.rule_number, entry.egress)
+                          for entry in entries],
+                         [('InboundHTTPNetworkAclEntry', 100, False),
+                          ('InboundHTTPSNetworkAclEntry', 200, False),
+                          ('InboundSSHNetworkAclEntry', 300, False),
+                          ('OutboundHTTPNetworkAclEntry', 100, True),
+                          ('OutboundHTTPSNetworkAclEntry', 200, True),
+                          ('OutboundSSHNetworkAclEntry', 300, True)])
+
+    def test_adding_a_rule_does_not_renumber_earlier_entries(self):
+        rules = [network_rule('HTTP', 80), network_rule('SSH', 22)]
+        before = compile_nacl_entries(rules)
+        after = compile_nacl_entries(rules + [network_rule('HTTPS', 443)])
+
+        self.assertEqual(before, [entry for entry in after if entry.logical_id in
+                                  [earlier.logical_id for earlier in before]])
+
+    def test_rejects_more_entries_than_the_limit(self):
+        rules = [network_rule('Port%d' % port, port * 10)
+                 for port in range(1, NACL_ENTRY_LIMIT + 2)]
+
+        self.assertRaises(RuleLimitError, compile_nacl_entries, rules)
+
+    def test_builds_network_acl_entry_resources(self):
+        entries = network_acl_entries('NetworkAcl', [network_rule('HTTP', 80),
+                                                     network_rule('ResponsePorts', 1024, 65535)])
+
+        self.assertEqual([entry.title for entry in entries],
+                         ['InboundHTTPNetworkAclEntry', 'InboundResponsePortsNetworkAclEntry',
+                          'OutboundHTTPNetworkAclEntry', 'OutboundResponsePortsNetworkAclEntry'])
+        properties = entries[1].to_dict()['Properties']
+        self.assertEqual(properties['RuleNumber'], '200')
+        self.assertEqual(properties['Protocol'], 6)
+        self.assertEqual(properties['PortRange'], {'From': '1024', 'To': '65535'})
+        self.assertEqual(properties['Egress'], 'false')
+        self.assertEqual(properties['NetworkAclId'], {'Ref': 'NetworkAcl'})
+
+
+class RestrictRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = [network_rule('HTTP', 80, security_group=True),
+                      network_rule('Alternate', 80, nacl=False, security_group=True),
+                      network_rule('SSH', 22, security_group=True),
+                      network_rule('ResponsePorts', 1024, 65535)]
+
+    def test_restricts_the_port_to_a_prefix_list_but_keeps_its_nacl_entries(self):
+        restricted = restrict_to_prefix_list(self.rules, 'pl-1', 80)
+
+        self.assertEqual([(rule.name, rule.cidr, rule.prefix_list, rule.nacl,
+                           rule.security_group) for rule in restricted],
+                         [('HTTP', '0.0.0.0/0', None, True, False),
+                          ('HTTP', None, 'pl-1', False, True),
+                          ('Alternate', None, 'pl-1', False, True),
+                          ('SSH', '0.0.0.0/0', None, True, True),
+                          ('ResponsePorts', '0.0.0.0/0', None, True, False)])
+
+    def test_closes_the_port_in_the_security_group_but_keeps_its_nacl_entries(self):
+        closed = close_security_group_port(self.rules, 80)
+
+        self.assertEqual([(rule.name, rule.nacl, rule.security_group) for rule in closed],
+                         [('HTTP', True, False), ('SSH', True, True),
+                          ('ResponsePorts', True, False)])
+
+    def test_counts_a_prefix_list_rule_as_its_weight(self):
+        restricted = restrict_to_prefix_list(self.rules, 'pl-1', 80, weight=55)
+        self.assertEqual([rule.weight for rule in compile_security_group_rules(restricted)],
+                         [55, 1])
+
+        ssh_rules = [network_rule('SSH%d' % port, port, nacl=False, security_group=True,
+                                  cidr='10.0.%d.0/24' % port)
+                     for port in range(SECURITY_GROUP_RULE_LIMIT - 55 - 1)]
+        compile_security_group_rules(restricted + ssh_rules)
+        self.assertRaises(RuleLimitError, compile_security_group_rules, restricted + ssh_rules +
+                          [network_rule('Extra', 8080, nacl=False, security_group=True)])
+
+    def test_only_prefix_list_rules_have_a_weight(self):
+        self.assertRaises(ValueError, network_rule, 'HTTP', 80, security_group=True, weight=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import json
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import botocore.session
+from botocore.stub import Stubber
+
+import provision_awscloud_webserver_env as provision
+from stack_state import StackState
+from tests.fakes import FakeClock
+
+NETWORK_STACK_ID = 'arn:aws:cloudformation:us-east-1:123456789012:stack/shared/1'
+
+
+class UpdateStackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = botocore.session.get_session().create_client(
+            'cloudformation', region_name='us-east-1', aws_access_key_id='id',
+            aws_secret_access_key='secret')
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        self.template = {'Resources': {'VPC': {'Type': 'AWS::EC2::VPC',
+                                               'Properties': {'CidrBlock': '10.0.0.0/16'}}}}
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        sys.stdout = self.stdout
+
+    def test_does_nothing_when_the_templates_match(self):
+        # Differently formatted, but the same Template
+        self.stubber.add_response('get_template',
+                                  {'TemplateBody': json.dumps(self.template, indent=2)},
+                                  {'StackName': 'webserver', 'TemplateStage': 'Original'})
+        self.stubber.add_response('describe_stacks', {'Stacks': [{
+            'StackName': 'webserver',
+            'CreationTime': '2020-01-01T00:00:00Z',
+            'StackStatus': 'CREATE_COMPLETE',
+            'Outputs': [{'OutputKey': 'URL', 'OutputValue': 'http://example.com'}]
+        }]}, {'StackName': 'webserver'})
+
+        result = provision.update_stack(self.client, 'webserver', 'us-east-1',
+                                        json.dumps(self.template), stack_name='webserver')
+
+        # No Change Set is created, and no readiness gate is waited on
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(result, provision.StackResult('UP_TO_DATE', True,
+                                                       {'URL': 'http://example.com'}, None))
+
+    def test_templates_match(self):
+        body = json.dumps(self.template)
+        self.assertTrue(provision.templates_match(self.template, body))
+        self.assertTrue(provision.templates_match(json.dumps(self.template, indent=4), body))
+        self.assertFalse(provision.templates_match('Resources: {}', body))
+        self.template['Resources']['VPC']['Properties']['CidrBlock'] = '10.1.0.0/16'
+        self.assertFalse(provision.templates_match(self.template, body))
+
+
+class EnsureNetworkStackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = botocore.session.get_session().create_client(
+            'cloudformation', region_name='us-east-1', aws_access_key_id='id',
+            aws_secret_access_key='secret')
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+        self.directory = tempfile.mkdtemp()
+        state = StackState(os.path.join(self.directory, 'state.json'))
+        state.put('us-east-1', 'shared', {'stack_id': NETWORK_STACK_ID})
+        self.saved = provision.aws_session.get_client, provision.stack_state, sys.stdout
+        provision.aws_session.get_client = lambda service, region, id, secret: self.client
+        provision.stack_state = state
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        provision.aws_session.get_client, provision.stack_state, sys.stdout = self.saved
+        shutil.rmtree(self.directory)
+
+    def add_network_stack(self, subnets):
+        stack = {
+            'StackId': NETWORK_STACK_ID,
+            'StackName': 'shared',
+            'CreationTime': '2020-01-01T00:00:00Z',
+            'StackStatus': 'CREATE_COMPLETE',
+            'Outputs': [{'OutputKey': 'VPC', 'OutputValue': 'vpc-1'}] +
+                       [{'OutputKey': 'Subnet%d' % (index + 1),
+                         'OutputValue': 'subnet-%d' % index} for index in range(subnets)]
+        }
+        self.stubber.add_response('describe_stacks', {'Stacks': [stack]},
+                                  {'StackName': 'shared'})
+        self.stubber.add_response('describe_stacks', {'Stacks': [stack]},
+                                  {'StackName': NETWORK_STACK_ID})
+
+    def test_reuses_an_existing_network_stack(self):
+        self.add_network_stack(2)
+
+        result = provision.ensure_network_stack('id', 'secret', 'us-east-1', 'shared',
+                                                required_zones=2)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual((result.status, result.succeeded, result.outputs['Subnet2']),
+                         ('REUSED', True, 'subnet-1'))
+
+    def test_rejects_a_network_stack_with_too_few_subnets(self):
+        self.add_network_stack(1)
+
+        self.assertRaises(provision.ProvisioningError, provision.ensure_network_stack,
+                          'id', 'secret', 'us-east-1', 'shared', required_zones=2)
+
+
+class ProvisionEnvironmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.saved = dict((name, getattr(provision, name)) for name in (
+            'ProvisioningTimer', 'validate_key_pair', 'ensure_network_stack',
+            'render_template', 'create_stack', 'save_stack_state'))
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        timer_class = provision.ProvisioningTimer
+        provision.ProvisioningTimer = lambda: timer_class(clock=self.clock)
+        provision.validate_key_pair = lambda id, secret, key_pair, region: None
+        provision.ensure_network_stack = self.build_network_stack
+        provision.render_template = lambda *args: (None, '{}')
+        provision.create_stack = self.build_web_stack
+        provision.save_stack_state = lambda *args: None
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(provision, name, value)
+        sys.stdout = self.stdout
+
+    def build_network_stack(self, id, secret, region, network_stack, zone_count,
+                            required_zones, update, timer):
+        with timer.phase('stack_build'):
+            self.clock.sleep(30)
+        return provision.StackResult('CREATE_COMPLETE', True, {}, None)
+
+    def build_web_stack(self, id, secret, key_pair, region, template_body, ready_timeout,
+                        timer, stack_name):
+        with timer.phase('stack_build'):
+            self.clock.sleep(10)
+        return provision.StackResult('CREATE_COMPLETE', True, {}, None)
+
+    def test_network_stack_time_is_counted_once(self):
+        provision.provision_environment('id', 'secret', 'key', 'us-east-1', 't3.micro',
+                                        timings_file=None, image_id='ami-1',
+                                        network_stack='shared')
+
+        totals = [line.split()[1] for line in sys.stdout.getvalue().splitlines()
+                  if line.strip().startswith('total')]
+        # The network Stack's own summary, then the whole run's
+        self.assertEqual(totals, ['30.00', '40.00'])
+
+
+if __name__ == '__main__':
+    unittest.main()
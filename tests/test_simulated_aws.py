@@ -0,0 +1,90 @@
+import json
+import unittest
+
+import botocore.exceptions
+import botocore.session
+
+from simulated_aws import SimulatedClock, SimulatedCloud
+from stack_poller import StackPoller, wait_for_change_set
+
+TEMPLATE = {'Resources': {
+    'VPC': {'Type': 'AWS::EC2::VPC', 'Properties': {'CidrBlock': '10.0.0.0/16'}},
+    'Subnet': {'Type': 'AWS::EC2::Subnet', 'Properties': {'VpcId': {'Ref': 'VPC'}}}
+}}
+
+
+class SimulatedCloudTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.cloud = SimulatedCloud(self.clock)
+        self.client = botocore.session.get_session().create_client(
+            'cloudformation', region_name='us-east-1', aws_access_key_id='id',
+            aws_secret_access_key='secret')
+        self.cloud.attach(self.client)
+
+    def tearDown(self):
+        self.cloud.detach()
+
+    def poller(self, stack_id):
+        poller = StackPoller(self.client, stack_id, clock=self.clock.time,
+                             sleep=self.clock.sleep)
+        poller.mark()
+        return poller
+
+    def create(self):
+        stack_id = self.client.create_stack(StackName='web',
+                                            TemplateBody=json.dumps(TEMPLATE))['StackId']
+        StackPoller(self.client, stack_id, clock=self.clock.time,
+                    sleep=self.clock.sleep).wait()
+        return stack_id
+
+    def change_set(self, template):
+        change_set = self.client.create_change_set(StackName='web',
+                                                   TemplateBody=json.dumps(template),
+                                                   ChangeSetName='update',
+                                                   ChangeSetType='UPDATE')
+        return change_set['Id'], wait_for_change_set(self.client, change_set['Id'],
+                                                     clock=self.clock.time,
+                                                     sleep=self.clock.sleep)
+
+    def test_updates_a_stack_through_a_change_set(self):
+        stack_id = self.create()
+        template = json.loads(json.dumps(TEMPLATE))
+        template['Resources']['Subnet']['Properties']['CidrBlock'] = '10.0.0.0/24'
+        template['Resources']['Gateway'] = {'Type': 'AWS::EC2::InternetGateway'}
+        del template['Resources']['VPC']
+        template['Resources']['Subnet']['Properties']['VpcId'] = 'vpc-1'
+
+        change_set_id, details = self.change_set(template)
+        self.assertEqual(details['Status'], 'CREATE_COMPLETE')
+        self.assertEqual([(change['ResourceChange']['Action'],
+                           change['ResourceChange']['LogicalResourceId'])
+                          for change in details['Changes']],
+                         [('Add', 'Gateway'), ('Modify', 'Subnet'), ('Remove', 'VPC')])
+
+        poller = self.poller(stack_id)
+        self.client.execute_change_set(ChangeSetName=change_set_id)
+        self.assertEqual(poller.wait(), 'UPDATE_COMPLETE')
+        deployed = self.client.get_template(StackName='web')['TemplateBody']
+        # botocore parses a JSON TemplateBody
+        self.assertEqual(deployed, template)
+        stack = self.client.describe_stacks(StackName='web')['Stacks'][0]
+        self.assertEqual(stack['StackStatus'], 'UPDATE_COMPLETE')
+
+    def test_a_change_set_without_changes_fails(self):
+        self.create()
+
+        change_set_id, details = self.change_set(TEMPLATE)
+        self.assertEqual(details['Status'], 'FAILED')
+        self.assertIn("didn't contain changes", details['StatusReason'])
+        self.client.delete_change_set(ChangeSetName=change_set_id)
+
+    def test_calls_that_are_not_simulated_fail_like_aws_errors(self):
+        with self.assertRaises(botocore.exceptions.ClientError) as context:
+            self.client.list_stacks()
+        self.assertEqual(context.exception.response['Error']['Code'], 'InvalidAction')
+
+
+if __name__ == '__main__':
+    unittest.main()
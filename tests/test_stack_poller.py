@@ -0,0 +1,133 @@
+import datetime
+import unittest
+
+import botocore.session
+from botocore.stub import Stubber
+
+from stack_poller import StackPoller, StackPollTimeout
+from tests.fakes import FakeClock
+
+STACK_ID = 'arn:aws:cloudformation:us-east-1:123456789012:stack/webserver/1'
+
+
+def stack_event(event_id, logical_id, status, resource_type='AWS::EC2::VPC',
+                physical_id=None):
+    """ Return a describe_stack_events event for the test Stack """
+
+    return {
+        'StackId': STACK_ID,
+        'StackName': 'webserver',
+        'EventId': event_id,
+        'LogicalResourceId': logical_id,
+        'PhysicalResourceId': physical_id or logical_id,
+        'ResourceType': resource_type,
+        'ResourceStatus': status,
+        'Timestamp': datetime.datetime(2020, 1, 1)
+    }
+
+
+def stack_status_event(event_id, status):
+    return stack_event(event_id, 'webserver', status, 'AWS::CloudFormation::Stack', STACK_ID)
+
+
+class StackPollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = botocore.session.get_session().create_client(
+            'cloudformation', region_name='us-east-1', aws_access_key_id='id',
+            aws_secret_access_key='secret')
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+        self.clock = FakeClock()
+        self.events = []
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def poller(self, **kwargs):
+        return StackPoller(self.client, STACK_ID, on_event=self.events.append,
+                           clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def add_events(self, events, next_token=None, expected_token=None):
+        response = {'StackEvents': events}
+        if next_token:
+            response['NextToken'] = next_token
+        expected = {'StackName': STACK_ID}
+        if expected_token:
+            expected['NextToken'] = expected_token
+        self.stubber.add_response('describe_stack_events', response, expected)
+
+    def test_pages_only_until_a_seen_event_and_reports_each_event_once(self):
+        started = stack_status_event('e1', 'CREATE_IN_PROGRESS')
+        vpc_started = stack_event('e2', 'VPC', 'CREATE_IN_PROGRESS')
+        vpc_created = stack_event('e3', 'VPC', 'CREATE_COMPLETE')
+        created = stack_status_event('e4', 'CREATE_COMPLETE')
+        # First pass: two pages of new events, newest first
+        self.add_events([vpc_created, vpc_started], next_token='page2')
+        self.add_events([started], expected_token='page2')
+        # Second pass: nothing new, so a single call
+        self.add_events([vpc_created, vpc_started], next_token='page2')
+        # Third pass: one new event ahead of the seen ones
+        self.add_events([created, vpc_created], next_token='page2')
+
+        poller = self.poller()
+        self.assertEqual(poller.wait(), 'CREATE_COMPLETE')
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual([event['EventId'] for event in self.events], ['e1', 'e2', 'e3', 'e4'])
+        self.assertEqual(poller.api_calls, 4)
+        # Back off while nothing happens
+        self.assertEqual(self.clock.sleeps, [2.0, 3.0])
+
+    def test_mark_ignores_earlier_events(self):
+        old = stack_status_event('old', 'UPDATE_COMPLETE')
+        deleting = stack_status_event('e1', 'DELETE_IN_PROGRESS')
+        deleted = stack_status_event('e2', 'DELETE_COMPLETE')
+        self.add_events([old])
+        self.add_events([deleting, old])
+        self.add_events([deleted, deleting, old])
+
+        poller = self.poller()
+        poller.mark()
+        self.assertEqual(poller.wait(), 'DELETE_COMPLETE')
+        self.assertEqual([event['EventId'] for event in self.events], ['e1', 'e2'])
+
+    def test_nested_stack_events_do_not_set_the_status(self):
+        nested = stack_event('e1', 'Nested', 'CREATE_COMPLETE', 'AWS::CloudFormation::Stack',
+                             STACK_ID.replace('webserver', 'nested'))
+        created = stack_status_event('e2', 'CREATE_COMPLETE')
+        self.add_events([nested])
+        self.add_events([created, nested])
+
+        poller = self.poller()
+        self.assertEqual(poller.wait(), 'CREATE_COMPLETE')
+        self.assertEqual(self.clock.sleeps, [2.0])
+
+    def test_throttling_waits_the_longest_interval(self):
+        self.stubber.add_client_error('describe_stack_events', service_error_code='Throttling',
+                                      http_status_code=400)
+        self.add_events([stack_status_event('e1', 'CREATE_COMPLETE')])
+
+        self.assertEqual(self.poller().wait(), 'CREATE_COMPLETE')
+        self.assertEqual(self.clock.sleeps, [15.0])
+
+    def test_other_errors_are_raised(self):
+        self.stubber.add_client_error('describe_stack_events',
+                                      service_error_code='ValidationError',
+                                      service_message='Stack does not exist')
+
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.poller().wait()
+
+    def test_times_out_before_sleeping_past_the_timeout(self):
+        in_progress = stack_status_event('e1', 'CREATE_IN_PROGRESS')
+        self.add_events([in_progress])
+        self.add_events([in_progress])
+        self.add_events([in_progress])
+
+        with self.assertRaises(StackPollTimeout):
+            self.poller(timeout=6).wait()
+        self.assertEqual(self.clock.sleeps, [2.0, 3.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
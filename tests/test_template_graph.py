@@ -0,0 +1,149 @@
+import unittest
+
+from template_graph import (Dependency, DependsOnFinding, analyze_template, critical_path,
+                            depends_on_findings, schedule, template_dependencies,
+                            timing_durations)
+
+
+def resource(resource_type, properties=None, depends_on=None):
+    value = {'Type': resource_type, 'Properties': properties or {}}
+    if depends_on is not None:
+        value['DependsOn'] = depends_on
+    return value
+
+
+# A VPC with a Subnet and a gateway, a Route that explicitly waits for the
+#     gateway to be attached, and an Instance that waits for the Route; the
+#     Bucket's DependsOn on the VPC has no known reason, and the Instance's
+#     DependsOn on the Subnet is implied by its Ref
+TEMPLATE = {
+    'Parameters': {'KeyName': {'Type': 'String'}},
+    'Resources': {
+        'VPC': resource('AWS::EC2::VPC'),
+        'Gateway': resource('AWS::EC2::InternetGateway'),
+        'Attach': resource('AWS::EC2::VPCGatewayAttachment', {
+            'VpcId': {'Ref': 'VPC'}, 'InternetGatewayId': {'Ref': 'Gateway'}}),
+        'Table': resource('AWS::EC2::RouteTable', {'VpcId': {'Ref': 'VPC'}}),
+        'Route': resource('AWS::EC2::Route', {
+            'GatewayId': {'Ref': 'Gateway'}, 'RouteTableId': {'Ref': 'Table'}}, 'Attach'),
+        'Subnet': resource('AWS::EC2::Subnet', {
+            'VpcId': {'Fn::GetAtt': ['VPC', 'VpcId']},
+            'Tags': [{'Key': 'Stack', 'Value': {'Ref': 'AWS::StackName'}}]}),
+        'Instance': resource('AWS::EC2::Instance', {
+            'KeyName': {'Ref': 'KeyName'},
+            'SubnetId': {'Ref': 'Subnet'},
+            'UserData': {'Fn::Sub': 'echo ${Table} ${Subnet.AvailabilityZone} ${!Literal} '
+                                    '${AWS::Region}'}}, ['Route', 'Subnet']),
+        'Bucket': resource('AWS::S3::Bucket', {}, 'VPC')
+    }
+}
+
+
+class TemplateDependenciesTest(unittest.TestCase):
+
+    def test_finds_refs_getatts_sub_variables_and_depends_on(self):
+        dependencies = template_dependencies(TEMPLATE)
+
+        self.assertEqual(sorted(dependencies), sorted([
+            Dependency('Attach', 'Gateway', 'reference'),
+            Dependency('Attach', 'VPC', 'reference'),
+            Dependency('Bucket', 'VPC', 'depends_on'),
+            Dependency('Instance', 'Subnet', 'reference'),
+            Dependency('Instance', 'Table', 'reference'),
+            Dependency('Instance', 'Route', 'depends_on'),
+            Dependency('Instance', 'Subnet', 'depends_on'),
+            Dependency('Route', 'Gateway', 'reference'),
+            Dependency('Route', 'Table', 'reference'),
+            Dependency('Route', 'Attach', 'depends_on'),
+            Dependency('Subnet', 'VPC', 'reference'),
+            Dependency('Table', 'VPC', 'reference')]))
+
+    def test_sub_variables_from_its_own_map_are_not_dependencies(self):
+        template = {'Resources': {
+            'VPC': resource('AWS::EC2::VPC'),
+            'Instance': resource('AWS::EC2::Instance', {'UserData': {'Fn::Sub': [
+                'echo ${Name} ${VPC}', {'Name': {'Fn::GetAtt': 'Table.Name'}}]}}),
+            'Table': resource('AWS::EC2::RouteTable')}}
+
+        self.assertEqual(sorted(template_dependencies(template)),
+                         [Dependency('Instance', 'Table', 'reference'),
+                          Dependency('Instance', 'VPC', 'reference')])
+
+
+class CriticalPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resources = TEMPLATE['Resources']
+        self.dependencies = template_dependencies(TEMPLATE)
+
+    def test_follows_the_longest_chain_of_levels(self):
+        self.assertEqual(critical_path(self.resources, self.dependencies),
+                         (['Gateway', 'Attach', 'Route', 'Instance'], 4))
+        self.assertEqual(schedule(self.resources, self.dependencies)['Bucket'].start, 1)
+
+    def test_weights_the_chain_with_durations(self):
+        durations = dict((name, 1) for name in self.resources)
+        durations['Subnet'] = 10
+
+        self.assertEqual(critical_path(self.resources, self.dependencies, durations),
+                         (['VPC', 'Subnet', 'Instance'], 12))
+
+    def test_rejects_cycles_and_unknown_resources(self):
+        self.assertRaises(ValueError, schedule, {'A': {}, 'B': {}},
+                          [Dependency('A', 'B', 'reference'),
+                           Dependency('B', 'A', 'depends_on')])
+        self.assertRaises(ValueError, schedule, {'A': {}},
+                          [Dependency('A', 'Missing', 'depends_on')])
+
+
+class DependsOnFindingsTest(unittest.TestCase):
+
+    def test_reports_redundant_required_and_unexplained_depends_on(self):
+        findings = depends_on_findings(TEMPLATE['Resources'], template_dependencies(TEMPLATE))
+
+        self.assertEqual(sorted(findings), sorted([
+            DependsOnFinding('Bucket', 'VPC', False, 0, None),
+            DependsOnFinding('Instance', 'Route', False, 1,
+                             'the Instance needs the Internet route to install the web '
+                             'server and signal'),
+            DependsOnFinding('Instance', 'Subnet', True, 0, None),
+            DependsOnFinding('Route', 'Attach', False, 0,
+                             'a Route to an Internet Gateway fails until the gateway is '
+                             'attached')]))
+
+    def test_reports_what_an_unexplained_depends_on_costs(self):
+        template = {'Resources': {
+            'VPC': resource('AWS::EC2::VPC'),
+            'Table': resource('AWS::EC2::RouteTable', {'VpcId': {'Ref': 'VPC'}}),
+            'Bucket': resource('AWS::S3::Bucket', {}, 'Table')}}
+
+        analysis = analyze_template(template)
+
+        self.assertEqual([step['resource'] for step in analysis['critical_path']],
+                         ['VPC', 'Table', 'Bucket'])
+        self.assertEqual(analysis['depends_on'], [{
+            'resource': 'Bucket', 'dependency': 'Table', 'redundant': False, 'savings': 1,
+            'reason': None}])
+        self.assertEqual([level['width'] for level in analysis['levels']], [1, 1, 1])
+
+
+class TimingDurationsTest(unittest.TestCase):
+
+    def test_uses_the_median_of_the_resource_then_its_type(self):
+        records = [
+            {'kind': 'resource', 'operation': 'CREATE', 'status': 'CREATE_COMPLETE',
+             'name': 'VPC', 'resource_type': 'AWS::EC2::VPC', 'seconds': seconds}
+            for seconds in [10, 20, 60]] + [
+            {'kind': 'resource', 'operation': 'CREATE', 'status': 'CREATE_FAILED',
+             'name': 'Subnet', 'resource_type': 'AWS::EC2::Subnet', 'seconds': 99},
+            {'kind': 'phase', 'name': 'create_stack', 'seconds': 500}]
+        resources = {'VPC': resource('AWS::EC2::VPC'), 'Other': resource('AWS::EC2::VPC'),
+                     'Subnet': resource('AWS::EC2::Subnet')}
+
+        self.assertEqual(timing_durations(records, resources),
+                         ({'VPC': 20, 'Other': 20, 'Subnet': 20}, ['Subnet']))
+        self.assertEqual(timing_durations(records, resources, default=5)[0]['Subnet'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import json
+import unittest
+
+import provision_awscloud_webserver_env as provision
+
+
+def render(type_instance='t3.micro', **options):
+    """ Return the parsed Template for the options of create_template """
+
+    return json.loads(provision.create_template('key', 'us-east-1', type_instance,
+                                                **options).to_json())
+
+
+class ReadinessTest(unittest.TestCase):
+
+    def test_instance_waits_for_the_internet_route_and_signals(self):
+        instance = render(ready_timeout=600)['Resources']['WebServerInstance']
+
+        self.assertEqual(instance['DependsOn'], 'Route')
+        self.assertEqual(instance['CreationPolicy'],
+                         {'ResourceSignal': {'Count': 1, 'Timeout': 'PT600S'}})
+
+    def test_instance_in_a_network_stack_has_no_route_to_wait_for(self):
+        instance = render(network_stack='shared')['Resources']['WebServerInstance']
+
+        self.assertNotIn('DependsOn', instance)
+
+
+class FleetTest(unittest.TestCase):
+
+    def setUp(self):
+        fleet = provision.fleet_config(min_size=2, max_size=6, desired_capacity=3,
+                                       zone_count=3, scaling_metric='requests')
+        self.resources = render(fleet=fleet, ready_timeout=600)['Resources']
+
+    def test_launch_template_holds_the_web_server_setup(self):
+        data = self.resources['WebServerLaunchTemplate']['Properties']['LaunchTemplateData']
+
+        self.assertEqual(data['InstanceType'], 't3.micro')
+        self.assertEqual(data['KeyName'], 'key')
+        self.assertEqual(data['ImageId'], provision.fallback_image_id)
+        self.assertEqual(data['NetworkInterfaces'][0]['Groups'], [{'Ref': 'SecurityGroup'}])
+        self.assertIn('UserData', data)
+        self.assertNotIn('WebServerInstance', self.resources)
+
+    def test_auto_scaling_group_spans_a_subnet_per_zone_after_the_route(self):
+        group = self.resources['WebServerGroup']
+        properties = group['Properties']
+
+        self.assertEqual((properties['MinSize'], properties['MaxSize'],
+                          properties['DesiredCapacity']), ('2', '6', '3'))
+        self.assertEqual(properties['VPCZoneIdentifier'],
+                         [{'Ref': 'Subnet'}, {'Ref': 'Subnet2'}, {'Ref': 'Subnet3'}])
+        self.assertEqual([self.resources[name]['Properties']['AvailabilityZone']
+                          ['Fn::Select'][0] for name in ['Subnet', 'Subnet2', 'Subnet3']],
+                         [0, 1, 2])
+        self.assertEqual(properties['TargetGroupARNs'], [{'Ref': 'TargetGroup'}])
+        self.assertEqual(group['DependsOn'], 'Route')
+        self.assertEqual(group['CreationPolicy']['ResourceSignal']['Count'], 3)
+
+    def test_target_group_health_checks_the_page(self):
+        properties = self.resources['TargetGroup']['Properties']
+
+        self.assertEqual((properties['HealthCheckPath'], properties['Matcher']),
+                         ('/', {'HttpCode': '200'}))
+        self.assertEqual((properties['HealthyThresholdCount'],
+                          properties['UnhealthyThresholdCount']), ('2', '3'))
+
+    def test_listener_forwards_http_to_the_target_group(self):
+        properties = self.resources['Listener']['Properties']
+
+        self.assertEqual((properties['Port'], properties['Protocol']), ('80', 'HTTP'))
+        self.assertEqual(properties['LoadBalancerArn'], {'Ref': 'LoadBalancer'})
+        self.assertEqual(properties['DefaultActions'],
+                         [{'Type': 'forward', 'TargetGroupArn': {'Ref': 'TargetGroup'}}])
+        self.assertEqual(self.resources['LoadBalancer']['DependsOn'], 'AttachGateway')
+
+    def test_request_count_policy_names_the_load_balancer_and_target_group(self):
+        policy = self.resources['WebServerScalingPolicy']
+        configuration = policy['Properties']['TargetTrackingConfiguration']
+        metric = configuration['PredefinedMetricSpecification']
+
+        self.assertEqual(policy['DependsOn'], 'Listener')
+        self.assertEqual(configuration['TargetValue'], 1000.0)
+        self.assertEqual(metric['PredefinedMetricType'], 'ALBRequestCountPerTarget')
+        self.assertEqual(metric['ResourceLabel'], {'Fn::Join': ['/', [
+            {'Fn::GetAtt': ['LoadBalancer', 'LoadBalancerFullName']},
+            {'Fn::GetAtt': ['TargetGroup', 'TargetGroupFullName']}]]})
+
+    def test_cpu_policy_has_no_resource_label(self):
+        resources = render(fleet=provision.fleet_config())['Resources']
+        metric = resources['WebServerScalingPolicy']['Properties'][
+            'TargetTrackingConfiguration']['PredefinedMetricSpecification']
+
+        self.assertEqual(metric, {'PredefinedMetricType': 'ASGAverageCPUUtilization'})
+
+
+class CdnTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cdn = provision.cdn_config(origin_prefix_list='pl-3b927c52')
+
+    def http_ingress(self, security_group):
+        return [rule for rule in security_group['Properties']['SecurityGroupIngress']
+                if int(rule['FromPort']) <= 80 <= int(rule['ToPort'])]
+
+    def test_single_instance_only_takes_http_from_cloudfront(self):
+        template = render(cdn=self.cdn)
+        resources = template['Resources']
+
+        self.assertEqual(self.http_ingress(resources['SecurityGroup']), [{
+            'IpProtocol': 'tcp', 'FromPort': '80', 'ToPort': '80',
+            'SourcePrefixListId': 'pl-3b927c52'}])
+        self.assertNotIn('0.0.0.0/0', [rule.get('CidrIp') for rule in
+                                       self.http_ingress(resources['SecurityGroup'])])
+        self.assertEqual(resources['CdnDistribution']['Properties']['DistributionConfig']
+                         ['Origins'][0]['DomainName'],
+                         {'Fn::GetAtt': ['WebServerInstance', 'PublicDnsName']})
+        self.assertEqual(sorted(template['Outputs']), ['OriginURL', 'URL', 'VPC'])
+
+    def test_fleet_instances_only_take_http_from_the_load_balancer(self):
+        template = render(fleet=provision.fleet_config(), cdn=self.cdn)
+        resources = template['Resources']
+
+        self.assertEqual(self.http_ingress(resources['SecurityGroup']), [])
+        self.assertEqual(resources['WebServerLoadBalancerIngress']['Properties'], {
+            'GroupId': {'Ref': 'SecurityGroup'}, 'IpProtocol': 'tcp',
+            'FromPort': '80', 'ToPort': '80',
+            'SourceSecurityGroupId': {'Ref': 'LoadBalancerSecurityGroup'}})
+        self.assertEqual(self.http_ingress(resources['LoadBalancerSecurityGroup']), [{
+            'IpProtocol': 'tcp', 'FromPort': '80', 'ToPort': '80',
+            'SourcePrefixListId': 'pl-3b927c52'}])
+        self.assertEqual(template['Outputs']['URL']['Value'], {'Fn::Join': ['', [
+            'http://', {'Fn::GetAtt': ['CdnDistribution', 'DomainName']}]]})
+        self.assertEqual(template['Outputs']['OriginURL']['Value'], {'Fn::Join': ['', [
+            'http://', {'Fn::GetAtt': ['LoadBalancer', 'DNSName']}]]})
+
+    def test_without_a_cdn_the_web_server_is_open_and_has_no_origin_url(self):
+        template = render()
+
+        self.assertEqual([rule['CidrIp'] for rule in
+                          self.http_ingress(template['Resources']['SecurityGroup'])],
+                         ['0.0.0.0/0'])
+        self.assertEqual(sorted(template['Outputs']), ['URL', 'VPC'])
+
+
+class NetworkStackTest(unittest.TestCase):
+
+    def test_network_template_exports_the_network(self):
+        template = json.loads(provision.create_network_template(zone_count=3).to_json())
+        resources = template['Resources']
+
+        self.assertEqual(dict((name, output['Export']['Name']['Fn::Sub'])
+                              for name, output in template['Outputs'].items()), {
+            'VPC': '${AWS::StackName}-VPC',
+            'Subnet1': '${AWS::StackName}-Subnet1',
+            'Subnet2': '${AWS::StackName}-Subnet2',
+            'Subnet3': '${AWS::StackName}-Subnet3',
+            'SecurityGroup': '${AWS::StackName}-SecurityGroup'})
+        self.assertEqual(template['Outputs']['SecurityGroup']['Value'],
+                         {'Ref': 'SecurityGroup'})
+        self.assertEqual(resources['Route']['Properties']['GatewayId'],
+                         {'Ref': 'InternetGateway'})
+        self.assertEqual(resources['Route']['DependsOn'], 'AttachGateway')
+        self.assertNotIn('WebServerInstance', resources)
+
+    def test_web_tier_only_imports_the_network(self):
+        template = render(network_stack='shared')
+        resources = template['Resources']
+
+        self.assertEqual(sorted(resources), ['WebServerInstance'])
+        interface = resources['WebServerInstance']['Properties']['NetworkInterfaces'][0]
+        self.assertEqual(interface['GroupSet'], [{'Fn::ImportValue': 'shared-SecurityGroup'}])
+        self.assertEqual(interface['SubnetId'], {'Fn::ImportValue': 'shared-Subnet1'})
+        self.assertEqual(template['Outputs']['VPC']['Value'],
+                         {'Fn::ImportValue': 'shared-VPC'})
+
+    def test_web_tier_fleet_imports_a_subnet_per_zone(self):
+        resources = render(network_stack='shared',
+                           fleet=provision.fleet_config(zone_count=3))['Resources']
+
+        self.assertFalse([name for name, resource in resources.items()
+                          if resource['Type'].startswith('AWS::EC2::') and
+                          resource['Type'] not in ('AWS::EC2::LaunchTemplate',
+                                                   'AWS::EC2::SecurityGroup')])
+        self.assertEqual(resources['WebServerGroup']['Properties']['VPCZoneIdentifier'],
+                         [{'Fn::ImportValue': 'shared-Subnet%d' % zone} for zone in [1, 2, 3]])
+        self.assertEqual(resources['LoadBalancerSecurityGroup']['Properties']['VpcId'],
+                         {'Fn::ImportValue': 'shared-VPC'})
+        self.assertNotIn('DependsOn', resources['WebServerGroup'])
+
+
+class InstancePropertiesTest(unittest.TestCase):
+
+    def test_t2_keeps_its_own_credit_option_and_gets_a_gp3_root_volume(self):
+        properties = render('t2.micro')['Resources']['WebServerInstance']['Properties']
+
+        self.assertNotIn('CreditSpecification', properties)
+        self.assertNotIn('EbsOptimized', properties)
+        self.assertEqual(properties['BlockDeviceMappings'], [{
+            'DeviceName': '/dev/xvda',
+            'Ebs': {'VolumeType': 'gp3', 'VolumeSize': 8, 'Iops': 3000, 'Throughput': 125,
+                    'DeleteOnTermination': 'true'}}])
+
+    def test_applies_the_chosen_options(self):
+        instance = provision.instance_options('t3.large', root_volume_size=20,
+                                              root_volume_iops=6000, cpu_credits='unlimited',
+                                              placement_strategy='spread')
+        template = render('t3.large', instance=instance)
+        properties = template['Resources']['WebServerInstance']['Properties']
+
+        self.assertEqual(properties['CreditSpecification'], {'CPUCredits': 'unlimited'})
+        self.assertEqual(properties['EbsOptimized'], 'true')
+        self.assertEqual(properties['BlockDeviceMappings'][0]['Ebs']['Iops'], 6000)
+        self.assertEqual(properties['PlacementGroupName'], {'Ref': 'WebServerPlacementGroup'})
+        self.assertEqual(template['Resources']['WebServerPlacementGroup']['Properties'],
+                         {'Strategy': 'spread'})
+
+    def test_rejects_options_the_type_cannot_use(self):
+        self.assertRaises(ValueError, provision.instance_options, 'm5.large',
+                          cpu_credits='unlimited')
+        self.assertRaises(ValueError, provision.instance_options, 't3.micro',
+                          root_volume_size=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
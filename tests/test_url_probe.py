@@ -0,0 +1,42 @@
+import unittest
+from StringIO import StringIO
+
+from tests.fakes import FakeClock
+from url_probe import probe_url
+
+
+class ProbeUrlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.responses = []
+
+    def opener(self, pages):
+        pages = list(pages)
+
+        def open_url(url, timeout=None):
+            self.responses.append(StringIO(pages.pop(0)))
+            return self.responses[-1]
+        return open_url
+
+    def test_closes_every_response(self):
+        result = probe_url('http://example.com/', 'Hello', clock=self.clock,
+                           sleep=self.clock.sleep,
+                           opener=self.opener(['Loading', 'Hello World']))
+
+        self.assertTrue(result.ready)
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual([response.closed for response in self.responses], [True, True])
+
+    def test_gives_up_after_the_timeout(self):
+        result = probe_url('http://example.com/', 'Hello', timeout=1.0,
+                           clock=self.clock, sleep=self.clock.sleep,
+                           opener=self.opener(['Loading'] * 3))
+
+        self.assertFalse(result.ready)
+        self.assertEqual(result.error, 'page did not contain "Hello"')
+        self.assertTrue(all(response.closed for response in self.responses))
+
+
+if __name__ == '__main__':
+    unittest.main()
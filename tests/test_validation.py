@@ -0,0 +1,153 @@
+import StringIO
+import sys
+import unittest
+
+import botocore.session
+from botocore.stub import Stubber
+
+import test_awscloud_webserver_env as validation
+
+RUNNING = {'Name': 'instance-state-name', 'Values': ['running']}
+LIVE = {'Name': 'instance-state-name', 'Values': validation.LIVE_INSTANCE_STATES}
+WEB_SERVER_SG = {'Name': 'description', 'Values': ['Web Server SG']}
+
+
+def ec2_client():
+    """ Return an EC2 client for stubbing; building one is slow, so tests share it """
+
+    return botocore.session.get_session().create_client(
+        'ec2', region_name='us-east-1', aws_access_key_id='id', aws_secret_access_key='secret')
+
+
+def fleet_instance(instance_id, group_ids, state='running'):
+    """ Return a describe_instances Instance with the Security Groups attached """
+
+    return {'InstanceId': instance_id,
+            'State': {'Name': state},
+            'PublicIpAddress': '203.0.113.%s' % instance_id[2:],
+            'Placement': {'AvailabilityZone': 'us-east-1a'},
+            'SecurityGroups': [{'GroupId': group_id, 'GroupName': group_id}
+                               for group_id in group_ids]}
+
+
+class ValidateSecurityGroupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = ec2_client()
+
+    def setUp(self):
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+        self.saved = validation.aws_session.get_client
+        validation.aws_session.get_client = lambda service, region, id, secret: \
+            self.client
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        validation.aws_session.get_client = self.saved
+
+    def add_instances(self, instances):
+        self.stubber.add_response('describe_instances', {'Reservations': [
+            {'Instances': instances}]}, {'Filters': [{
+                'Name': 'tag:Name', 'Values': [validation.WEBSERVER_NAME]}, RUNNING]})
+
+    def test_only_describes_the_security_groups_of_the_instance(self):
+        self.add_instances([{'InstanceId': 'i-1', 'SecurityGroups': [
+            {'GroupId': 'sg-1', 'GroupName': 'web'}, {'GroupId': 'sg-2', 'GroupName': 'other'}]}])
+        self.stubber.add_response('describe_security_groups', {'SecurityGroups': [{
+            'GroupId': 'sg-1',
+            'IpPermissions': [{'IpProtocol': 'tcp', 'FromPort': 80, 'ToPort': 80},
+                              {'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22}]
+        }]}, {'GroupIds': ['sg-1', 'sg-2'],
+              'Filters': [{'Name': 'description', 'Values': ['Web Server SG']}]})
+
+        self.assertEqual(validation.validate_securitygroup('id', 'secret', 'us-east-1'),
+                         [])
+        self.stubber.assert_no_pending_responses()
+
+    def test_searches_the_account_without_an_instance(self):
+        self.add_instances([])
+        self.stubber.add_response('describe_security_groups', {'SecurityGroups': []}, {
+            'Filters': [{'Name': 'description', 'Values': ['Web Server SG']}]})
+
+        self.assertEqual(validation.validate_securitygroup('id', 'secret', 'us-east-1'),
+                         ['Could not find expected Security Group',
+                          'Could not find expected Web Server EC2 Instance'])
+
+
+class ValidateFleetTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = ec2_client()
+
+    def setUp(self):
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+        self.saved = validation.aws_session.get_client, sys.stdout
+        validation.aws_session.get_client = lambda service, region, id, secret: \
+            self.client
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        validation.aws_session.get_client, sys.stdout = self.saved
+
+    def add_stack_instances(self, instances):
+        self.stubber.add_response('describe_instances', {'Reservations': [
+            {'Instances': instances}]}, {'Filters': [{
+                'Name': 'tag:aws:cloudformation:stack-name', 'Values': ['webserver']}, LIVE],
+                'MaxResults': 100})
+
+    def test_finds_the_security_group_among_the_instances_own(self):
+        self.add_stack_instances([fleet_instance('i-1', ['sg-1', 'sg-ssh']),
+                                  fleet_instance('i-2', ['sg-1'])])
+        # Another environment's Web Server Security Group is not a candidate
+        self.stubber.add_response('describe_security_groups', {'SecurityGroups': [
+            {'GroupId': 'sg-1'}]}, {'GroupIds': ['sg-1', 'sg-ssh'], 'Filters': [WEB_SERVER_SG]})
+
+        failures = validation.validate_fleet('id', 'secret', 'us-east-1', 'webserver',
+                                             samples=0)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(failures, [])
+        self.assertIn('2 of 2 Instances passed', sys.stdout.getvalue())
+
+    def test_reports_instances_without_the_security_group(self):
+        self.add_stack_instances([fleet_instance('i-1', ['sg-1']),
+                                  fleet_instance('i-2', ['sg-other']),
+                                  fleet_instance('i-3', ['sg-1'], state='stopped')])
+        self.stubber.add_response('describe_security_groups', {'SecurityGroups': [
+            {'GroupId': 'sg-1'}]}, {'GroupIds': ['sg-1', 'sg-other'],
+                                    'Filters': [WEB_SERVER_SG]})
+
+        failures = validation.validate_fleet('id', 'secret', 'us-east-1', 'webserver',
+                                             samples=0)
+
+        self.assertEqual(failures, ['Instance i-2 does not have Security Group sg-1 attached',
+                                    'Instance i-3 is stopped'])
+
+    def test_looks_up_recorded_resources_by_id(self):
+        state = {'resources': {'SecurityGroup': {'physical_id': 'sg-1'},
+                               'WebServerGroup': {'physical_id': 'webserver-group'}}}
+        self.stubber.add_response('describe_instances', {'Reservations': [{'Instances': [
+            fleet_instance('i-1', ['sg-1'])]}]}, {'Filters': [{
+                'Name': 'tag:aws:autoscaling:groupName', 'Values': ['webserver-group']}, LIVE],
+                'MaxResults': 100})
+
+        failures = validation.validate_fleet('id', 'secret', 'us-east-1', 'webserver',
+                                             state=state, samples=0)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(failures, [])
+
+    def test_reports_a_stack_without_instances(self):
+        self.add_stack_instances([])
+
+        self.assertEqual(validation.validate_fleet('id', 'secret', 'us-east-1', 'webserver'),
+                         ['Could not find any Web Server EC2 Instances for Stack "webserver"'])
+
+
+if __name__ == '__main__':
+    unittest.main()
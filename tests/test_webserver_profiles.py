@@ -0,0 +1,85 @@
+import unittest
+
+from webserver_profiles import (render_user_data, mpm_settings, INDEX_HTML,
+                                MAX_REQUEST_WORKERS, USER_DATA)
+
+
+class RenderUserDataTest(unittest.TestCase):
+
+    def test_default_profile_installs_updates_and_starts_httpd(self):
+        self.assertEqual(render_user_data(), USER_DATA)
+        self.assertEqual(render_user_data(), [
+            '#!/bin/bash -x',
+            'yum install httpd -y',
+            'yum update -y',
+            'echo "%s" > /var/www/html/index.html' % INDEX_HTML,
+            'systemctl start httpd',
+            'systemctl enable httpd'
+        ])
+
+    def test_performance_profile_tunes_the_kernel_and_httpd_before_starting_it(self):
+        lines = render_user_data('performance', 'm5.large')
+
+        self.assertEqual(lines[:3], ['#!/bin/bash -x', 'yum install httpd -y',
+                                     'yum update -y'])
+        for line in ['sysctl -p /etc/sysctl.d/99-webserver.conf',
+                     'LimitNOFILE=65535',
+                     'systemctl daemon-reload',
+                     'LoadModule mpm_event_module modules/mod_mpm_event.so',
+                     '    MaxRequestWorkers 400',
+                     'KeepAlive On']:
+            self.assertIn(line, lines)
+        self.assertLess(lines.index('systemctl daemon-reload'),
+                        lines.index('systemctl start httpd'))
+        self.assertEqual(lines[-3:], ['echo "%s" > /var/www/html/index.html' % INDEX_HTML,
+                                      'systemctl start httpd', 'systemctl enable httpd'])
+
+    def test_defer_update_moves_the_update_into_the_background(self):
+        for profile in ['default', 'performance']:
+            lines = render_user_data(profile, 't3.micro', defer_update=True,
+                                     signal_resource='WebServerInstance')
+
+            self.assertNotIn('yum update -y', lines)
+            self.assertEqual(lines[-1], 'nohup yum update -y > /var/log/yum-update.log 2>&1 &')
+            self.assertLess(lines.index('systemctl start httpd'),
+                            lines.index(lines[-1]))
+
+    def test_only_the_signal_line_needs_substitution(self):
+        for profile in ['default', 'performance']:
+            lines = render_user_data(profile, 'c5.large', signal_resource='WebServerGroup')
+            substituted = [line for line in lines if '${' in line]
+
+            self.assertEqual(substituted, [
+                '/opt/aws/bin/cfn-signal -e $ready --stack ${AWS::StackName} '
+                '--resource WebServerGroup --region ${AWS::Region}'])
+            self.assertLess(lines.index('yum install aws-cfn-bootstrap -y'),
+                            lines.index(substituted[0]))
+        self.assertEqual([line for line in render_user_data('performance', 'c5.large')
+                          if '${' in line], [])
+
+    def test_rejects_unknown_profiles(self):
+        self.assertRaises(ValueError, render_user_data, 'fast')
+
+
+class MpmSettingsTest(unittest.TestCase):
+
+    def test_max_request_workers_is_a_multiple_of_threads_per_child(self):
+        for type_instance in ['t2.nano', 't3.micro', 'm5.large', 'c4.8xlarge', 'm5.12xlarge',
+                              'm6i.32xlarge']:
+            settings = dict(mpm_settings(type_instance))
+
+            self.assertEqual(settings['MaxRequestWorkers'] % settings['ThreadsPerChild'], 0)
+            self.assertEqual(settings['ServerLimit'] * settings['ThreadsPerChild'],
+                             settings['MaxRequestWorkers'])
+            self.assertLessEqual(settings['StartServers'], settings['ServerLimit'])
+
+    def test_caps_max_request_workers_for_large_types(self):
+        self.assertEqual(dict(mpm_settings('t2.micro'))['MaxRequestWorkers'], 200)
+        self.assertEqual(dict(mpm_settings('m5.4xlarge'))['MaxRequestWorkers'], 3200)
+        for type_instance in ['m5.24xlarge', 'c5.18xlarge', 'm6i.32xlarge']:
+            self.assertEqual(dict(mpm_settings(type_instance))['MaxRequestWorkers'],
+                             MAX_REQUEST_WORKERS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import httplib
+import socket
+import time
+import urllib2
+from contextlib import closing
+
+
+class ProbeResult(object):
+    """ Outcome of probing a URL until it served the expected content """
+
+    def __init__(self, ready, attempts, elapsed, first_byte, error=None):
+        self.ready = ready
+        self.attempts = attempts
+        # Seconds from the start of probing until the successful response
+        self.elapsed = elapsed
+        # Seconds from sending the successful request until its first byte
+        self.first_byte = first_byte
+        self.error = error
+
+
+def probe_url(url, expected_text, timeout=900.0, min_interval=0.5, max_interval=10.0,
+              backoff_factor=2.0, request_timeout=10.0, clock=time.time, sleep=time.sleep,
+              opener=urllib2.urlopen):
+    """ Fetch the URL with backoff until its page contains the expected text
+
+    Retries quickly at first (DNS for a new load balancer or an Elastic IP can
+    take a moment to become reachable) and backs off up to max_interval.
+    Returns a ProbeResult; gives up once timeout seconds have passed.
+    """
+
+    started = clock()
+    interval = min_interval
+    attempts = 0
+    error = None
+    while True:
+        attempts += 1
+        sent = clock()
+        try:
+            with closing(opener(url, timeout=request_timeout)) as response:
+                first_chunk = response.read(1)
+                first_byte = clock() - sent
+                body = first_chunk + response.read()
+            if expected_text in body:
+                return ProbeResult(True, attempts, clock() - started, first_byte)
+            error = 'page did not contain "%s"' % expected_text
+        except (urllib2.URLError, httplib.HTTPException, socket.error), err:
+            error = str(err)
+
+        if clock() - started + interval > timeout:
+            return ProbeResult(False, attempts, clock() - started, None, error)
+        sleep(interval)
+        interval = min(interval * backoff_factor, max_interval)
@@ -0,0 +1,187 @@
+from instance_types import instance_capabilities
+
+
+# Web server profiles that can be selected for the instance UserData
+PROFILES = ['default', 'performance']
+
+INDEX_HTML = '<html><h1>Automation for the People</h1></html>'
+
+# Commands run by the Web Server Instance (Amazon Linux 2023, where yum is
+#     dnf and services are systemd units) on first boot with the default profile
+USER_DATA = [
+    '#!/bin/bash -x',
+    'yum install httpd -y',
+    'yum update -y',
+    'echo "%s" ' % INDEX_HTML + \
+    '> /var/www/html/index.html',
+    'systemctl start httpd',
+    'systemctl enable httpd'
+]
+
+# Seconds the instance waits for httpd to serve the page before signalling failure
+LOCAL_READY_TIMEOUT = 300
+LOCAL_READY_INTERVAL = 2
+
+# Event MPM threads per httpd child process, and request workers per vCPU
+THREADS_PER_CHILD = 25
+WORKERS_PER_VCPU = 200
+MAX_REQUEST_WORKERS = 4000
+
+# Open file limit for httpd, and the kernel settings that go with it
+NOFILE_LIMIT = 65535
+SYSCTL_SETTINGS = [
+    ('fs.file-max', '2097152'),
+    ('net.core.somaxconn', '4096'),
+    ('net.core.netdev_max_backlog', '4096'),
+    ('net.ipv4.tcp_max_syn_backlog', '4096'),
+    ('net.ipv4.ip_local_port_range', '1024 65535'),
+    ('net.ipv4.tcp_fin_timeout', '15'),
+    ('net.ipv4.tcp_tw_reuse', '1'),
+    ('net.ipv4.tcp_slow_start_after_idle', '0')
+]
+
+def instance_vcpus(type_instance):
+    """ Return the vCPU count of an instance type from the capability table
+
+    Raises UnsupportedInstanceType for a type that is not in the table.
+    """
+
+    return instance_capabilities(type_instance).vcpus
+
+
+def mpm_settings(type_instance):
+    """ Return the event MPM limits sized to the instance type """
+
+    vcpus = instance_vcpus(type_instance)
+    max_request_workers = min(WORKERS_PER_VCPU * vcpus, MAX_REQUEST_WORKERS)
+    # MaxRequestWorkers must be a multiple of ThreadsPerChild
+    max_request_workers -= max_request_workers % THREADS_PER_CHILD
+    server_limit = max_request_workers // THREADS_PER_CHILD
+    return [
+        ('StartServers', min(2 * vcpus, server_limit)),
+        ('ServerLimit', server_limit),
+        ('ThreadsPerChild', THREADS_PER_CHILD),
+        ('MinSpareThreads', THREADS_PER_CHILD),
+        ('MaxSpareThreads', max(THREADS_PER_CHILD * 2 * vcpus, THREADS_PER_CHILD * 3)),
+        ('MaxRequestWorkers', max_request_workers),
+        ('MaxConnectionsPerChild', 0)
+    ]
+
+
+def render_user_data(web_profile='default', type_instance='t2.micro', defer_update=False,
+                     signal_resource=None):
+    """ Return the UserData script lines for a web server profile
+
+    With defer_update the full "yum update" runs in the background once httpd
+    is already serving, rather than on the boot critical path.
+
+    With signal_resource the script waits until httpd serves the page locally
+    and then reports the result to that resource's CreationPolicy with
+    cfn-signal.  The signal line refers to ${AWS::StackName} and
+    ${AWS::Region}, so the script must then be wrapped in Fn::Sub (and no
+    other line may contain "${").
+    """
+
+    if web_profile not in PROFILES:
+        raise ValueError('Unknown web server profile "%s"' % web_profile)
+
+    if web_profile == 'default':
+        lines = list(USER_DATA)
+        if defer_update:
+            lines.remove('yum update -y')
+    else:
+        lines = ['#!/bin/bash -x'] + _performance_install_lines()
+        if not defer_update:
+            lines.append('yum update -y')
+        lines += _performance_kernel_lines() + \
+            _performance_httpd_lines(type_instance) + \
+            [
+                'echo "%s" ' % INDEX_HTML + \
+                '> /var/www/html/index.html',
+                'systemctl start httpd',
+                'systemctl enable httpd'
+            ]
+
+    if signal_resource is not None:
+        lines += _ready_signal_lines(signal_resource)
+    if defer_update:
+        lines.append('nohup yum update -y > /var/log/yum-update.log 2>&1 &')
+    return lines
+
+
+def _ready_signal_lines(signal_resource):
+    attempts = LOCAL_READY_TIMEOUT // LOCAL_READY_INTERVAL
+    return [
+        # Provides cfn-signal, in case the AMI does not already have it
+        'yum install aws-cfn-bootstrap -y',
+        'ready=1',
+        'for attempt in $(seq 1 %d); do' % attempts,
+        '    if curl -sf http://localhost/ | grep -q "Automation for the People"; then',
+        '        ready=0',
+        '        break',
+        '    fi',
+        '    sleep %d' % LOCAL_READY_INTERVAL,
+        'done',
+        '/opt/aws/bin/cfn-signal -e $ready --stack ${AWS::StackName} '
+        '--resource %s --region ${AWS::Region}' % signal_resource
+    ]
+
+
+def _performance_install_lines():
+    return ['yum install httpd -y']
+
+
+def _performance_kernel_lines():
+    sysctl_conf = ['%s = %s' % setting for setting in SYSCTL_SETTINGS]
+    return [
+        "cat > /etc/sysctl.d/99-webserver.conf <<'EOF'"
+    ] + sysctl_conf + [
+        'EOF',
+        'sysctl -p /etc/sysctl.d/99-webserver.conf',
+        "cat > /etc/security/limits.d/99-httpd.conf <<'EOF'",
+        'apache soft nofile %d' % NOFILE_LIMIT,
+        'apache hard nofile %d' % NOFILE_LIMIT,
+        'root soft nofile %d' % NOFILE_LIMIT,
+        'root hard nofile %d' % NOFILE_LIMIT,
+        'EOF',
+        # systemd does not apply limits.d to services, so httpd needs a drop-in
+        'mkdir -p /etc/systemd/system/httpd.service.d',
+        "cat > /etc/systemd/system/httpd.service.d/limits.conf <<'EOF'",
+        '[Service]',
+        'LimitNOFILE=%d' % NOFILE_LIMIT,
+        'EOF',
+        'systemctl daemon-reload'
+    ]
+
+
+def _performance_httpd_lines(type_instance):
+    mpm_conf = ['    %s %s' % setting for setting in mpm_settings(type_instance)]
+    return [
+        # Switch from the prefork MPM to the event MPM
+        "cat > /etc/httpd/conf.modules.d/00-mpm.conf <<'EOF'",
+        'LoadModule mpm_event_module modules/mod_mpm_event.so',
+        'EOF',
+        "cat > /etc/httpd/conf.d/zz-performance.conf <<'EOF'",
+        '<IfModule mpm_event_module>'
+    ] + mpm_conf + [
+        '</IfModule>',
+        'ListenBacklog 4096',
+        'KeepAlive On',
+        'MaxKeepAliveRequests 1000',
+        'KeepAliveTimeout 5',
+        'HostnameLookups Off',
+        'EnableSendfile On',
+        'FileETag MTime Size',
+        '<IfModule mod_deflate.c>',
+        '    AddOutputFilterByType DEFLATE text/html text/plain text/css '
+        'application/javascript application/json image/svg+xml',
+        '</IfModule>',
+        '<IfModule mod_expires.c>',
+        '    ExpiresActive On',
+        '    ExpiresDefault "access plus 5 minutes"',
+        '    ExpiresByType text/css "access plus 1 day"',
+        '    ExpiresByType application/javascript "access plus 1 day"',
+        '    ExpiresByType image/png "access plus 1 week"',
+        '</IfModule>',
+        'EOF'
+    ]